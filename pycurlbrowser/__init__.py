@@ -1,4 +1,10 @@
 from .version import __version__
 from .browser import Browser
-from .backend import RequestsBackend, CurlBackend, MockBackend, MockResponse #, BasicAuth, DigestAuth, OpenAuth
+from .async_browser import AsyncBrowser, SessionLoop
+from .crawler import Crawler, Frontier, BloomFilter
+from .pool import BrowserPool, PoolExhausted
+from .prefetch import Prefetcher
+from .backend import RequestsBackend, CurlBackend, CurlSharedState, CurlMultiBackend, MockBackend, MockResponse, CachingBackend, MemoryCache, DirectoryCache, Cassette, RecordingBackend, ReplayBackend, HedgePolicy, RetryPolicy, RetryBudget, CoalescingBackend, SingleFlight #, BasicAuth, DigestAuth, OpenAuth
+from .hooks import hooks, Hooks, RequestStats
 from .rest_client import RestClient, RestClientJson
+from .codec import JsonCodec, FastJsonCodec, MsgpackCodec
@@ -0,0 +1,257 @@
+# coding: utf-8
+
+"""
+Non-blocking browsing: many Browser sessions driven from one loop.
+
+A session is a generator that yields whatever AsyncBrowser.go (and so
+form_submit and follow_link) returns, and is resumed with the HTTP response
+code once that request completes, e.g.
+
+    def session(browser):
+        yield browser.go('http://example.com/login')
+        browser.form_select(0)
+        browser.form_data_update(user='me')
+        code = yield browser.form_submit()
+
+    backend = CurlMultiBackend(concurrency=100)
+    loop = SessionLoop(backend)
+    for _ in range(1000):
+        loop.spawn(session(AsyncBrowser(backend=backend)))
+    loop.run()
+"""
+
+import sys
+from .browser import Browser, FeedParser
+
+class Pending(object):
+
+    """
+    A request started by AsyncBrowser; yield it from a session to wait for it
+    """
+
+    def __init__(self):
+        self.done = False
+        self.resp = None
+        self._waiters = []
+
+    def complete(self, resp):
+        """Record the Response and wake anything waiting on it"""
+        self.done = True
+        self.resp = resp
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter()
+
+    def wait(self, waiter):
+        """Call waiter once complete; immediately, if it already is"""
+        if self.done:
+            waiter()
+        else:
+            self._waiters.append(waiter)
+
+class AsyncBrowser(Browser):
+
+    """
+    A Browser whose requests don't block.
+
+    The backend must implement AsyncHttpBackend, and may be shared between
+    any number of AsyncBrowsers. Page state is held per browser.
+    """
+
+    def __init__(self, backend=None):
+        self._resp = None
+        super(AsyncBrowser, self).__init__(backend=backend)
+
+    def _default_backend(self):
+        """Create a backend for this browser alone"""
+        from .backend import CurlMultiBackend
+        return CurlMultiBackend()
+
+    def go(self,
+           url,
+           method='GET',
+           data=None,
+           headers=None,
+           auth=None,
+           follow=None,
+           agent=None,
+           retries=None,
+           debug=None,
+           sink=None):
+        """Start going to a url, return a Pending"""
+        pending = Pending()
+
+        request = self._request(url, method, data, headers, auth, sink)
+        self.hooks.fire('before_request',
+                        browser=self,
+                        url=request['url'],
+                        method=request['method'])
+
+        feed = None
+        if self.parse_incrementally and sink is None:
+            feed = request['sink'] = FeedParser()
+            self.hooks.fire('parse_start', browser=self, url=request['url'])
+
+        def callback(resp):
+            """Closure to update the page state on completion"""
+            self.hooks.fire('after_response',
+                            browser=self,
+                            url=resp.url,
+                            method=request['method'],
+                            http_code=resp.http_code,
+                            roundtrip=resp.roundtrip,
+                            timing=resp.timing,
+                            exception=resp.exception,
+                            served=False,
+                            cached=False)
+            if resp.exception is None:
+                self._resp = resp
+                self._reset_state()
+                self._src = None
+                self._served = None
+                if feed is not None:
+                    self._src = feed.src
+                    self._tree = feed.close()
+                    if self._tree is not None:
+                        self._prepare_tree()
+                        self._record_parse(feed.parse_time)
+                    self.hooks.fire('parse_end',
+                                    browser=self,
+                                    url=resp.url,
+                                    parse_time=feed.parse_time)
+            pending.complete(resp)
+
+        self.backend.start(request,
+                           follow=follow or self.follow,
+                           agent=agent or self.agent,
+                           retries=retries or self.retries,
+                           debug=debug or self.debug,
+                           callback=callback)
+
+        return pending
+
+    @property
+    def http_code(self):
+        """Read-only last HTTP response code"""
+        return self._resp.http_code
+
+    @property
+    def src(self):
+        """Read-only page-source"""
+        if self._src is not None:
+            return self._src
+        return self._resp.src
+
+    @property
+    def content(self):
+        """Read-only page body as bytes, or None if it was streamed"""
+        if self._src is not None:
+            return self._src
+        return self._resp.content
+
+    @property
+    def url(self):
+        """Read-only current URL"""
+        return self._resp.url
+
+    @property
+    def roundtrip(self):
+        """Read-only request roundtrip timing"""
+        return self._resp.roundtrip
+
+    @property
+    def headers(self):
+        """Read-only headers dict"""
+        return self._resp.headers
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing, with parse time"""
+        return self._resp.timing
+
+class Session(object):
+
+    """
+    A session generator being driven by a SessionLoop
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.done = False
+        self.exception = None
+        self._exc_info = None
+
+class SessionLoop(object):
+
+    """
+    Drive session generators, polling an AsyncHttpBackend for their requests
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._running = set()
+        self._failed = [] # sessions that raised, not yet reported by run()
+
+    def spawn(self, generator):
+        """Start a session, running it up to its first request"""
+        session = Session(generator)
+        self._running.add(session)
+        self._step(session, lambda: session.generator.next())
+        return session
+
+    @staticmethod
+    def _resumer(session, pending):
+        """How to resume a session with the outcome of a completed request"""
+        if pending.resp.exception is not None:
+            return lambda: session.generator.throw(pending.resp.exception)
+        return lambda: session.generator.send(pending.resp.http_code)
+
+    def _step(self, session, resume):
+        """
+        Resume a session and wait on whatever it yields next, carrying on
+        for as long as what it yields has already completed
+        """
+        while True:
+            try:
+                pending = resume()
+            except StopIteration:
+                self._stop(session)
+                return
+            except Exception, ex:
+                self._stop(session, ex, sys.exc_info())
+                return
+
+            if not isinstance(pending, Pending):
+                error = TypeError("Sessions must yield a Pending, not %r" % pending)
+                resume = lambda: session.generator.throw(error)
+            elif pending.done:
+                resume = self._resumer(session, pending)
+            else:
+                break
+
+        pending.wait(lambda: self._step(session, self._resumer(session, pending)))
+
+    def _stop(self, session, exception=None, exc_info=None):
+        """Mark a session as finished"""
+        session.done = True
+        session.exception = exception
+        session._exc_info = exc_info
+        self._running.discard(session)
+        if exception is not None:
+            self._failed.append(session)
+
+    def run(self, timeout=1.0):
+        """
+        Run until every session has finished, then raise the first uncaught
+        exception of any session that failed (each is also kept on its
+        Session)
+        """
+        while self._running:
+            if self.backend.poll(timeout) == 0 and self._running:
+                raise RuntimeError("Sessions are waiting on requests that " +
+                                   "this loop's backend does not know about")
+
+        if self._failed:
+            failed, self._failed = self._failed, []
+            exc_type, exc_value, traceback = failed[0]._exc_info
+            raise exc_type, exc_value, traceback
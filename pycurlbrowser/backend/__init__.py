@@ -1,5 +1,19 @@
-from .base import HttpBackend
+from .base import HttpBackend, AsyncHttpBackend, Response
+from .util import Headers
 #from .auth import BasicAuth, DigestAuth, OpenAuth
 from .mock import MockBackend, MockResponse
-from .curl import CurlBackend
+from .curl import CurlBackend, CurlSharedState
+from .curl_multi import CurlMultiBackend
+from .hedge import HedgePolicy
+from .retry import RetryPolicy, RetryBudget, retry_budget
 from .req import RequestsBackend
+from .cache import CachingBackend, MemoryCache, DirectoryCache
+from .cassette import Cassette, RecordingBackend, ReplayBackend
+from .coalesce import CoalescingBackend, SingleFlight
+
+def default_backend():
+    """Create the preferred backend available: Requests, otherwise curl"""
+    try:
+        return RequestsBackend()
+    except ImportError:
+        return CurlBackend()
@@ -1,12 +1,135 @@
 # coding: utf-8
 
+from ..hooks import hooks
+from .util import Headers
+from .retry import RetryPolicy
+
+def request_args(request):
+    """
+    Normalise a request for go_many: either a URL string or a dict containing
+    at least 'url', and optionally 'method', 'data', 'headers', 'auth' and
+    'sink'.
+    """
+    if isinstance(request, basestring):
+        request = dict(url=request)
+
+    return dict(url=request['url'],
+                method=request.get('method', 'GET').upper(),
+                data=request.get('data'),
+                headers=request.get('headers'),
+                auth=request.get('auth'),
+                sink=request.get('sink'))
+
+def sink_writer(sink):
+    """
+    Make a function that passes each chunk of a streamed body on to a sink:
+    anything with a write() method, a primed generator (chunks are sent to
+    it), or a callable.
+    """
+    for name in ('write', 'send'):
+        if hasattr(sink, name):
+            sink = getattr(sink, name)
+            break
+
+    def write(chunk):
+        """Closure to hide the sink's return value, which curl would check"""
+        sink(chunk)
+
+    return write
+
+class Response(object):
+
+    """
+    A completed request, exposing the same read-only values as HttpBackend,
+    as returned by go(). content is the body as bytes, where src may be
+    decoded text, by decode on first reading if given, from the charset
+    (None where src is the bytes themselves); headers are Headers; history
+    holds a Response for each redirect followed on the way, oldest first.
+    """
+
+    def __init__(self, src=None, url=None, http_code=None, headers=None,
+                 roundtrip=None, timing=None, exception=None, history=None,
+                 content=None, decode=None, charset=None):
+        self._src = src
+        self._decode = decode
+        self.charset = charset
+        self.url = url
+        self.http_code = http_code
+        self.headers = headers if headers is None or \
+                                  isinstance(headers, Headers) \
+                               else Headers(headers)
+        self.roundtrip = roundtrip
+        self.timing = timing
+        self.exception = exception
+        self.history = history or []
+        self._content = content
+
+    @property
+    def src(self):
+        """The page-source, or None if it was streamed"""
+        if self._decode is not None:
+            self._src, self._decode = self._decode(), None
+        return self._src
+
+    @src.setter
+    def src(self, src):
+        """Replace the page-source"""
+        self._src = src
+        self._decode = None
+
+    @property
+    def content(self):
+        """The body as bytes, or None if it was streamed"""
+        if self._content is None and isinstance(self.src, unicode):
+            self._content = self.src.encode('utf-8')
+        return self._content if self._content is not None else self.src
+
+    @content.setter
+    def content(self, content):
+        """Replace the body bytes"""
+        self._content = content
+
+    def decode_content(self):
+        """
+        Have src decoded from content on first reading, from charset where
+        there is one, or else be the bytes themselves
+        """
+        content, charset = self.content, self.charset
+
+        def decode():
+            """Closure to decode the body as its backend would have"""
+            if content is None or charset is None:
+                return content
+            try:
+                return content.decode(charset, 'replace')
+            except LookupError:
+                return content # a charset Python doesn't know
+
+        self._src, self._decode = None, decode
+
+    @classmethod
+    def from_backend(cls, backend):
+        """Take a copy of the last request made by a backend"""
+        return cls(src=backend.src,
+                   url=backend.url,
+                   http_code=backend.http_code,
+                   headers=backend.headers,
+                   roundtrip=backend.roundtrip,
+                   timing=backend.timing)
+
+    def __repr__(self):
+        return "<Response %s %s>" % (self.http_code, self.url)
+
 class HttpBackend(object):
 
     """
     Interface for HTTP backends
     """
 
-    def go(self, url, method, data, headers, auth, follow, agent, retries, debug):
+    hooks = hooks # see pycurlbrowser.hooks; set per instance to observe apart
+    retry_policy = RetryPolicy() # how to retry, given retries; see retry
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
         """
         Visit a URL.
 
@@ -19,11 +142,77 @@ class HttpBackend(object):
             auth:    A two-tuple of user/password
             follow:  Whether to automatically follow 3xx responses
             agent:   User agent to supply
-            retries: Number of times to try the HTTP request
+            retries: Number of times to retry a failed request, as
+                     retry_policy allows
             debug:   Whether to output debug data
+            sink:    Stream the body to this, see sink_writer, leaving src
+                     as None; or None to keep the body in src
+
+        Returns a Response.
         """
         raise NotImplementedError()
 
+    def forget(self):
+        """Forget the last response, so that nothing of it can be read"""
+        self._response = Response()
+
+    def companion(self):
+        """
+        Another backend like this one, for another thread to make requests
+        with alongside it, sharing its cookies; or None if they can't be
+        shared. Call it from the thread using this backend.
+        """
+        return None
+
+    def _like(self, backend):
+        """Give a companion this backend's hooks and retry policy"""
+        backend.hooks = self.hooks
+        backend.retry_policy = self.retry_policy
+        return backend
+
+    def _visit(self, request, follow, agent, retries, debug):
+        """Visit a single request (see request_args), returning a Response"""
+        request = request_args(request)
+        try:
+            resp = self.go(follow=follow,
+                           agent=agent,
+                           retries=retries,
+                           debug=debug,
+                           **request)
+        except Exception, ex:
+            return Response(url=request['url'], exception=ex)
+
+        # backends written before go() returned a Response
+        return resp if resp is not None else Response.from_backend(self)
+
+    def go_as_completed(self, requests, follow, agent, retries, debug,
+                        concurrency=None):
+        """
+        Visit many URLs, yielding (index, Response) pairs as each completes.
+
+        Requests are as accepted by request_args. Failures do not abort the
+        batch; they are yielded as a Response with its exception set. No more
+        than concurrency requests are in flight at once, if given.
+
+        This default implementation visits each URL in turn, with a
+        companion where there is one, so that this backend's current
+        response is kept; backends capable of concurrent transfers should
+        override it.
+        """
+        backend = self.companion() or self
+        for i, request in enumerate(requests):
+            yield i, backend._visit(request, follow, agent, retries, debug)
+
+    def go_many(self, requests, follow, agent, retries, debug,
+                concurrency=None):
+        """Visit many URLs, returning a list of Responses in input order"""
+        return [resp for _, resp in sorted(self.go_as_completed(requests,
+                                                                follow,
+                                                                agent,
+                                                                retries,
+                                                                debug,
+                                                                concurrency))]
+
     @property
     def src(self):
         """Read-only page-source"""
@@ -39,6 +228,11 @@ class HttpBackend(object):
         """Read-only request roundtrip timing"""
         raise NotImplementedError()
 
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing, see util.Timing"""
+        raise NotImplementedError()
+
     @property
     def http_code(self):
         """Read-only last HTTP response code"""
@@ -48,3 +242,31 @@ class HttpBackend(object):
     def headers(self):
         """Read-only headers dict"""
         raise NotImplementedError()
+
+class AsyncHttpBackend(object):
+
+    """
+    Interface for HTTP backends that can make requests without blocking
+    """
+
+    def start(self, request, follow, agent, retries, debug, callback):
+        """
+        Begin a request and return immediately.
+
+        params:
+
+            request:  A URL or dict, as accepted by request_args
+            callback: Called with a Response once the request completes;
+                      always from within poll()
+
+        The other params are as for HttpBackend.go
+        """
+        raise NotImplementedError()
+
+    def poll(self, timeout):
+        """
+        Make progress on started requests, waiting up to timeout seconds for
+        activity, and call back for any that complete. Returns the number of
+        requests still outstanding.
+        """
+        raise NotImplementedError()
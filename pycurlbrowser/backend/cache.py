@@ -0,0 +1,437 @@
+# coding: utf-8
+
+import os
+import time
+import threading
+import cPickle as pickle
+from copy import deepcopy
+from collections import OrderedDict
+from datetime import timedelta
+from email.utils import parsedate_tz, mktime_tz
+from hashlib import sha1
+from .base import HttpBackend, Response
+from .util import Timing, Headers
+
+def header(headers, name):
+    """Case-insensitive header lookup, giving None if absent"""
+    if not headers:
+        return None
+    if isinstance(headers, Headers):
+        return headers.get(name)
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def cache_control(headers):
+    """Parse a Cache-Control header into a dict of directives"""
+    directives = {}
+    for part in (header(headers, 'Cache-Control') or '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+def vary(headers):
+    """Lower-cased names of the request headers a response varies by"""
+    return [name.strip().lower()
+            for name in (header(headers, 'Vary') or '').split(',')
+            if name.strip()]
+
+def http_date(value):
+    """Parse an HTTP date into a timestamp, or None"""
+    parsed = parsedate_tz(value) if value else None
+    return mktime_tz(parsed) if parsed else None
+
+class CacheEntry(object):
+
+    """
+    A stored response, with what's needed to decide whether it's fresh, and
+    the values of the request headers named by its Vary. The body is kept as
+    the bytes received, with the charset its text was decoded from; src is
+    only given where the text can't be decoded again (a guessed charset).
+    """
+
+    def __init__(self, url, http_code, headers, content, roundtrip,
+                 varied=None, charset=None, src=None):
+        self.url = url
+        self.http_code = http_code
+        self.headers = headers
+        self.content = content
+        self.charset = charset
+        self.roundtrip = roundtrip
+        self.varied = varied or {}
+        self._src = src
+        self._tree = None # a parsed tree, kept only in memory
+        self._tree_lock = threading.Lock()
+        self.refresh(headers)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tree'] = None
+        del state['_tree_lock']
+        return state
+
+    def __setstate__(self, state):
+        if 'src' in state: # stored before the bytes were kept
+            src = state.pop('src')
+            state['content'] = src.encode('utf-8') \
+                               if isinstance(src, unicode) else src
+            state['_src'] = src
+        self.__dict__.update(state)
+        self.__dict__.setdefault('varied', {})
+        self.__dict__.setdefault('charset', None)
+        self._tree_lock = threading.Lock()
+
+    @property
+    def src(self):
+        """The page-source, decoded from the body as it was when received"""
+        if self._src is not None or self.content is None:
+            return self._src
+        response = Response(content=self.content, charset=self.charset)
+        response.decode_content()
+        return response.src
+
+    @property
+    def tree(self):
+        """A copy of the parsed tree kept, for its reader alone, or None"""
+        with self._tree_lock:
+            return deepcopy(self._tree) if self._tree is not None else None
+
+    @tree.setter
+    def tree(self, tree):
+        """Keep a parsed tree, which mustn't be changed afterwards"""
+        with self._tree_lock:
+            self._tree = tree
+
+    def refresh(self, headers):
+        """Take on the headers of a fresh response (e.g. a 304)"""
+        fresh = Headers(headers)
+        self.headers = Headers([(name, value) for name, value
+                                in Headers(self.headers).allitems()
+                                if name not in fresh] + fresh.allitems())
+        directives = cache_control(self.headers)
+        now = time.time()
+
+        lifetime = 0
+        if 'no-cache' in directives:
+            lifetime = 0
+        elif directives.get('max-age'):
+            try:
+                lifetime = int(directives['max-age'])
+            except ValueError:
+                pass
+        else:
+            expires = http_date(header(self.headers, 'Expires'))
+            date = http_date(header(self.headers, 'Date')) or now
+            if expires is not None:
+                lifetime = expires - date
+
+        try:
+            age = int(header(self.headers, 'Age') or 0)
+        except ValueError:
+            age = 0
+
+        self.expires = now + lifetime - age
+
+    @property
+    def fresh(self):
+        """Can this be used without asking the server?"""
+        return time.time() < self.expires
+
+    @property
+    def validators(self):
+        """Headers to make the request conditional"""
+        validators = {}
+        etag = header(self.headers, 'ETag')
+        if etag is not None:
+            validators['If-None-Match'] = etag
+        last_modified = header(self.headers, 'Last-Modified')
+        if last_modified is not None:
+            validators['If-Modified-Since'] = last_modified
+        return validators
+
+    @property
+    def size(self):
+        """Approximate size in bytes"""
+        return len(self.content or '') + len(self._src or '') + \
+               sum(len(k) + len(str(v)) for k, v in self.headers.allitems())
+
+class MemoryCache(object):
+
+    """
+    In-memory cache storage, evicting the least recently used entries to keep
+    within a byte budget
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Fetch an entry, or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        """Store an entry, evicting others as necessary"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+
+            if entry.size > self.max_bytes:
+                return
+
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
+
+    def delete(self, key):
+        """Forget an entry"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+
+class DirectoryCache(object):
+
+    """
+    On-disk cache storage, one file per entry, surviving restarts
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _filename(self, key):
+        """Where an entry lives"""
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    def get(self, key):
+        """Fetch an entry, or None"""
+        try:
+            with open(self._filename(key), 'rb') as fp:
+                return pickle.load(fp)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, entry):
+        """Store an entry, replacing any existing one atomically"""
+        filename = self._filename(key)
+        tmp = '%s.%d.%d' % (filename, os.getpid(), threading.current_thread().ident)
+        with open(tmp, 'wb') as fp:
+            pickle.dump(entry, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, filename)
+
+    def delete(self, key):
+        """Forget an entry"""
+        try:
+            os.unlink(self._filename(key))
+        except OSError:
+            pass
+
+class CachingBackend(HttpBackend):
+
+    """
+    HTTP cache in front of another backend.
+
+    Fresh responses (by Cache-Control max-age or Expires) are served without
+    a request; stale ones are revalidated with If-None-Match/If-Modified-Since
+    and reused on a 304. Only GET responses are cached; other methods
+    invalidate the URL. One response is kept per URL, and only used for
+    requests with the same values for the headers named by its Vary (auth
+    counting as Authorization, agent as User-Agent). Responses varying by
+    Cookie aren't cached unless the request sets the Cookie header itself,
+    as the backend's cookies can't be seen.
+    """
+
+    def __init__(self, backend=None, store=None, *args, **kwargs):
+        super(CachingBackend, self).__init__(*args, **kwargs)
+        if backend is None:
+            from . import default_backend
+            backend = default_backend()
+        self.backend = backend
+        self.store = store if store is not None else MemoryCache()
+        self.status = None # 'hit', 'revalidated', 'miss' or None if uncached
+        self._entry = None
+        self._replayed = None # the Response made from the entry
+        self._timing = None # of the current hit
+
+    @staticmethod
+    def _cacheable(http_code, headers):
+        """Should a response be stored?"""
+        directives = cache_control(headers)
+        return http_code == 200 and 'no-store' not in directives
+
+    @staticmethod
+    def _varied(names, headers, auth, agent):
+        """
+        A request's values for the named headers, or None if they can't be
+        known
+        """
+        values = {}
+        for name in names:
+            value = header(headers, name)
+            if value is None:
+                if name == '*' or name == 'cookie':
+                    return None
+                if name == 'authorization' and auth is not None:
+                    # never store credentials themselves
+                    value = sha1(repr(auth)).hexdigest()
+                elif name == 'user-agent':
+                    value = agent
+            values[name] = value
+        return values
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, from the cache if possible"""
+        self._entry = None
+        self._replayed = None
+        self.status = None
+        self._timing = None
+
+        if method != 'GET' or sink is not None:
+            if method not in ('GET', 'HEAD', 'OPTIONS'):
+                self.store.delete(url)
+            return self.backend.go(url, method, data, headers, auth, follow,
+                                   agent, retries, debug, sink)
+
+        entry = self.store.get(url)
+        if entry is not None and \
+           entry.varied != self._varied(entry.varied, headers, auth, agent):
+            entry = None # a variant for other request headers
+        if entry is not None and entry.fresh:
+            self._entry = entry
+            self.status = 'hit'
+            self._timing = Timing(total=timedelta())
+            return self._replay()
+
+        sent = headers
+        if entry is not None:
+            sent = dict(headers or {})
+            sent.update(entry.validators)
+
+        resp = self.backend.go(url, method, data, sent, auth, follow,
+                               agent, retries, debug)
+
+        if entry is not None and self.backend.http_code == 304:
+            entry.refresh(self.backend.headers)
+            varied = self._varied(vary(entry.headers), headers, auth, agent)
+            if varied is None:
+                self.store.delete(url)
+            else:
+                entry.varied = varied
+                self.store.set(url, entry)
+            self._entry = entry
+            self.status = 'revalidated'
+            return self._replay()
+
+        self.status = 'miss'
+        if resp is None:
+            resp = Response.from_backend(self.backend)
+        varied = self._varied(vary(self.backend.headers), headers, auth, agent)
+        if varied is not None and \
+           self._cacheable(self.backend.http_code, self.backend.headers):
+            # text that couldn't be decoded again is kept as it is
+            src = resp.src if resp.charset is None and \
+                              isinstance(resp.src, unicode) else None
+            self._entry = CacheEntry(self.backend.url,
+                                     self.backend.http_code,
+                                     self.backend.headers,
+                                     resp.content,
+                                     self.backend.roundtrip,
+                                     varied,
+                                     resp.charset,
+                                     src)
+            self.store.set(url, self._entry)
+        return resp
+
+    def _replay(self):
+        """The cached response, with the body and charset it was received with"""
+        entry = self._entry
+        self._replayed = Response(decode=lambda: entry.src,
+                                  content=entry.content,
+                                  charset=entry.charset,
+                                  url=self.url,
+                                  http_code=self.http_code,
+                                  headers=self.headers,
+                                  roundtrip=self.roundtrip,
+                                  timing=self.timing)
+        return self._replayed
+
+    def forget(self):
+        """Forget the last response, so that nothing of it can be read"""
+        self._entry = None
+        self._replayed = None
+        self.status = None
+        self._timing = None
+        self.backend.forget()
+
+    def companion(self):
+        """A CachingBackend with the same store, before a companion backend"""
+        backend = self.backend.companion()
+        if backend is None:
+            return None
+        return self._like(CachingBackend(backend, self.store))
+
+    @property
+    def _cached(self):
+        """Is the current response being served from the cache?"""
+        return self.status in ('hit', 'revalidated')
+
+    @property
+    def tree(self):
+        """A copy of a parsed tree for the current response, if one was kept"""
+        return self._entry.tree if self._entry is not None else None
+
+    @tree.setter
+    def tree(self, tree):
+        """Keep a parsed tree alongside the cached response"""
+        if self._entry is not None:
+            self._entry.tree = tree
+
+    @property
+    def src(self):
+        """Read-only page-source"""
+        return self._replayed.src if self._cached else self.backend.src
+
+    @property
+    def url(self):
+        """Read-only current URL"""
+        return self._entry.url if self._cached else self.backend.url
+
+    @property
+    def roundtrip(self):
+        """Read-only request roundtrip timing"""
+        if self.status == 'hit':
+            return timedelta()
+        return self.backend.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        if self.status == 'hit':
+            return self._timing
+        return self.backend.timing
+
+    @property
+    def http_code(self):
+        """Read-only last HTTP response code"""
+        return self._entry.http_code if self._cached else self.backend.http_code
+
+    @property
+    def headers(self):
+        """Read-only headers dict"""
+        return self._entry.headers if self._cached else self.backend.headers
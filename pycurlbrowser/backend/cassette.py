@@ -0,0 +1,360 @@
+# coding: utf-8
+
+"""
+Record requests made through any backend to a cassette file, and replay them
+offline through a MockBackend.
+
+    with RecordingBackend('site.cassette', backend=CurlBackend()) as recorder:
+        Browser(backend=recorder).go('http://example.com/')
+
+    with ReplayBackend('site.cassette') as replay:
+        browser = Browser(backend=replay)
+"""
+
+import mmap
+import time
+import zlib
+import shutil
+import threading
+import cPickle as pickle
+from copy import copy
+from datetime import timedelta
+from tempfile import TemporaryFile
+from .base import HttpBackend, Response, sink_writer
+from .mock import MockBackend, MockResponse
+from .util import Headers
+
+class RecordedResponse(MockResponse):
+
+    """
+    A MockResponse read from a cassette. The body stays in the (memory
+    mapped) cassette file until src is first read.
+    """
+
+    def __init__(self, record, body):
+        super(RecordedResponse, self).__init__()
+        self._src = None
+        self._body = body
+        self.request = dict(url=record['url'],
+                            method=record['method'],
+                            data=record['data'],
+                            headers=record['headers'])
+        self.url = record['final_url']
+        self.http_code = record['http_code']
+        self.headers = Headers(record['response_headers'])
+        self.roundtrip = record['roundtrip'] or timedelta()
+        self.exception = record['exception']
+        self._unicode = record['unicode']
+
+    @property
+    def src(self):
+        """Page-source, unpacked from the cassette on first read"""
+        if self._src is None:
+            src = zlib.decompress(self._body())
+            self._src = src.decode('utf-8') if self._unicode else src
+        return self._src
+
+    @src.setter
+    def src(self, src):
+        """Replace the recorded page-source"""
+        self._src = src
+
+class Cassette(object):
+
+    """
+    An append-only file of recorded request/response pairs: each record is a
+    pickled dict followed by the zlib-compressed body. With no path, records
+    go to an anonymous temporary file. A read-only cassette must exist.
+    """
+
+    def __init__(self, path=None, readonly=False):
+        self.path = path
+        if path is None:
+            self._fp = TemporaryFile()
+        else:
+            self._fp = open(path, 'rb' if readonly else 'a+b')
+        self._maps = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _picklable(exception):
+        """The exception, or a stand-in for one that can't be pickled"""
+        if exception is None:
+            return None
+        try:
+            pickle.dumps(exception, pickle.HIGHEST_PROTOCOL)
+            return exception
+        except Exception:
+            return Exception(repr(exception))
+
+    def record(self, url, method, data, headers, resp, body=None):
+        """
+        Append a request and its Response. The body is resp.src, or given
+        as a BodyWriter when it was streamed.
+        """
+        src = resp.src or ''
+        if body is None:
+            body = BodyWriter()
+            body.write(src.encode('utf-8') if isinstance(src, unicode) else src)
+        size = body.finish()
+        record = dict(url=url,
+                      method=method,
+                      data=data,
+                      headers=headers,
+                      final_url=resp.url if resp.url is not None else url,
+                      http_code=resp.http_code,
+                      response_headers=Headers(resp.headers or {}).allitems(),
+                      roundtrip=resp.roundtrip,
+                      exception=self._picklable(resp.exception),
+                      unicode=isinstance(src, unicode),
+                      size=size)
+
+        with self._lock:
+            self._fp.seek(0, 2)
+            pickle.dump(record, self._fp, pickle.HIGHEST_PROTOCOL)
+            body.copy_to(self._fp)
+            self._fp.flush()
+
+    def __iter__(self):
+        """
+        Yield a RecordedResponse for each record, reading only the records'
+        metadata; bodies are left in the memory-mapped file
+        """
+        with self._lock:
+            self._fp.flush()
+            self._fp.seek(0, 2)
+            if self._fp.tell() == 0:
+                return
+            mapped = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mapped)
+
+        def loader(offset, size):
+            """Closure to read a body out of the mapped file"""
+            return lambda: mapped[offset:offset + size]
+
+        while mapped.tell() < mapped.size():
+            record = pickle.load(mapped)
+            offset = mapped.tell()
+            mapped.seek(record['size'], 1)
+            yield RecordedResponse(record, loader(offset, record['size']))
+
+    def close(self):
+        """
+        Close the file and its memory maps; bodies of records already read
+        stay readable only if their src has been
+        """
+        with self._lock:
+            for mapped in self._maps:
+                mapped.close()
+            self._maps = []
+            self._fp.close()
+
+class BodyWriter(object):
+
+    """
+    A body being compressed for a cassette as it's written, into a temporary
+    file rather than memory
+    """
+
+    def __init__(self):
+        self._compressor = zlib.compressobj()
+        self._fp = TemporaryFile()
+
+    def write(self, chunk):
+        """Compress the next chunk of the body"""
+        self._fp.write(self._compressor.compress(chunk))
+
+    def finish(self):
+        """Finish compressing, returning the compressed size"""
+        self._fp.write(self._compressor.flush())
+        return self._fp.tell()
+
+    def copy_to(self, fp):
+        """Copy the compressed body into fp, and discard it"""
+        self._fp.seek(0)
+        shutil.copyfileobj(self._fp, fp)
+        self._fp.close()
+
+class RecordingBackend(HttpBackend):
+
+    """
+    Record every request made through another backend to a cassette, given
+    as a Cassette or a path.
+    """
+
+    def __init__(self, cassette=None, backend=None, *args, **kwargs):
+        super(RecordingBackend, self).__init__(*args, **kwargs)
+        if backend is None:
+            from . import default_backend
+            backend = default_backend()
+        self.backend = backend
+        self.cassette = cassette if isinstance(cassette, Cassette) \
+                                 else Cassette(cassette)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the cassette"""
+        self.cassette.close()
+
+    def forget(self):
+        """Forget the last response, so that nothing of it can be read"""
+        self.backend.forget()
+
+    def companion(self):
+        """A RecordingBackend to the same cassette, from a companion backend"""
+        backend = self.backend.companion()
+        if backend is None:
+            return None
+        return self._like(RecordingBackend(self.cassette, backend))
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, recording the outcome"""
+        streamed = None
+        if sink is not None:
+            # compress a streamed body for the cassette as it arrives
+            streamed = BodyWriter()
+            write = sink_writer(sink)
+
+            def sink(chunk):
+                """Closure to pass each chunk on, and keep it"""
+                streamed.write(chunk)
+                write(chunk)
+
+        try:
+            resp = self.backend.go(url, method, data, headers, auth, follow,
+                                   agent, retries, debug, sink)
+        except Exception, ex:
+            self.cassette.record(url, method, data, headers,
+                                 Response(url=url, exception=ex))
+            raise
+
+        if resp is None:
+            resp = Response.from_backend(self.backend)
+        if streamed is not None:
+            recorded = copy(resp)
+            recorded.src = None
+            self.cassette.record(url, method, data, headers, recorded, streamed)
+        else:
+            self.cassette.record(url, method, data, headers, resp)
+        return resp
+
+    @property
+    def src(self):
+        """Read-only page-source"""
+        return self.backend.src
+
+    @property
+    def url(self):
+        """Read-only current URL"""
+        return self.backend.url
+
+    @property
+    def roundtrip(self):
+        """Read-only request roundtrip timing"""
+        return self.backend.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        return self.backend.timing
+
+    @property
+    def http_code(self):
+        """Read-only last HTTP response code"""
+        return self.backend.http_code
+
+    @property
+    def headers(self):
+        """Read-only headers dict"""
+        return self.backend.headers
+
+class ReplayBackend(MockBackend):
+
+    """
+    Replay a cassette, given as a Cassette or a path. Where a request was
+    recorded more than once the last recording wins; redirects are replayed
+    as a redirect to the recorded final URL.
+
+    With latency set, each request takes as long as it did when recorded.
+    Bodies are read from the cassette as they're replayed, until it's closed.
+    """
+
+    def __init__(self, cassette=None, latency=False, *args, **kwargs):
+        super(ReplayBackend, self).__init__(*args, **kwargs)
+        self.latency = latency
+        self.cassettes = []
+        if cassette is not None:
+            self.load(cassette if isinstance(cassette, Cassette)
+                                else Cassette(cassette, readonly=True))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the cassettes loaded"""
+        for cassette in self.cassettes:
+            cassette.close()
+
+    @staticmethod
+    def _key(request):
+        """Identify a request, so that re-recordings replace it"""
+        data = request['data']
+        if isinstance(data, dict):
+            data = tuple(sorted(data.items()))
+        headers = request['headers']
+        if headers is not None:
+            headers = tuple(sorted(headers.items()))
+        return request['url'], request['method'], data, headers
+
+    def load(self, cassette):
+        """Add every recording in a cassette to the responses"""
+        self.cassettes.append(cassette)
+        latest = {}
+        order = []
+
+        def keep(request, resp):
+            """Closure to keep the last response for each request"""
+            key = self._key(request)
+            if key not in latest:
+                order.append(key)
+            latest[key] = (request, resp)
+
+        for resp in cassette:
+            if resp.exception is None and resp.url != resp.request['url']:
+                hop = MockResponse()
+                hop.http_code = 302
+                hop.headers = {'Location': resp.url}
+                hop.redirect = resp.url
+                keep(resp.request, hop)
+                keep(dict(resp.request, url=resp.url), resp)
+            else:
+                keep(resp.request, resp)
+
+        for key in order:
+            request, resp = latest[key]
+            self.responses.add(resp, **request)
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Replay a URL"""
+        self._resp = None
+        try:
+            return super(ReplayBackend, self).go(url, method, data, headers,
+                                                 auth, follow, agent, retries,
+                                                 debug, sink)
+        finally:
+            if self.latency and self._resp is not None:
+                time.sleep(self._resp.roundtrip.total_seconds())
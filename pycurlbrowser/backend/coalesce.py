@@ -0,0 +1,333 @@
+# coding: utf-8
+
+"""
+Coalesce identical concurrent requests, so that a stampede of threads asking
+for the same page sends one request upstream, e.g.
+
+    flights = SingleFlight(ttl=1.0)
+    pool = BrowserPool(backend_factory=lambda: CoalescingBackend(group=flights))
+"""
+
+import sys
+import threading
+from copy import copy
+from collections import OrderedDict
+from tempfile import SpooledTemporaryFile
+from .base import HttpBackend, Response, sink_writer
+from .util import clock
+
+class _Call(object):
+
+    """
+    A request in flight, and what came of it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.resp = None
+        self.shared = None # the Response given to the others, if any
+        self.exception = None
+        self.followers = 0
+
+class Unshared(Exception):
+
+    """
+    Raised by a SingleFlight call for a failure of its own, rather than of
+    the request: exc_info is raised as it was, and any waiting on the call
+    try again.
+    """
+
+    def __init__(self, exc_info):
+        super(Unshared, self).__init__(exc_info[1])
+        self.exc_info = exc_info
+
+class SingleFlight(object):
+
+    """
+    Requests in flight from any number of CoalescingBackends, in any number
+    of threads. A request identical to one in flight waits for its outcome
+    rather than being sent again; with ttl, a successful outcome is also
+    given to identical requests for ttl seconds after it arrives, keeping
+    no more than max_results, of max_bytes of bodies, the oldest dropped
+    first.
+    """
+
+    def __init__(self, ttl=0, max_results=256, max_bytes=16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.requests = 0 # sent upstream
+        self.coalesced = 0 # waited for one in flight
+        self.reused = 0 # given a recent result
+        self.bytes = 0 # of the bodies of recent results
+        self._calls = {}
+        self._results = OrderedDict() # key -> (expires, Response, size), oldest first
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(resp):
+        """Bytes of a result's body"""
+        return len(resp.content or '')
+
+    @staticmethod
+    def _copy(resp):
+        """A copy of a Response to give out, with a Timing of its own"""
+        resp = copy(resp)
+        resp.timing = copy(resp.timing)
+        return resp
+
+    def _forget(self, key):
+        """Drop a recent result"""
+        result = self._results.pop(key, None)
+        if result is not None:
+            self.bytes -= result[2]
+
+    def _remember(self, key, resp):
+        """Keep a result for ttl seconds, dropping the oldest beyond the caps"""
+        self._forget(key)
+        size = self._size(resp)
+        if size > self.max_bytes:
+            return
+        self._results[key] = (clock() + self.ttl, resp, size)
+        self.bytes += size
+        while len(self._results) > self.max_results or \
+              self.bytes > self.max_bytes:
+            self._forget(next(iter(self._results)))
+
+    def _recent(self, key, now):
+        """A result for key still within its ttl, dropping any expired"""
+        while self._results:
+            oldest = next(iter(self._results))
+            if self._results[oldest][0] > now:
+                break
+            self._forget(oldest)
+        result = self._results.get(key)
+        return result[1] if result is not None else None
+
+    def _lead(self, key, call, fn, share):
+        """Make a call, and give its outcome to any waiting on it"""
+        def shared(resp):
+            """Closure making the Response to give the others"""
+            return self._copy(share(resp) if share is not None else resp)
+
+        try:
+            call.resp = fn()
+            if self.ttl:
+                # kept in any case, so ready before the call is done with
+                call.shared = shared(call.resp)
+        except Exception, ex:
+            call.exception = ex
+        finally:
+            with self._lock:
+                del self._calls[key]
+                followed = call.followers > 0
+                if self.ttl and call.shared is not None:
+                    self._remember(key, call.shared)
+            try:
+                if followed and call.resp is not None and call.shared is None:
+                    call.shared = shared(call.resp)
+            finally:
+                call.done.set()
+
+    def do(self, key, fn, share=None):
+        """
+        Call fn() for a Response, unless a call with the same key is in
+        flight or recently done, in which case share its outcome: a copy of
+        its Response, or its exception raised. share(resp) makes the
+        Response to give the others from the one fn() returned, and is only
+        called if there are any; should fn() raise Unshared, its exception
+        is the caller's alone. Returns (Response, how), how being 'sent',
+        'coalesced' or 'reused'.
+        """
+        while True:
+            with self._lock:
+                recent = self._recent(key, clock()) if self.ttl else None
+                if recent is not None:
+                    self.reused += 1
+                    return self._copy(recent), 'reused'
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.requests += 1
+                else:
+                    call.followers += 1
+                    self.coalesced += 1
+
+            if leader:
+                self._lead(key, call, fn, share)
+                break
+
+            call.done.wait()
+            if call.shared is not None or \
+               call.exception is not None and \
+               not isinstance(call.exception, Unshared):
+                break
+            with self._lock:
+                self.coalesced -= 1 # nothing to share after all; try again
+
+        if isinstance(call.exception, Unshared):
+            exc_type, exc_value, traceback = call.exception.exc_info
+            raise exc_type, exc_value, traceback
+        if call.exception is not None:
+            raise call.exception
+        if leader:
+            return call.resp, 'sent'
+        return self._copy(call.shared), 'coalesced'
+
+    def stats(self):
+        """Counts of requests sent, coalesced and reused"""
+        with self._lock:
+            return dict(requests=self.requests,
+                        coalesced=self.coalesced,
+                        reused=self.reused,
+                        in_flight=len(self._calls))
+
+class CoalescingBackend(HttpBackend):
+
+    """
+    Send GET and HEAD requests through another backend by way of a
+    SingleFlight group, which should be shared by the backends of every
+    thread that is to coalesce. Requests are identical when their method,
+    URL, headers, auth, agent and follow setting are; each backend keeps
+    its own copy of the outcome, so Browsers' page state stays their own.
+    A streamed body is streamed to the first request's sink, and written
+    whole to the sinks of any coalesced with it, kept meanwhile in a file
+    that spills to disk beyond spool_size bytes. Should the first request's
+    sink fail, those coalesced with it are sent again.
+
+    Backends with cookie jars of their own may see different pages for the
+    same request; coalesce those that share cookies, or keep none.
+    """
+
+    methods = ('GET', 'HEAD')
+    spool_size = 1024 * 1024
+
+    def __init__(self, backend=None, group=None, *args, **kwargs):
+        super(CoalescingBackend, self).__init__(*args, **kwargs)
+        if backend is None:
+            from . import default_backend
+            backend = default_backend()
+        self.backend = backend
+        self.group = group if group is not None else SingleFlight()
+        self.status = None # 'sent', 'coalesced', 'reused', or None if passed on
+        self._response = Response()
+
+    @staticmethod
+    def _key(url, method, headers, auth, follow, agent):
+        """Identify a request, so that identical ones can be coalesced"""
+        if headers is not None:
+            headers = tuple(sorted((k.lower(), v) for k, v in headers.items()))
+        return method, url, headers, auth, bool(follow), agent
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, coalescing with identical requests in flight"""
+        self.status = None
+        if method not in self.methods or data is not None:
+            resp = self.backend.go(url, method, data, headers, auth, follow,
+                                   agent, retries, debug, sink)
+            self._response = resp if resp is not None \
+                                  else Response.from_backend(self.backend)
+            return self._response
+
+        spool = tee = None
+        failed = [] # the exception this request's sink raised
+        if sink is not None:
+            # keep the body for the requests coalesced with this one
+            spool = SpooledTemporaryFile(self.spool_size)
+            write = sink_writer(sink)
+
+            def tee(chunk):
+                """Closure to keep each chunk, and pass it on"""
+                spool.write(chunk)
+                try:
+                    write(chunk)
+                except Exception:
+                    failed.append(sys.exc_info())
+                    raise
+
+        def send():
+            """Closure making the request, if this backend leads"""
+            try:
+                resp = self.backend.go(url, method, data, headers, auth,
+                                       follow, agent, retries, debug, tee)
+            except Exception:
+                if failed:
+                    raise Unshared(failed[0]) # this sink's alone
+                raise
+            if failed:
+                raise Unshared(failed[0])
+            return resp if resp is not None \
+                        else Response.from_backend(self.backend)
+
+        def share(resp):
+            """Closure giving the others the body this backend was streamed"""
+            if spool is None:
+                return resp
+            resp = copy(resp)
+            spool.seek(0)
+            resp.content = spool.read()
+            return resp
+
+        try:
+            resp, self.status = self.group.do(
+                self._key(url, method, headers, auth, follow, agent),
+                send, share)
+        finally:
+            if spool is not None:
+                spool.close()
+
+        if self.status != 'sent':
+            # the body as this request asked for it
+            if sink is not None:
+                if resp.content is not None:
+                    sink_writer(sink)(resp.content)
+                resp.src = None
+            elif resp.src is None:
+                resp.decode_content()
+
+        self._response = resp
+        return resp
+
+    def forget(self):
+        """Forget the last response, so that nothing of it can be read"""
+        self.status = None
+        self._response = Response()
+        self.backend.forget()
+
+    def companion(self):
+        """A CoalescingBackend in the same group, before a companion backend"""
+        backend = self.backend.companion()
+        if backend is None:
+            return None
+        return self._like(CoalescingBackend(backend, self.group))
+
+    @property
+    def src(self):
+        """Read-only page-source"""
+        return self._response.src
+
+    @property
+    def url(self):
+        """Read-only current URL"""
+        return self._response.url
+
+    @property
+    def roundtrip(self):
+        """Read-only request roundtrip timing"""
+        return self._response.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        return self._response.timing
+
+    @property
+    def http_code(self):
+        """Read-only last HTTP response code"""
+        return self._response.http_code
+
+    @property
+    def headers(self):
+        """Read-only headers dict"""
+        return self._response.headers
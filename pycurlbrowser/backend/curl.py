@@ -1,9 +1,43 @@
 # coding: utf-8
 
 from urllib import urlencode
+from urlparse import urljoin
+from datetime import timedelta
+import sys
 import StringIO
-from .base import HttpBackend
-from .util import StopWatch
+from .base import HttpBackend, Response, sink_writer
+from .util import StopWatch, Timing, Headers
+
+class CurlSharedState(object):
+
+    """
+    DNS, SSL session and connection caches (and optionally cookies) shared
+    between any number of CurlBackends, via pycurl's CurlShare.
+
+    pycurl locks each shared cache itself, so one instance can be used by
+    backends in different threads; each backend must still stay in one thread.
+    """
+
+    def __init__(self, dns=True, ssl=True, connections=True, cookies=False):
+        import pycurl
+
+        self._share = pycurl.CurlShare()
+
+        # connection sharing needs a recent libcurl, and pycurl to expose it
+        wanted = [(dns,         'LOCK_DATA_DNS'),
+                  (ssl,         'LOCK_DATA_SSL_SESSION'),
+                  (connections, 'LOCK_DATA_CONNECT'),
+                  (cookies,     'LOCK_DATA_COOKIE')]
+        self.shared = []
+        for enabled, name in wanted:
+            if enabled and hasattr(pycurl, name):
+                self._share.setopt(pycurl.SH_SHARE, getattr(pycurl, name))
+                self.shared.append(name)
+
+    def attach(self, curl):
+        """Attach a curl "easy" handle to the shared state"""
+        import pycurl
+        curl.setopt(pycurl.SHARE, self._share)
 
 class CurlBackend(HttpBackend):
 
@@ -11,28 +45,70 @@ class CurlBackend(HttpBackend):
     Curl backend
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, share=None, *args, **kwargs):
         super(CurlBackend, self).__init__(*args, **kwargs)
 
-        self._head_buf = StringIO.StringIO()
+        self._hops = [] # header lines of each response received
         self._body_buf = StringIO.StringIO()
-        self._roundtrip = None
-        self._http_code = None
+        self._response = Response()
+        self._streamed = False
+        self._sunk = False # has any of the body reached the sink?
+        self._sink_failure = None # exc_info of an exception the sink raised
+        self._share = share
+        self._requested_url = None
 
         import pycurl
         self._pycurl = pycurl
 
         self._curl = self._pycurl.Curl() # note: this is an "easy" connection
+        self._setup_defaults()
+
+    def _setup_defaults(self):
+        """Options that hold for every request made with this handle"""
         self._curl.setopt(self._pycurl.AUTOREFERER, 1)
         self._curl.setopt(self._pycurl.MAXREDIRS, 20)
         self._curl.setopt(self._pycurl.ENCODING, "gzip")
-        self._curl.setopt(self._pycurl.HEADERFUNCTION,
-                          self._head_buf.write) # callback for header buffer
-        self._curl.setopt(self._pycurl.WRITEFUNCTION,
-                          self._body_buf.write) # callback for content buffer
+        self._curl.setopt(self._pycurl.HEADERFUNCTION, self._header_line)
         self._curl.setopt(self._pycurl.COOKIEFILE, "") # use cookies
         self._curl.setopt(self._pycurl.CONNECTTIMEOUT, 2)
         self._curl.setopt(self._pycurl.TIMEOUT, 4)
+        if self._share is not None:
+            self._share.attach(self._curl)
+
+    def _share_cookies(self):
+        """
+        Keep this handle's cookies in shared state, so that companions can
+        share them, returning whether they are
+        """
+        if self._share is not None and 'LOCK_DATA_COOKIE' in self._share.shared:
+            return True
+        if not hasattr(self._pycurl, 'LOCK_DATA_COOKIE'):
+            return False
+
+        # attaching drops the handle's own cookies, so put them back after
+        cookies = self._curl.getinfo(self._pycurl.INFO_COOKIELIST)
+        self._share = CurlSharedState(cookies=True)
+        self._share.attach(self._curl)
+        for cookie in cookies:
+            self._curl.setopt(self._pycurl.COOKIELIST, cookie)
+        return True
+
+    def companion(self):
+        """
+        A CurlBackend sharing cookies and caches with this one. Unless its
+        CurlSharedState already shares cookies, this one moves to a new
+        CurlSharedState that does.
+        """
+        if not self._share_cookies():
+            return None
+        return self._like(CurlBackend(share=self._share))
+
+    def _header_line(self, line):
+        """Collect a header line, starting a new hop at each status line"""
+        if line.startswith('HTTP/') or not self._hops:
+            self._hops.append([line])
+        else:
+            self._hops[-1].append(line)
 
     def check_curl(self, item):
         """Convenience method to check whether curl supports a given feature"""
@@ -40,6 +116,7 @@ class CurlBackend(HttpBackend):
 
     def _setup_url(self, url):
         """Pass the url on to curl"""
+        self._requested_url = url
         self._curl.setopt(self._pycurl.URL, url)
 
     def _setup_method(self, method):
@@ -72,6 +149,30 @@ class CurlBackend(HttpBackend):
         """Pass the user agent on to curl"""
         self._curl.setopt(self._pycurl.USERAGENT, agent)
 
+    def _setup_sink(self, sink):
+        """Send the body to the sink, or the content buffer if there's none"""
+        self._streamed = sink is not None
+        if sink is None:
+            self._curl.setopt(self._pycurl.WRITEFUNCTION, self._body_buf.write)
+            return
+
+        to_sink = sink_writer(sink)
+
+        def write(chunk):
+            """
+            Closure noting that the sink has been written to. Should the sink
+            raise, the transfer is aborted, and the exception kept to raise
+            once curl returns.
+            """
+            self._sunk = True
+            try:
+                to_sink(chunk)
+            except Exception:
+                self._sink_failure = sys.exc_info()
+                return 0 # short of the chunk's length, so curl aborts
+
+        self._curl.setopt(self._pycurl.WRITEFUNCTION, write)
+
     def _setup_debug(self, debug):
         """Pass a pretty helper on to curl for debugging if neccessary"""
         if debug:
@@ -91,8 +192,8 @@ class CurlBackend(HttpBackend):
         else:
             self._curl.setopt(self._pycurl.VERBOSE, 0)
 
-    def go(self, url, method, data, headers, auth, follow, agent, retries, debug):
-        """Visit a URL, return an HTTP response code"""
+    def _prepare(self, url, method, data, headers, follow, agent, debug, sink):
+        """Set up curl for a request and clear out the buffers"""
         self._setup_url(url)
         self._setup_method(method)
         self._setup_data(method, data)
@@ -100,48 +201,193 @@ class CurlBackend(HttpBackend):
         self._setup_follow(follow)
         self._setup_agent(agent)
         self._setup_debug(debug)
+        self._setup_sink(sink)
+
+        self._reset_attempt()
 
-        self._head_buf.truncate(0)
+    def _reset_attempt(self):
+        """Forget anything received by an earlier attempt"""
+        self._hops = []
         self._body_buf.truncate(0)
+        self._sunk = False
+        self._sink_failure = None
+
+    def _retry_delay(self, method, attempt, exception=None):
+        """
+        Seconds to wait before retrying the attempt just made, which failed
+        with exception or else gave a response, or None not to retry
+        """
+        failure = self._failure(exception)
+        if failure is None:
+            return None
+        return self.retry_policy.retry(method, attempt, **failure)
+
+    def _failure(self, exception=None):
+        """
+        What the retry policy is told of the attempt just made, which failed
+        with exception or else gave a response; None if it can't be retried
+        """
+        if self._sunk:
+            return None # the sink can't give back what it's been given
+        if exception is not None:
+            return dict(exception=exception,
+                        connect_failed=exception.args[0] in
+                                       self._connect_errors())
+        return dict(
+            http_code=self._curl.getinfo(self._pycurl.RESPONSE_CODE),
+            headers=Headers(lines=self._hops[-1] if self._hops else None))
+
+    def _connect_errors(self):
+        """curl's error codes for requests that were never sent"""
+        return (self._pycurl.E_COULDNT_RESOLVE_PROXY,
+                self._pycurl.E_COULDNT_RESOLVE_HOST,
+                self._pycurl.E_COULDNT_CONNECT)
+
+    def _history(self):
+        """A Response for each redirect followed, from their header lines"""
+        history = []
+        url = self._requested_url
+        for lines in self._hops[:-1]:
+            status = lines[0].split(None, 2)
+            http_code = int(status[1]) if len(status) > 1 and \
+                                          status[1].isdigit() else None
+            # skip interim responses, e.g. 100 Continue
+            if http_code is None or not 300 <= http_code < 400:
+                continue
+            headers = Headers(lines=lines)
+            history.append(Response(url=url,
+                                    http_code=http_code,
+                                    headers=headers))
+            url = urljoin(url, headers.get('Location', ''))
+        return history
+
+    def _complete(self, roundtrip):
+        """Record the outcome of a finished request"""
+        src = None if self._streamed else self._body_buf.getvalue()
+        redirects = self._curl.getinfo(self._pycurl.REDIRECT_COUNT)
+        self._response = Response(
+            src=src,
+            content=src,
+            url=self._curl.getinfo(self._pycurl.EFFECTIVE_URL),
+            http_code=self._curl.getinfo(self._pycurl.RESPONSE_CODE),
+            headers=Headers(lines=self._hops[-1] if self._hops else None),
+            roundtrip=roundtrip,
+            timing=self._read_timing(roundtrip),
+            history=self._history() if redirects else None)
+
+        if redirects:
+            self.hooks.fire('redirect',
+                            backend=self,
+                            url=self._requested_url,
+                            final_url=self.url,
+                            count=redirects)
+        return self._response
+
+    def _read_timing(self, total):
+        """Break the request down into phases, using curl's counters"""
+        info = dict((name, self._curl.getinfo(getattr(self._pycurl, name)))
+                    for name in ('NAMELOOKUP_TIME',
+                                 'CONNECT_TIME',
+                                 'APPCONNECT_TIME',
+                                 'PRETRANSFER_TIME',
+                                 'STARTTRANSFER_TIME',
+                                 'TOTAL_TIME',
+                                 'REDIRECT_TIME',
+                                 'REQUEST_SIZE',
+                                 'SIZE_UPLOAD',
+                                 'HEADER_SIZE',
+                                 'SIZE_DOWNLOAD'))
+
+        def span(start, end):
+            """Time between two of curl's cumulative timestamps"""
+            return timedelta(seconds=max(0, info[end] - info[start]))
+
+        # curl's timestamps are cumulative from the start of the final
+        # request, except the total, which includes redirects; a reused
+        # connection has no DNS, connect or TLS time
+        info['FINAL_TIME'] = info['TOTAL_TIME'] - info['REDIRECT_TIME']
+        tls = span('CONNECT_TIME', 'APPCONNECT_TIME') \
+              if info['APPCONNECT_TIME'] > 0 else timedelta()
+        return Timing(total=total,
+                      dns=timedelta(seconds=info['NAMELOOKUP_TIME']),
+                      connect=span('NAMELOOKUP_TIME', 'CONNECT_TIME'),
+                      tls=tls,
+                      first_byte=span('PRETRANSFER_TIME', 'STARTTRANSFER_TIME'),
+                      transfer=span('STARTTRANSFER_TIME', 'FINAL_TIME'),
+                      redirect=timedelta(seconds=info['REDIRECT_TIME']),
+                      bytes_up=int(info['REQUEST_SIZE'] + info['SIZE_UPLOAD']),
+                      bytes_down=int(info['HEADER_SIZE'] + info['SIZE_DOWNLOAD']))
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, returning a Response"""
+        self._prepare(url, method, data, headers, follow, agent, debug, sink)
+
+        self.retry_policy.started()
+
         with StopWatch() as sw:
-            exception = Exception("Dummy exception")
+            attempt = 0
 
-            while retries >= 0 and exception is not None:
-                retries -= 1
+            while True:
+                attempt += 1
+                exception = None
+                if attempt > 1:
+                    self._reset_attempt()
                 try:
                     self._curl.perform()
-                    exception = None
                 except self._pycurl.error, ex:
                     exception = ex
 
+                delay = self._retry_delay(method, attempt, exception) \
+                        if attempt <= retries else None
+                if delay is None:
+                    break
+
+                self.hooks.fire('retry',
+                                backend=self,
+                                url=url,
+                                attempt=attempt,
+                                exception=exception,
+                                http_code=self._curl.getinfo(
+                                    self._pycurl.RESPONSE_CODE)
+                                    if exception is None else None,
+                                delay=delay)
+                self.retry_policy.wait(delay)
+
+            if self._sink_failure is not None:
+                exc_type, exc_value, traceback = self._sink_failure
+                self._sink_failure = None
+                raise exc_type, exc_value, traceback
             if exception is not None:
                 raise exception
 
-        self._roundtrip = sw.total
-
-        self._http_code = self._curl.getinfo(self._pycurl.RESPONSE_CODE)
+        return self._complete(sw.total)
 
     @property
     def src(self):
-        """Read-only page-source"""
-        return self._body_buf.getvalue()
+        """Read-only page-source, or None if the body was streamed"""
+        return self._response.src
 
     @property
     def url(self):
         """Read-only current URL"""
-        return self._curl.getinfo(self._pycurl.EFFECTIVE_URL)
+        return self._response.url
 
     @property
     def roundtrip(self):
         """Read-only request roundtrip timing"""
-        return self._roundtrip
+        return self._response.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        return self._response.timing
 
     @property
     def http_code(self):
         """Read-only last HTTP response code"""
-        return self._http_code
+        return self._response.http_code
 
     @property
     def headers(self):
         """Read-only headers dict"""
-        return dict([h for h in [h.split(': ') for h in self._head_buf.getvalue().splitlines()] if len(h) == 2])
+        return self._response.headers
@@ -0,0 +1,380 @@
+# coding: utf-8
+
+import time
+import heapq
+from collections import deque
+from datetime import timedelta
+from itertools import count
+from .base import HttpBackend, AsyncHttpBackend, Response, request_args
+from .curl import CurlBackend
+from .util import clock
+
+class _Transfer(object):
+
+    """
+    A request queued on, or in flight in, a CurlMultiBackend
+    """
+
+    def __init__(self, request, follow, agent, retries, debug, callback):
+        self.request = request_args(request)
+        self.follow = follow
+        self.agent = agent
+        self.retries = retries
+        self.attempt = 1
+        self.debug = debug
+        self.callback = callback
+        self.worker = None
+        self.started = None
+        self.twin = None # the other copy of a hedged request
+        self.is_hedge = False
+        self.cancelled = False
+        self.failure = None # what the retry policy is told of the last attempt
+
+class CurlMultiBackend(HttpBackend, AsyncHttpBackend):
+
+    """
+    Concurrent curl backend, driving a pool of reused "easy" handles through
+    a single CurlMulti loop. A CurlSharedState may be given to share caches
+    with other backends, and a HedgePolicy to hedge slow requests.
+    """
+
+    def __init__(self, concurrency=10, share=None, hedge=None, *args, **kwargs):
+        super(CurlMultiBackend, self).__init__(*args, **kwargs)
+
+        import pycurl
+        self._pycurl = pycurl
+
+        self.concurrency = concurrency
+        self.hedge = hedge
+        self._share = share
+        self._multi = self._pycurl.CurlMulti()
+        self._idle = []
+        self._queue = deque()
+        self._delayed = [] # heap of (due, seq, transfer) waiting to retry
+        self._seq = count()
+        self._active = {}
+        self._resp = Response()
+
+    def _worker(self):
+        """Lease an easy handle from the pool, creating one if necessary"""
+        if self._idle:
+            worker = self._idle.pop()
+            worker._curl.reset()
+            worker._setup_defaults()
+            return worker
+
+        return CurlBackend(share=self._share)
+
+    def _start(self, transfer):
+        """Prepare a transfer and hand it to the multi handle"""
+        transfer.worker = self._worker()
+        transfer.worker.hooks = self.hooks
+        transfer.worker.retry_policy = self.retry_policy
+        transfer.worker._prepare(transfer.request['url'],
+                                 transfer.request['method'],
+                                 transfer.request['data'],
+                                 transfer.request['headers'],
+                                 transfer.follow,
+                                 transfer.agent,
+                                 transfer.debug,
+                                 transfer.request['sink'])
+        self._multi.add_handle(transfer.worker._curl)
+        self._active[transfer.worker._curl] = transfer
+        transfer.started = clock()
+        if not transfer.is_hedge and transfer.attempt == 1:
+            self.retry_policy.started()
+            if self.hedge is not None:
+                self.hedge.started(transfer.request)
+
+    def _finish(self, transfer, exception=None):
+        """Take a transfer out of the multi handle and return its Response"""
+        worker, transfer.worker = transfer.worker, None
+        self._multi.remove_handle(worker._curl)
+        del self._active[worker._curl]
+
+        if worker._sink_failure is not None:
+            # what the sink raised, rather than curl's write error
+            exception, worker._sink_failure = worker._sink_failure[1], None
+
+        transfer.failure = None if transfer.cancelled else \
+                           worker._failure(exception)
+
+        if exception is None:
+            resp = worker._complete(timedelta(
+                seconds=worker._curl.getinfo(self._pycurl.TOTAL_TIME)))
+        else:
+            resp = Response(url=transfer.request['url'], exception=exception)
+
+        self._idle.append(worker)
+        return resp
+
+    def _cancel(self, transfer):
+        """
+        Drop a transfer (and any hedge of it), whether queued or in flight,
+        without calling back
+        """
+        for each in (transfer, transfer.twin):
+            if each is None or each.cancelled:
+                continue
+            each.cancelled = True
+            if each.worker is not None:
+                self._finish(each, Exception("Transfer cancelled"))
+            elif each in self._queue:
+                self._queue.remove(each)
+            else:
+                self._delayed = [d for d in self._delayed if d[2] is not each]
+                heapq.heapify(self._delayed)
+
+    def _start_hedges(self):
+        """
+        Hedge the in-flight requests that are due it, returning the seconds
+        until the next is due, or None
+        """
+        now = clock()
+        due = None
+        for transfer in self._active.values():
+            if transfer.twin is not None or transfer.is_hedge or \
+               not self.hedge.eligible(transfer.request):
+                continue
+            delay = self.hedge.delay_for(transfer.request['url'])
+            wait = transfer.started + delay - now
+            if wait > 0:
+                due = wait if due is None else min(due, wait)
+            elif len(self._active) < self.concurrency and self.hedge.take():
+                hedge = _Transfer(transfer.request, transfer.follow,
+                                  transfer.agent, 0, transfer.debug,
+                                  transfer.callback)
+                hedge.is_hedge = True
+                hedge.twin, transfer.twin = transfer, hedge
+                self.hooks.fire('hedge',
+                                backend=self,
+                                url=transfer.request['url'],
+                                delay=delay)
+                self._start(hedge)
+        return due
+
+    def _failed(self, transfer, resp):
+        """
+        Did a finished transfer fail in a way the retry policy would retry,
+        were there retries and budget left?
+        """
+        if transfer.failure is None:
+            return resp.exception is not None
+        return self.retry_policy.delay(transfer.request['method'],
+                                       transfer.attempt,
+                                       **transfer.failure) is not None
+
+    def _retry_delay(self, transfer):
+        """
+        Seconds to wait before retrying a failed transfer, paid for from the
+        retry budget, or None not to retry
+        """
+        if transfer.retries <= 0 or transfer.failure is None:
+            return None
+        return self.retry_policy.retry(transfer.request['method'],
+                                       transfer.attempt,
+                                       **transfer.failure)
+
+    def _settle(self, transfer, resp, failed):
+        """
+        Resolve a finished copy of a hedged request: the first that didn't
+        fail wins and cancels its twin, while a failure leaves its twin to
+        carry on. Returns whether the request is done with.
+        """
+        twin = transfer.twin
+        if failed and not twin.cancelled:
+            # the twin may yet succeed, with whatever retries are left
+            twin.twin = None
+            twin.retries = max(twin.retries, transfer.retries)
+            return False
+
+        transfer.twin = twin.twin = None
+        self._cancel(twin)
+        if not failed:
+            self.hedge.observe(transfer.request['url'],
+                               resp.roundtrip.total_seconds(),
+                               hedge_won=transfer.is_hedge)
+        return True
+
+    def start(self, request, follow, agent, retries, debug, callback):
+        """Queue a request; it is started by poll() when there is capacity"""
+        transfer = _Transfer(request, follow, agent, retries, debug, callback)
+        self._queue.append(transfer)
+        return transfer
+
+    def poll(self, timeout):
+        """
+        Start queued transfers up to the concurrency cap, wait up to timeout
+        seconds for activity, and call back for those that completed. Returns
+        the number of requests still outstanding.
+        """
+        now = clock()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._queue.append(heapq.heappop(self._delayed)[2])
+
+        while self._queue and len(self._active) < self.concurrency:
+            self._start(self._queue.popleft())
+
+        retry_due = self._delayed[0][0] - now if self._delayed else None
+        if not self._active:
+            if retry_due is not None:
+                # nothing to do but wait out a backoff
+                time.sleep(max(0, min(timeout, retry_due)))
+            return len(self._queue) + len(self._delayed)
+
+        due = self._start_hedges() if self.hedge is not None else None
+        if retry_due is not None:
+            due = retry_due if due is None else min(due, retry_due)
+
+        while True:
+            ret, _ = self._multi.perform()
+            if ret != self._pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+        finished = []
+        while True:
+            queued, ok_list, err_list = self._multi.info_read()
+            for curl in ok_list:
+                transfer = self._active[curl]
+                finished.append((transfer, self._finish(transfer)))
+            for curl, errno, msg in err_list:
+                transfer = self._active[curl]
+                error = self._pycurl.error(errno, msg)
+                finished.append((transfer, self._finish(transfer, error)))
+            if queued == 0:
+                break
+
+        for transfer, resp in finished:
+            if transfer.cancelled:
+                continue # a twin won in this same batch
+            failed = self._failed(transfer, resp)
+            if transfer.twin is not None:
+                if not self._settle(transfer, resp, failed):
+                    continue
+            elif not failed and self.hedge is not None:
+                self.hedge.observe(transfer.request['url'],
+                                   resp.roundtrip.total_seconds())
+
+            delay = self._retry_delay(transfer) if failed else None
+            if delay is not None:
+                self.hooks.fire('retry',
+                                backend=self,
+                                url=transfer.request['url'],
+                                attempt=transfer.attempt,
+                                exception=resp.exception,
+                                http_code=resp.http_code,
+                                delay=delay)
+                transfer.retries -= 1
+                transfer.attempt += 1
+                heapq.heappush(self._delayed,
+                               (clock() + delay,
+                                self._seq.next(),
+                                transfer))
+            else:
+                transfer.callback(resp)
+
+        if not finished:
+            self._multi.select(timeout if due is None else min(timeout, due))
+
+        return len(self._queue) + len(self._delayed) + len(self._active)
+
+    def go_as_completed(self, requests, follow, agent, retries, debug,
+                        concurrency=None):
+        """
+        Visit many URLs concurrently, yielding (index, Response) pairs as each
+        transfer completes. No more than concurrency (and never more than
+        self.concurrency) transfers are in flight at once.
+        """
+        limit = min(concurrency or self.concurrency, self.concurrency)
+        requests = enumerate(requests)
+        outstanding = set()
+        completed = deque()
+
+        def collect(transfer, idx):
+            """Closure to collect a completed transfer"""
+            def callback(resp):
+                outstanding.discard(transfer)
+                completed.append((idx, resp))
+            transfer.callback = callback
+
+        try:
+            while True:
+                while len(outstanding) < limit:
+                    try:
+                        idx, request = requests.next()
+                    except StopIteration:
+                        break
+                    transfer = self.start(request, follow, agent, retries,
+                                          debug, None)
+                    collect(transfer, idx)
+                    outstanding.add(transfer)
+
+                if not outstanding and not completed:
+                    return
+
+                self.poll(1.0)
+
+                while completed:
+                    yield completed.popleft()
+        finally:
+            # abandoned part-way through; don't leave handles in the multi
+            for transfer in outstanding:
+                self._cancel(transfer)
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, returning a Response"""
+        self._resp = self.go_many([dict(url=url,
+                                        method=method,
+                                        data=data,
+                                        headers=headers,
+                                        auth=auth,
+                                        sink=sink)],
+                                  follow, agent, retries, debug)[0]
+
+        if self._resp.exception is not None:
+            raise self._resp.exception
+        return self._resp
+
+    def forget(self):
+        """Forget the last response, so that nothing of it can be read"""
+        self._resp = Response()
+
+    def companion(self):
+        """
+        A CurlMultiBackend sharing this one's CurlSharedState, where that
+        shares cookies
+        """
+        if self._share is None or 'LOCK_DATA_COOKIE' not in self._share.shared:
+            return None
+        return self._like(CurlMultiBackend(self.concurrency, self._share,
+                                           self.hedge))
+
+    @property
+    def src(self):
+        """Read-only page-source"""
+        return self._resp.src
+
+    @property
+    def url(self):
+        """Read-only current URL"""
+        return self._resp.url
+
+    @property
+    def roundtrip(self):
+        """Read-only request roundtrip timing"""
+        return self._resp.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        return self._resp.timing
+
+    @property
+    def http_code(self):
+        """Read-only last HTTP response code"""
+        return self._resp.http_code
+
+    @property
+    def headers(self):
+        """Read-only headers dict"""
+        return self._resp.headers
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+import threading
+from urlparse import urlsplit
+from ..hooks import Histogram
+
+class HedgePolicy(object):
+
+    """
+    When CurlMultiBackend should send a second copy (a hedge) of a slow,
+    idempotent request, taking whichever copy finishes first and cancelling
+    the other.
+
+    A request is hedged once it has been in flight for delay seconds; or,
+    with delay None, for longer than the given percentile of its host's
+    observed latencies (min_delay until warmup requests have been seen).
+    Hedges are paid for from a budget: each request earns budget hedges,
+    e.g. 0.05 for at most 5% extra load, and up to burst may be saved up.
+    """
+
+    methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, delay=None, percentile=95, min_delay=0.05, warmup=20,
+                 budget=0.05, burst=10):
+        self.delay = delay
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.warmup = warmup
+        self.budget = budget
+        self.burst = burst
+        self.latency = {} # host -> Histogram of seconds
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0 # hedges that finished before the request they copied
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url):
+        """The host whose latencies apply to a URL"""
+        return urlsplit(url).netloc
+
+    def eligible(self, request):
+        """May a request (see request_args) be hedged at all?"""
+        # a streamed body would reach the sink twice
+        return request['method'] in self.methods and request['sink'] is None
+
+    def started(self, request):
+        """Note a request being made, earning budget for hedges"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+    def delay_for(self, url):
+        """Seconds to wait for a response before hedging"""
+        if self.delay is not None:
+            return self.delay
+        histogram = self.latency.get(self._host(url))
+        if histogram is None or histogram.count < self.warmup:
+            return self.min_delay
+        return max(self.min_delay, histogram.percentile(self.percentile))
+
+    def take(self):
+        """Spend budget on a hedge, if there's enough"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def observe(self, url, seconds, hedge_won=False):
+        """Note how long a successful request took, and whether a hedge won"""
+        with self._lock:
+            host = self._host(url)
+            if host not in self.latency:
+                self.latency[host] = Histogram()
+            self.latency[host].add(seconds)
+            if hedge_won:
+                self.wins += 1
+
+    def stats(self):
+        """Hedge counts, and the fraction of hedges that won"""
+        with self._lock:
+            return dict(requests=self.requests,
+                        hedged=self.hedged,
+                        wins=self.wins,
+                        hedge_rate=float(self.hedged) / self.requests
+                                   if self.requests else None,
+                        win_rate=float(self.wins) / self.hedged
+                                 if self.hedged else None)
@@ -1,7 +1,9 @@
 # coding: utf-8
 
+from copy import copy
 from datetime import timedelta
-from .base import HttpBackend
+from .base import HttpBackend, AsyncHttpBackend, Response, sink_writer
+from .util import Timing
 
 class MockResponse(object):
 
@@ -14,22 +16,72 @@ class MockResponse(object):
         self.http_code = 200
         self.exception = None
         self.roundtrip = timedelta()
+        self.timing = None # defaults to a Timing of just the roundtrip
         self.headers = dict()
         self.redirect = None
         self.src = ''
 
+class NoMatchingResponse(LookupError):
+
+    """
+    No stored response matches a request. The message, which lists every
+    stored response, is only built if asked for.
+    """
+
+    def __init__(self, request, collection):
+        super(NoMatchingResponse, self).__init__()
+        self.request = request
+        self._collection = collection
+
+    def __str__(self):
+        return "Could not make a choice with " + \
+               "input data: %s, from choices: %s" % \
+                   (self.request,
+                    [dict(url=r['url'],
+                          method=r['method'],
+                          data=r['data'],
+                          headers=r['headers'])
+                     for r in self._collection])
+
 class ResponseCollection(object):
 
+    """
+    Mock responses, indexed by url, method and headers so that a lookup only
+    has to best-match the data of a handful of candidates.
+    """
+
     def __init__(self):
         self._responses = []
+        self._index = {}
+
+    def __iter__(self):
+        return iter(self._responses)
+
+    @staticmethod
+    def _key(url, method, headers):
+        """Index key for a request; headers must match exactly"""
+        if headers is not None:
+            headers = tuple(sorted(headers.items()))
+        return url, method, headers
 
     def add(self, mock, url, method='GET', data=None, headers=None):
         """Store a mock response."""
-        self._responses.append(dict(mock=mock,
-                                    url=url,
-                                    method=method,
-                                    data=data if not self._empty(data) else None,
-                                    headers=headers))
+        data = data if not self._empty(data) else None
+        try:
+            # precompute what best-matching the data needs
+            fingerprint = self._to_set(data) if type(data) is not str else None
+        except AttributeError:
+            fingerprint = None
+
+        response = dict(mock=mock,
+                        url=url,
+                        method=method,
+                        data=data,
+                        headers=headers,
+                        fingerprint=fingerprint)
+        self._responses.append(response)
+        self._index.setdefault(self._key(url, method, headers), []) \
+                   .append(response)
 
     @staticmethod
     def _to_set(dictionary):
@@ -48,13 +100,10 @@ class ResponseCollection(object):
         """
         data = data if not self._empty(data) else None
 
-        # reduce
-        potentials = [r for r in self._responses if \
-            r['url'] == url and \
-            r['method'] == method and \
-            r['headers'] == headers]
-
         try:
+            # reduce
+            potentials = self._index.get(self._key(url, method, headers), [])
+
             # ideally we don't have to best-match the data
             # like if it's None
             if data is None:
@@ -78,29 +127,24 @@ class ResponseCollection(object):
 
             # of well, best-match it is
             def difference_size(p):
-                return len(reference.difference(self._to_set(p['data'])))
+                return len(reference.difference(p['fingerprint']))
 
             # reduce by matching data
             reference = self._to_set(data)
             potentials_with_crossover = [p
                 for p in potentials
-                if len(reference.intersection(self._to_set(p['data']))) > 0]
+                if p['fingerprint'] and \
+                   not reference.isdisjoint(p['fingerprint'])]
             return min(potentials_with_crossover, key=difference_size)['mock']
 
-        except (LookupError, AttributeError, ValueError):
-            raise LookupError("Could not make a choice with " + \
-                    "input data: %s, from choices: %s" %
-                        (dict(url=url,
-                              method=method,
-                              data=data,
-                              headers=headers),
-                         [dict(url=r['url'],
-                               method=r['method'],
-                               data=r['data'],
-                               headers=r['headers'])
-                          for r in self._responses]))
-
-class MockBackend(HttpBackend):
+        except (LookupError, AttributeError, ValueError, TypeError):
+            raise NoMatchingResponse(dict(url=url,
+                                          method=method,
+                                          data=data,
+                                          headers=headers),
+                                     self)
+
+class MockBackend(HttpBackend, AsyncHttpBackend):
 
     """
     Mock response backend
@@ -110,45 +154,98 @@ class MockBackend(HttpBackend):
         super(MockBackend, self).__init__(*args, **kwargs)
 
         self.responses = ResponseCollection()
-        self._resp = None
-        self._url = None
+        self._resp = None # the MockResponse last picked
+        self._response = Response()
+        self._queue = []
 
-    def go(self, url, method, data, headers, auth, follow, agent, retries, debug):
-        """Visit a URL"""
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, returning a Response"""
 
         # pick the best-matching MockResponse
-        self._resp = self.responses.get(url, method, data, headers)
+        self._resp = mock = self.responses.get(url, method, data, headers)
+
+        if mock.exception is not None:
+            raise mock.exception
+
+        streamed = sink is not None and (not follow or mock.redirect is None)
+        resp = Response(src=None if streamed else mock.src,
+                        # text goes over the wire as UTF-8
+                        charset='utf-8' if isinstance(mock.src, unicode) else None,
+                        url=url,
+                        http_code=mock.http_code,
+                        headers=mock.headers,
+                        roundtrip=mock.roundtrip,
+                        timing=copy(mock.timing) if mock.timing is not None
+                                                 else Timing(total=mock.roundtrip))
+
+        # redirect (recurse) if neccessary
+        if follow and mock.redirect is not None:
+            self.hooks.fire('redirect',
+                            backend=self,
+                            url=url,
+                            final_url=mock.redirect,
+                            count=1)
+            final = self.go(mock.redirect, method, data, headers, auth, follow,
+                            agent, retries, debug, sink)
+            final.history.insert(0, resp)
+            return final
+
+        if streamed:
+            sink_writer(sink)(mock.src.encode('utf-8')
+                              if isinstance(mock.src, unicode) else mock.src)
+        self._response = resp
+        return resp
+
+    def forget(self):
+        """Forget the last response, so that nothing of it can be read"""
+        self._resp = None
+        self._response = Response()
 
-        if self._resp.exception is not None:
-            raise self._resp.exception
+    def companion(self):
+        """A backend like this one, answering from the same responses"""
+        backend = copy(self)
+        backend._queue = []
+        backend.forget()
+        return backend
 
-        self._url = url
+    def start(self, request, follow, agent, retries, debug, callback):
+        """Queue a request, to be answered by the next poll()"""
+        self._queue.append((request, follow, agent, retries, debug, callback))
 
-        # redirect (recurse) if neccessary
-        if follow and self._resp.redirect is not None:
-            self.go(self._resp.redirect, method, data, headers)
+    def poll(self, timeout):
+        """Answer every queued request"""
+        queue, self._queue = self._queue, []
+        for request, follow, agent, retries, debug, callback in queue:
+            callback(self._visit(request, follow, agent, retries, debug))
+
+        return len(self._queue)
 
     @property
     def src(self):
-        """Read-only page-source"""
-        return self._resp.src
+        """Read-only page-source, or None if the body was streamed"""
+        return self._response.src
 
     @property
     def url(self):
         """Read-only current URL"""
-        return self._url
+        return self._response.url
 
     @property
     def roundtrip(self):
         """Read-only request roundtrip timing"""
-        return self._resp.roundtrip
+        return self._response.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        return self._response.timing
 
     @property
     def http_code(self):
         """Read-only last HTTP response code"""
-        return self._resp.http_code
+        return self._response.http_code
 
     @property
     def headers(self):
         """Read-only headers dict"""
-        return self._resp.headers
+        return self._response.headers
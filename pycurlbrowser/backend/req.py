@@ -1,7 +1,30 @@
 # coding: utf-8
-from .util import StopWatch
+from datetime import timedelta
+from .base import HttpBackend, Response, sink_writer
+from .util import StopWatch, Timing, Headers
 
-class RequestsBackend(object):
+def _headers(r):
+    """Every header of a Requests response, repeats included where possible"""
+    raw = getattr(r.raw, 'headers', None)
+    if hasattr(raw, 'iteritems'):
+        # urllib3 keeps each value of a repeated header
+        return Headers(raw.iteritems())
+    return Headers(r.headers)
+
+def _connect_failed(ex):
+    """Did a Requests exception happen before the request was sent?"""
+    from requests.exceptions import ConnectTimeout, ConnectionError
+    if isinstance(ex, ConnectTimeout):
+        return True
+    if not isinstance(ex, ConnectionError) or not ex.args:
+        return False
+    try:
+        from requests.packages.urllib3.exceptions import NewConnectionError
+    except ImportError:
+        return False
+    return isinstance(getattr(ex.args[0], 'reason', None), NewConnectionError)
+
+class RequestsBackend(HttpBackend):
 
     """
     HTTP backend using Requests
@@ -9,55 +32,154 @@ class RequestsBackend(object):
 
     def __init__(self, *args, **kwargs):
         super(RequestsBackend, self).__init__(*args, **kwargs)
-        self._r = None
-        self._roundtrip = None
+        self._response = Response()
+        self.chunk_size = 64 * 1024 # for streamed bodies
         import requests
         self._session = requests.session()
 
-    def go(self, url, method, data, headers, auth, follow, agent, retries, debug):
-        """Visit a URL"""
+    def companion(self):
+        """A RequestsBackend sharing this one's cookies"""
+        backend = RequestsBackend()
+        # cookielib's jar locks itself
+        backend._session.cookies = self._session.cookies
+        return self._like(backend)
+
+    def _retry_delay(self, method, attempt, retries, exception=None, r=None):
+        """
+        Seconds to wait before retrying the attempt just made, which failed
+        with exception or else gave the response r, or None not to retry
+        """
+        if attempt > retries:
+            return None
+        if exception is not None:
+            return self.retry_policy.retry(method, attempt,
+                                           exception=exception,
+                                           connect_failed=_connect_failed(exception))
+        return self.retry_policy.retry(method, attempt,
+                                       http_code=r.status_code,
+                                       headers=r.headers)
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        """Visit a URL, returning a Response"""
+        self.retry_policy.started()
+
         with StopWatch() as sw:
-            exception = Exception("Dummy exception")
+            attempt = 0
 
-            while retries >= 0 and exception is not None:
-                retries -= 1
+            while True:
+                attempt += 1
+                exception = None
+                r = None
+                sunk = False
                 try:
-                    self._r = self._session.request(method=method,
-                                                    url=url,
-                                                    data=data,
-                                                    headers=headers,
-                                                    auth=auth,
-                                                    allow_redirects=follow)
-                    exception = None
+                    # always stream, so the body can be timed on its own, and
+                    # a response to be retried needn't be read
+                    r = self._session.request(method=method,
+                                              url=url,
+                                              data=data,
+                                              headers=headers,
+                                              auth=auth,
+                                              allow_redirects=follow,
+                                              stream=True)
+                    delay = self._retry_delay(method, attempt, retries, r=r)
+                    if delay is None:
+                        with StopWatch() as transfer:
+                            if sink is not None:
+                                write = sink_writer(sink)
+                                try:
+                                    for chunk in r.iter_content(self.chunk_size):
+                                        sunk = True
+                                        write(chunk)
+                                finally:
+                                    # back to the pool, even if the sink gave up
+                                    r.close()
+                            else:
+                                r.content
                 except Exception, ex:
                     exception = ex
+                    # the sink can't give back what it's been given
+                    delay = None if sunk else \
+                            self._retry_delay(method, attempt, retries,
+                                              exception=ex)
+
+                if delay is None:
+                    break
+
+                if r is not None:
+                    r.close()
+                self.hooks.fire('retry',
+                                backend=self,
+                                url=url,
+                                attempt=attempt,
+                                exception=exception,
+                                http_code=r.status_code if exception is None
+                                                        else None,
+                                delay=delay)
+                self.retry_policy.wait(delay)
 
             if exception is not None:
+                if r is not None:
+                    r.close()
                 raise exception
 
-        self._roundtrip = sw.total
+        if r.history:
+            self.hooks.fire('redirect',
+                            backend=self,
+                            url=url,
+                            final_url=r.url,
+                            count=len(r.history))
+
+        streamed = sink is not None
+        # Requests can only tell us when the headers of each hop arrived
+        self._response = Response(
+            # text may mean guessing the charset; only if it's wanted
+            decode=None if streamed else lambda: r.text,
+            content=None if streamed else r.content,
+            charset=r.encoding, # None if Requests would guess
+            url=r.url,
+            http_code=r.status_code,
+            headers=_headers(r),
+            roundtrip=sw.total,
+            timing=Timing(total=sw.total,
+                          first_byte=r.elapsed,
+                          transfer=transfer.total,
+                          redirect=sum((h.elapsed for h in r.history),
+                                       timedelta())),
+            history=[Response(url=h.url,
+                              http_code=h.status_code,
+                              headers=_headers(h),
+                              roundtrip=h.elapsed,
+                              timing=Timing(total=h.elapsed,
+                                            first_byte=h.elapsed))
+                     for h in r.history])
+        return self._response
 
     @property
     def src(self):
-        """Read-only page-source"""
-        return self._r.text
+        """Read-only page-source, or None if the body was streamed"""
+        return self._response.src
 
     @property
     def url(self):
         """Read-only current URL"""
-        return self._r.url
+        return self._response.url
 
     @property
     def roundtrip(self):
         """Read-only request roundtrip timing"""
-        return self._roundtrip
+        return self._response.roundtrip
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing"""
+        return self._response.timing
 
     @property
     def http_code(self):
         """Read-only last HTTP response code"""
-        return self._r.status_code
+        return self._response.http_code
 
     @property
     def headers(self):
         """Read-only headers dict"""
-        return self._r.headers
+        return self._response.headers
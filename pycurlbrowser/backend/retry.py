@@ -0,0 +1,130 @@
+# coding: utf-8
+
+import time
+import random
+import threading
+from email.utils import parsedate_tz, mktime_tz
+
+IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE')
+
+class RetryBudget(object):
+
+    """
+    A limit on retries shared by every backend using it: each request made
+    earns ratio retries, and up to reserve may be saved up for a burst. When
+    an upstream is failing, retries stop at a fraction of the load rather
+    than multiplying it.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.requests = 0
+        self.retries = 0
+        self.refused = 0
+        self._tokens = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """A request is being made"""
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Spend a retry, returning whether there was one to spend"""
+        with self._lock:
+            if self._tokens < 1:
+                self.refused += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+retry_budget = RetryBudget()
+
+def retry_after(value):
+    """Seconds asked for by a Retry-After header, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = parsedate_tz(value)
+        return max(0.0, mktime_tz(parsed) - time.time()) if parsed else None
+
+class RetryPolicy(object):
+
+    """
+    When, and after how long, a backend retries a failed request. The
+    number of retries is still the retries argument to go().
+
+    Transport errors are retried for idempotent methods, and for any method
+    where the connection was never made. Responses with one of statuses are
+    retried for idempotent methods. Each retry waits an exponential backoff
+    (backoff * factor ** (attempt - 1), at most max_backoff) with full
+    jitter, or as long as Retry-After asks, if that's no more than
+    max_retry_after. Every retry is paid for from budget, by default the
+    process-wide retry_budget.
+    """
+
+    def __init__(self, backoff=0.1, factor=2.0, max_backoff=10.0, jitter=True,
+                 statuses=(429, 502, 503), methods=IDEMPOTENT,
+                 max_retry_after=60.0, budget=None):
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = statuses
+        self.methods = methods
+        self.max_retry_after = max_retry_after
+        self.budget = budget if budget is not None else retry_budget
+
+    def started(self):
+        """A request is being made (not counting its retries)"""
+        self.budget.deposit()
+
+    def _backoff(self, attempt):
+        """Seconds to wait after a failed attempt, jittered"""
+        delay = min(self.max_backoff,
+                    self.backoff * self.factor ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def delay(self, method, attempt, exception=None, connect_failed=False,
+              http_code=None, headers=None):
+        """
+        Is a failed attempt (the attempt-th) one to retry, budget aside?
+        Returns the seconds to wait first, or None. A failure is an
+        exception, where connect_failed says the request was never sent; or
+        an http_code, with its headers.
+        """
+        idempotent = method in self.methods
+        if exception is not None:
+            if not idempotent and not connect_failed:
+                return None
+            delay = self._backoff(attempt)
+        elif http_code in self.statuses and idempotent:
+            delay = self._backoff(attempt)
+            asked = retry_after(headers.get('Retry-After')) if headers else None
+            if asked is not None:
+                if asked > self.max_retry_after:
+                    return None
+                delay = asked
+        else:
+            return None
+        return delay
+
+    def retry(self, method, attempt, exception=None, connect_failed=False,
+              http_code=None, headers=None):
+        """
+        Should a failed attempt be retried? As delay(), but the retry is paid
+        for from budget, and None is returned when it can't be.
+        """
+        delay = self.delay(method, attempt, exception, connect_failed,
+                           http_code, headers)
+        return delay if delay is not None and self.budget.withdraw() else None
+
+    def wait(self, delay):
+        """Wait before retrying"""
+        if delay > 0:
+            time.sleep(delay)
@@ -1,6 +1,16 @@
 # coding: utf-8
 
-from datetime import datetime
+from collections import Mapping
+from datetime import timedelta
+
+try:
+    from time import monotonic as clock
+except ImportError:
+    try:
+        from monotonic import monotonic as clock
+    except ImportError:
+        # no monotonic clock to be had; wall-clock time will have to do
+        from time import time as clock
 
 class StopWatch(object):
 
@@ -13,8 +23,125 @@ class StopWatch(object):
         self.total = None
 
     def __enter__(self):
-        self._start = datetime.now()
+        self._start = clock()
         return self
 
     def __exit__(self, typ, value, traceback):
-        self.total = datetime.now() - self._start
+        self.total = timedelta(seconds=clock() - self._start)
+
+class Timing(object):
+
+    """
+    Where the time went for a request. Phases are timedeltas, and byte counts
+    are ints; anything a backend can't measure is None.
+
+        total:      the whole request, including any retries
+        dns:        name lookup
+        connect:    TCP connection
+        tls:        TLS handshake
+        first_byte: waiting for the server, from request sent to first byte
+        transfer:   receiving the response, from first byte to last
+        redirect:   following redirects, before the final request
+        parse:      parsing the page (filled in by Browser)
+        bytes_up:   bytes sent, headers included
+        bytes_down: bytes received, headers included
+    """
+
+    phases = ('total', 'dns', 'connect', 'tls', 'first_byte', 'transfer',
+              'redirect', 'parse')
+    counters = ('bytes_up', 'bytes_down')
+
+    def __init__(self, **kwargs):
+        for name in self.phases + self.counters:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError("Unknown timings: %s" % ', '.join(kwargs))
+
+    def as_dict(self):
+        """Phases in seconds, and byte counts, e.g. for logging"""
+        values = dict((name, getattr(self, name)) for name in self.counters)
+        for name in self.phases:
+            value = getattr(self, name)
+            values[name] = None if value is None else value.total_seconds()
+        return values
+
+    def __repr__(self):
+        return "<Timing %s>" % ' '.join('%s=%s' % i
+                                        for i in sorted(self.as_dict().items())
+                                        if i[1] is not None)
+
+class Headers(Mapping):
+
+    """
+    Response headers: case-insensitive, keeping every value of a repeated
+    header such as Set-Cookie. Made from raw header lines (parsed only when
+    first read), a dict, or (name, value) pairs.
+
+        headers['content-type']       # repeated values are joined by ", "
+        headers.getall('Set-Cookie')  # every value, as a list
+    """
+
+    def __init__(self, items=None, lines=None):
+        if isinstance(items, Headers):
+            items = items.allitems()
+        elif hasattr(items, 'items'):
+            items = items.items()
+        self._items = list(items) if items is not None else None
+        self._lines = lines
+        self._index = None
+        self._names = None
+
+    def _parse(self):
+        """Index the headers by lower-cased name, the first time it's needed"""
+        if self._index is not None:
+            return self._index
+
+        if self._items is None:
+            self._items = []
+            for line in self._lines or ():
+                if line[:1] in (' ', '\t') and self._items:
+                    # a folded continuation of the previous header
+                    name, value = self._items[-1]
+                    self._items[-1] = (name, '%s %s' % (value, line.strip()))
+                    continue
+                name, sep, value = line.partition(':')
+                if sep and name and ' ' not in name:
+                    self._items.append((name, value.strip()))
+            self._lines = None
+
+        index = {}
+        names = []
+        for name, value in self._items:
+            key = name.lower()
+            if key not in index:
+                index[key] = []
+                names.append(name)
+            index[key].append(value)
+        self._index, self._names = index, names
+        return index
+
+    def __getitem__(self, name):
+        values = self._parse()[name.lower()]
+        return values[0] if len(values) == 1 else ', '.join(map(str, values))
+
+    def __contains__(self, name):
+        return name.lower() in self._parse()
+
+    def __iter__(self):
+        self._parse()
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._parse())
+
+    def getall(self, name):
+        """Every value of a header, in the order received"""
+        return list(self._parse().get(name.lower(), ()))
+
+    def allitems(self):
+        """Every (name, value) pair, repeats included, in the order received"""
+        self._parse()
+        return list(self._items)
+
+    def __repr__(self):
+        return "<Headers %r>" % self.allitems()
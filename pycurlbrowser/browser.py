@@ -8,7 +8,13 @@ Includes canned responses for testing.
 """
 
 from urllib import urlencode
-from .backend import HttpBackend, RequestsBackend
+from urlparse import urljoin
+from StringIO import StringIO
+from datetime import timedelta
+from .backend import HttpBackend, default_backend
+from .backend.base import request_args
+from .backend.util import StopWatch
+from .selectors import selectors
 
 def url_for_get(url, data):
     """Encode the given data onto a URL"""
@@ -19,20 +25,73 @@ def url_for_get(url, data):
 
     return url
 
+class FeedParser(object):
+
+    """
+    A sink that parses HTML as it arrives, keeping a copy of the source.
+    """
+
+    def __init__(self):
+        # lazy-load LXML
+        from lxml.html import HTMLParser
+        self._parser = HTMLParser()
+        self._buf = StringIO()
+        self._error = None
+        self.parse_time = timedelta()
+
+    def write(self, chunk):
+        """Take the next chunk of the body"""
+        self._buf.write(chunk)
+        if self._error is None:
+            with StopWatch() as sw:
+                try:
+                    self._parser.feed(chunk)
+                except Exception, ex:
+                    self._error = ex
+            self.parse_time += sw.total
+
+    @property
+    def src(self):
+        """Everything written so far"""
+        return self._buf.getvalue()
+
+    def close(self):
+        """Finish parsing, returning the tree or None if it can't be parsed"""
+        if self._error is not None:
+            return None
+        with StopWatch() as sw:
+            try:
+                tree = self._parser.close()
+            except Exception:
+                tree = None
+        self.parse_time += sw.total
+        return tree
+
 class Browser(HttpBackend):
 
     """
     Emulate a normal browser.
 
     A lazy-loading backend-agnostic minimal web browser.
+
+    Each browser gets its own backend (and so its own session and cookies)
+    unless one is passed in; pass the same backend to several browsers to
+    share it.
     """
 
-    def __init__(self, url=None, backend=RequestsBackend()):
+    def __init__(self, url=None, backend=None):
         self._backend = backend
 
         self.retries = 0
         self.follow = True
         self.debug = False
+        self.parse_incrementally = False
+        self.absolute_links = False # rewrite every link when parsing
+        self.prefetcher = None # see prefetch()
+        self.prefetch_candidates = None
+        self._src = None
+        self._response = None # as returned by the backend
+        self._served = None # a prefetched Response being shown
         # TODO: come up with a new user-agent, supply version
         self.agent = "Mozilla/5.0 (X11; Linux i686) " +\
                      "AppleWebKit/534.24 (KHTML, like Gecko) " +\
@@ -44,21 +103,66 @@ class Browser(HttpBackend):
         if url is not None:
             self.go(url)
 
+    @property
+    def backend(self):
+        """The HTTP backend in use, created on first use if none was given"""
+        if self._backend is None:
+            self._backend = self._default_backend()
+        return self._backend
+
+    def _default_backend(self):
+        """Create a backend for this browser alone"""
+        return default_backend()
+
     def _reset_state(self):
         """Clear out the browser state"""
+        self._prefetched = False
         self._tree = None
         self._form = None
         self._form_data = {}
 
+    @staticmethod
+    def _request(url, method='GET', data=None, headers=None, auth=None,
+                 sink=None):
+        """Build a request for the backend, encoding GET data onto the URL"""
+        method = method.upper()
+
+        if data is not None and method == 'GET':
+            url = url_for_get(url, data)
+            data = None
+
+        return dict(url=url,
+                    method=method,
+                    data=data,
+                    headers=headers,
+                    auth=auth,
+                    sink=sink)
+
+    @property
+    def _page(self):
+        """Where the current page comes from: a prefetch, or the backend"""
+        return self._served if self._served is not None else self.backend
+
     @property
     def roundtrip(self):
         """Read-only request roundtrip timing"""
-        return self._backend.roundtrip
+        return self._page.roundtrip
 
     @property
     def headers(self):
         """Read-only headers dict"""
-        return self._backend.headers
+        return self._page.headers
+
+    @property
+    def timing(self):
+        """Read-only breakdown of the last request's timing, with parse time"""
+        return self._page.timing
+
+    def _record_parse(self, parse_time):
+        """Note how long parsing the current page took"""
+        timing = self.timing
+        if timing is not None:
+            timing.parse = parse_time
 
     def go(self,
            url,
@@ -69,32 +173,186 @@ class Browser(HttpBackend):
            follow=None,
            agent=None,
            retries=None,
-           debug=None):
-        """Go to a url, return the HTTP response code"""
-        method = method.upper()
-
-        if data is not None and method == 'GET':
-            url = url_for_get(url, data)
-            data = None
+           debug=None,
+           sink=None):
+        """
+        Go to a url, return the HTTP response code. If a sink is given the
+        body is streamed to it (see backend.base.sink_writer) and src is None.
 
-        self._backend.go(url=url,
-                         method=method,
-                         data=data,
-                         headers=headers,
-                         auth=auth,
-                         follow=follow or self.follow,
-                         retries=retries or self.retries,
-                         agent=agent or self.agent,
-                         debug=debug or self.debug)
+        With parse_incrementally set, the page is parsed as it downloads.
+        """
+        request = self._request(url, method, data, headers, auth, sink)
+        self.hooks.fire('before_request',
+                        browser=self,
+                        url=request['url'],
+                        method=request['method'])
+
+        served = None
+        if self.prefetcher is not None and request['method'] == 'GET' and \
+           not (request['data'] or request['headers'] or request['auth'] or
+                request['sink']):
+            served = self.prefetcher.take(request['url'])
+
+        feed = None
+        if self.parse_incrementally and sink is None and served is None:
+            feed = request['sink'] = FeedParser()
+            self.hooks.fire('parse_start', browser=self, url=request['url'])
+
+        self._src = None
+        self._response = None
+        self._served = None
+        try:
+            if served is None:
+                self._response = self.backend.go(follow=follow or self.follow,
+                                                 retries=retries or self.retries,
+                                                 agent=agent or self.agent,
+                                                 debug=debug or self.debug,
+                                                 **request)
+        except Exception, ex:
+            self.hooks.fire('after_response',
+                            browser=self,
+                            url=request['url'],
+                            method=request['method'],
+                            http_code=None,
+                            roundtrip=None,
+                            timing=None,
+                            exception=ex,
+                            served=False,
+                            cached=False)
+            raise
+
+        self._served = served
+        self.hooks.fire('after_response',
+                        browser=self,
+                        url=self.url,
+                        method=request['method'],
+                        http_code=self.http_code,
+                        roundtrip=self.roundtrip,
+                        timing=self.timing,
+                        exception=None,
+                        served=served is not None,
+                        cached=served is None and
+                               getattr(self.backend, 'status', None)
+                               in ('hit', 'reused'))
 
         self._reset_state()
 
+        if feed is not None:
+            self._src = feed.src
+            # anything unparseable is left for parse() to complain about
+            self._tree = feed.close()
+            if self._tree is not None:
+                self._prepare_tree()
+                self._record_parse(feed.parse_time)
+            self.hooks.fire('parse_end',
+                            browser=self,
+                            url=self.url,
+                            parse_time=feed.parse_time)
+        elif served is None:
+            # a caching backend may hold the tree parsed last time around
+            self._tree = getattr(self.backend, 'tree', None)
+            if self._tree is not None:
+                self._prepare_tree()
+
         return self.http_code
 
-    def save(self, filename):
-        """Save the current page"""
-        with open(filename, 'w') as fp:
-            fp.write(self.src)
+    def prefetch(self, candidates, concurrency=2, max_pages=16,
+                 max_bytes=8 * 1024 * 1024, ttl=30, backend_factory=None):
+        """
+        Fetch likely next pages in the background as each page is parsed,
+        so that going to one of them is instant. candidates is an XPath
+        selecting links (or their hrefs), or a predicate taking each link's
+        absolute URL. The rest configure the Prefetcher; by default its
+        backends are companions of this browser's, sharing its cookies.
+        Returns the Prefetcher, or None if there's no backend_factory and
+        the backend can't share its cookies, as pages fetched without them
+        might not be the ones this browser would be given.
+        """
+        # lazy-load prefetch, which needs the backends
+        from .prefetch import Prefetcher, sharing_cookies
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.prefetcher = self.prefetch_candidates = None
+        if backend_factory is None:
+            backend_factory = sharing_cookies(self.backend)
+            if backend_factory is None:
+                return None
+        self.prefetch_candidates = candidates
+        self.prefetcher = Prefetcher(concurrency=concurrency,
+                                     max_pages=max_pages,
+                                     max_bytes=max_bytes,
+                                     ttl=ttl,
+                                     backend_factory=backend_factory)
+        return self.prefetcher
+
+    def _prefetch(self):
+        """Start fetching the current page's candidate links"""
+        self._prefetched = True
+        candidates = self.prefetch_candidates
+        if callable(candidates):
+            urls = [url for url in self.links() if candidates(url)]
+        else:
+            urls = []
+            for found in self.xpath(candidates):
+                if hasattr(found, 'get'):
+                    found = found.get('href')
+                if found:
+                    urls.append(self.absolute_url(found))
+        for url in urls:
+            if url != self.url:
+                self.prefetcher.add(url, self.follow, self.agent)
+
+    def go_as_completed(self,
+                        requests,
+                        follow=None,
+                        agent=None,
+                        retries=None,
+                        debug=None,
+                        concurrency=None):
+        """
+        Visit many URLs, concurrently where the backend allows, yielding
+        (index, Response) pairs as each completes. The current page is not
+        changed.
+        """
+        return self.backend.go_as_completed((self._request(**request_args(r))
+                                             for r in requests),
+                                            follow=follow or self.follow,
+                                            agent=agent or self.agent,
+                                            retries=retries or self.retries,
+                                            debug=debug or self.debug,
+                                            concurrency=concurrency)
+
+    def go_many(self,
+                requests,
+                follow=None,
+                agent=None,
+                retries=None,
+                debug=None,
+                concurrency=None):
+        """
+        Visit many URLs, concurrently where the backend allows, returning a
+        list of Responses in input order. The current page is not changed.
+        """
+        return self.backend.go_many((self._request(**request_args(r))
+                                     for r in requests),
+                                    follow=follow or self.follow,
+                                    agent=agent or self.agent,
+                                    retries=retries or self.retries,
+                                    debug=debug or self.debug,
+                                    concurrency=concurrency)
+
+    def save(self, filename, url=None, **kwargs):
+        """
+        Save the current page, or if a url is given, go there and stream the
+        body straight to the file. Other arguments are passed on to go().
+        """
+        if url is None:
+            with open(filename, 'w') as fp:
+                fp.write(self.src)
+            return self.http_code
+
+        with open(filename, 'wb') as fp:
+            return self.go(url, sink=fp, **kwargs)
 
     def save_pretty(self, filename):
         """Save the current page, after lxml has prettified it"""
@@ -108,12 +366,50 @@ class Browser(HttpBackend):
     def parse(self):
         """Parse the current page into a node tree"""
         if self._tree is not None:
+            if self.prefetcher is not None and not self._prefetched:
+                self._prefetch()
             return
 
         # lazy-load LXML
         from lxml.html import fromstring
-        self._tree = fromstring(self.src)
-        self._tree.make_links_absolute(self.url)
+        self.hooks.fire('parse_start', browser=self, url=self.url)
+        with StopWatch() as sw:
+            self._tree = fromstring(self.src)
+            if hasattr(self.backend, 'tree') and self._served is None:
+                # the backend keeps the tree as parsed; this page gets a copy
+                self.backend.tree = self._tree
+                kept = self.backend.tree
+                if kept is not None:
+                    self._tree = kept
+            self._prepare_tree()
+        self._record_parse(sw.total)
+        self.hooks.fire('parse_end',
+                        browser=self,
+                        url=self.url,
+                        parse_time=sw.total)
+
+        if self.prefetcher is not None and not self._prefetched:
+            self._prefetch()
+
+    def _prepare_tree(self):
+        """
+        Tell a freshly parsed tree where it came from, so that lxml resolves
+        form actions; other links are resolved as they're used, unless
+        absolute_links is set.
+        """
+        self._tree.getroottree().docinfo.URL = self.url
+        if self.absolute_links:
+            self._tree.make_links_absolute(self.url)
+
+    def absolute_url(self, href):
+        """Resolve a link on the current page, honouring any <base href>"""
+        base = self.xpath('//base/@href')
+        return urljoin(urljoin(self.url, base[0]) if base else self.url,
+                       href.strip())
+
+    def links(self):
+        """Absolute URLs of the links on the current page"""
+        return [self.absolute_url(href) for href in self.xpath('//a/@href')]
 
     # form selection/submission
 
@@ -147,7 +443,8 @@ class Browser(HttpBackend):
         """Get the options for a dropdown"""
         assert self._form is not None, \
             "A form must be selected: %s" % self.forms
-        return self._form.xpath('.//select[@name="%s"]//option' % select_name)
+        return selectors.xpath('.//select[@name=$name]//option')(self._form,
+                                                                 name=select_name)
 
     def form_dropdown_options(self, select_name):
         """List options for the given dropdown"""
@@ -212,40 +509,60 @@ class Browser(HttpBackend):
         """Submit data, intelligently, to the given action URL"""
         assert action is not None, "action must be supplied"
         assert method is not None, "method must be supplied"
+        self.hooks.fire('form_submit',
+                        browser=self,
+                        action=action,
+                        method=method,
+                        data=data)
         return self.go(action, method=method, data=data)
 
     def follow_link(self, name_or_xpath):
         """Emulate clicking a link"""
         if name_or_xpath[0] == '/':
-            xpath = name_or_xpath
+            link = self.xpath(name_or_xpath)[0]
         else:
-            xpath = '//*[text()="%s"]/ancestor::a' % name_or_xpath
-        link = self.xpath(xpath)[0]
-        return self.go(link.get('href'))
+            link = self.xpath('//*[text()=$text]/ancestor::a',
+                              text=name_or_xpath)[0]
+        return self.go(self.absolute_url(link.get('href')))
 
     # helpers
 
     @property
     def http_code(self):
         """Read-only last HTTP response code"""
-        return self._backend.http_code
+        return self._page.http_code
 
     @property
     def src(self):
         """Read-only page-source"""
-        return self._backend.src
+        if self._src is not None:
+            return self._src
+        return self._page.src
+
+    @property
+    def content(self):
+        """Read-only page body as bytes, or None if it was streamed"""
+        if self._src is not None:
+            return self._src
+        if self._served is not None:
+            return self._served.content
+        if self._response is not None:
+            return self._response.content
+        # backends written before go() returned a Response
+        src = self.backend.src
+        return src.encode('utf-8') if isinstance(src, unicode) else src
 
     @property
     def url(self):
         """Read-only current URL"""
-        return self._backend.url
+        return self._page.url
 
     @property
     def title(self):
         """Read-only convenience for getting the HTML title"""
         self.parse()
         try:
-            return self._tree.xpath("/html/head/title/text()")[0].strip()
+            return self.xpath("/html/head/title/text()")[0].strip()
         except IndexError:
             return None
 
@@ -267,7 +584,7 @@ class Browser(HttpBackend):
         """Names of dropdowns for selected form"""
         assert self._form is not None, \
             "A form must be selected: %s" % self.forms
-        return self._form.xpath('.//select')
+        return selectors.xpath('.//select')(self._form)
 
     @property
     def form_dropdowns(self):
@@ -290,7 +607,7 @@ class Browser(HttpBackend):
         assert self._form is not None, \
             "A form must be selected: %s" % self.forms
 
-        submit_lst = self._form.xpath(".//input[@type='submit']")
+        submit_lst = selectors.xpath(".//input[@type='submit']")(self._form)
         assert len(submit_lst) > 0, \
             "The selected form must contain a submit button"
 
@@ -303,7 +620,21 @@ class Browser(HttpBackend):
             submits.append(items)
         return submits
 
-    def xpath(self, *argv, **kwargs):
-        """Execute an XPATH against the current node tree"""
+    def xpath(self, expression, namespaces=None, extensions=None,
+              smart_strings=True, regexp=True, **variables):
+        """
+        Execute an XPATH against the current node tree. The named arguments
+        are lxml's; other keyword arguments are available to the expression
+        as $variables.
+        """
+        self.parse()
+        return selectors.xpath(expression,
+                               namespaces,
+                               extensions,
+                               smart_strings,
+                               regexp)(self._tree, **variables)
+
+    def css(self, selector):
+        """Select nodes from the current node tree with a CSS selector"""
         self.parse()
-        return self._tree.xpath(*argv, **kwargs)
+        return selectors.css(selector)(self._tree)
@@ -0,0 +1,130 @@
+# coding: utf-8
+
+"""
+Codecs for REST payloads: each encodes Python primitives to a byte string
+with a media type, and decodes byte strings straight back.
+"""
+
+_json = None
+
+def _load_json():
+    """lazy-load a JSON module, preferring simplejson"""
+    global _json
+    if _json is None:
+        try:
+            import simplejson as _json
+        except ImportError:
+            import json as _json
+    return _json
+
+def media_type(content_type):
+    """The media type of a Content-Type header, e.g. application/json"""
+    return (content_type or '').split(';')[0].strip().lower()
+
+class JsonCodec(object):
+
+    """
+    JSON by way of simplejson, or the standard library's json; or another
+    module with dumps and loads, if given
+    """
+
+    content_type = 'text/json'
+    media_types = ('application/json', 'text/json')
+
+    def __init__(self, module=None, content_type=None):
+        self._module = module
+        if content_type is not None:
+            self.content_type = content_type
+
+    @property
+    def module(self):
+        """The JSON module in use"""
+        if self._module is None:
+            self._module = _load_json()
+        return self._module
+
+    def dumps(self, data):
+        """Encode to a byte string"""
+        encoded = self.module.dumps(data)
+        return encoded.encode('utf-8') if isinstance(encoded, unicode) \
+                                       else encoded
+
+    def loads(self, src):
+        """Decode a byte string (or text)"""
+        return self.module.loads(src)
+
+class FastJsonCodec(JsonCodec):
+
+    """
+    JSON by way of ujson, a C codec several times quicker than json
+    """
+
+    def __init__(self, content_type=None):
+        # lazy-load ujson
+        import ujson
+        super(FastJsonCodec, self).__init__(ujson, content_type)
+
+class MsgpackCodec(object):
+
+    """
+    MessagePack: compact binary, and quick to encode and decode
+    """
+
+    content_type = 'application/msgpack'
+    media_types = ('application/msgpack', 'application/x-msgpack')
+
+    def __init__(self):
+        # lazy-load msgpack
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, data):
+        """Encode to a byte string"""
+        return self._msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, src):
+        """Decode a byte string"""
+        return self._msgpack.unpackb(src, raw=False)
+
+class Negotiator(object):
+
+    """
+    Codec choice for a client. Requests are encoded with codec until the
+    server answers in one of accept, preferred in order, after which the
+    most preferred of those it has answered in is used. Responses are
+    decoded according to their Content-Type.
+    """
+
+    def __init__(self, codec, accept=None):
+        self.codec = codec
+        self.accept = list(accept or [])
+        self.current = codec
+
+    def _rank(self, codec):
+        """Preference for a codec: lower is better"""
+        try:
+            return self.accept.index(codec)
+        except ValueError:
+            return len(self.accept)
+
+    @property
+    def accept_header(self):
+        """An Accept header value, or None if nothing is to be negotiated"""
+        if not self.accept:
+            return None
+        types = []
+        for i, codec in enumerate(self.accept):
+            q = max(0.1, 1 - 0.1 * i)
+            for media in codec.media_types:
+                types.append(media if i == 0 else '%s;q=%.1f' % (media, q))
+        return ', '.join(types)
+
+    def for_response(self, content_type):
+        """The codec to decode a response with, noting what the server speaks"""
+        media = media_type(content_type)
+        for codec in self.accept:
+            if media in codec.media_types:
+                if self._rank(codec) < self._rank(self.current):
+                    self.current = codec
+                return codec
+        return self.codec
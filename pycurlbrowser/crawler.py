@@ -0,0 +1,398 @@
+# coding: utf-8
+
+"""
+Crawling: a URL frontier that keeps each host busy up to its politeness
+limits, and a Crawler driving a pool of AsyncBrowsers from it, e.g.
+
+    def scrape(browser, depth):
+        store(browser.url, browser.title)
+        return browser.links()
+
+    crawler = Crawler(scrape, concurrency=50, per_host=2, delay=0.5)
+    crawler.add('http://example.com/')
+    crawler.run()
+"""
+
+import re
+import math
+import heapq
+import struct
+import time
+from hashlib import sha1
+from itertools import count
+from urlparse import urlsplit, urlunsplit
+from robotparser import RobotFileParser
+from .async_browser import AsyncBrowser
+from .backend.util import clock
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def remove_dot_segments(path):
+    """Resolve . and .. in a URL path, as RFC 3986 section 5.2.4"""
+    output = []
+    for segment in path.split('/'):
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if path.endswith(('/.', '/..')):
+        output.append('')
+    return '/'.join(output)
+
+def normalize_url(url):
+    """
+    Canonical form of a URL for deduplication: lower-case scheme and host,
+    no default port, no fragment, no dot segments, and at least a / path
+    """
+    scheme, netloc, path, query, _ = urlsplit(url.strip())
+    scheme = scheme.lower()
+
+    userinfo, _, hostport = netloc.rpartition('@')
+    host, _, port = hostport.lower().partition(':')
+    if port and DEFAULT_PORTS.get(scheme) == int(port):
+        port = ''
+    netloc = '%s%s%s' % (userinfo + '@' if userinfo else '',
+                         host,
+                         ':' + port if port else '')
+
+    return urlunsplit((scheme,
+                       netloc,
+                       remove_dot_segments(path) or '/',
+                       query,
+                       ''))
+
+def host_of(url):
+    """The scheme and host:port that politeness limits apply to"""
+    scheme, netloc, _, _, _ = urlsplit(url)
+    return '%s://%s' % (scheme, netloc.rpartition('@')[2])
+
+class BloomFilter(object):
+
+    """
+    A fixed-size set that can't list its members, and answers "seen" for a
+    small fraction (error_rate) of things it hasn't. Use it as the Frontier's
+    seen set when a plain set of every URL would be too big.
+    """
+
+    def __init__(self, capacity=10 * 1000 * 1000, error_rate=0.001):
+        self.bits = int(math.ceil(-capacity * math.log(error_rate) /
+                                  math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / float(capacity) *
+                                       math.log(2))))
+        self._array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        """Bits for an item, by double hashing"""
+        if isinstance(item, unicode):
+            item = item.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', sha1(item).digest()[:16])
+        return [(h1 + i * h2) % self.bits for i in xrange(self.hashes)]
+
+    def add(self, item):
+        """Add an item"""
+        new = False
+        for pos in self._positions(item):
+            if not self._array[pos >> 3] & (1 << (pos & 7)):
+                self._array[pos >> 3] |= 1 << (pos & 7)
+                new = True
+        if new:
+            self.count += 1
+
+    def __contains__(self, item):
+        return all(self._array[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    def __len__(self):
+        # approximate: a false positive on add() isn't counted
+        return self.count
+
+class _Host(object):
+
+    """
+    Per-host state in a Frontier
+    """
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+        self.pending = [] # heap of (priority, seq, url, depth)
+        self.active = 0
+        self.next_start = 0
+        self.scheduled = False
+
+class Frontier(object):
+
+    """
+    URLs waiting to be crawled.
+
+    pop() gives the highest priority (lowest number) URL of any host that
+    may be visited now: one with fewer than per_host requests active, and
+    whose last request started at least its delay ago. Call done() as each
+    finishes. URLs are normalized and skipped if seen before.
+    """
+
+    def __init__(self, per_host=2, delay=1.0, seen=None):
+        self.per_host = per_host
+        self.delay = delay
+        self.seen = seen if seen is not None else set()
+        self._hosts = {}
+        self._waiting = [] # heap of (next_start, seq, host)
+        self._ready = [] # heap of (priority, seq, host)
+        self._seq = count()
+        self._pending = 0
+
+    def _host(self, name):
+        """Fetch a host's state, creating it if necessary"""
+        try:
+            return self._hosts[name]
+        except KeyError:
+            host = self._hosts[name] = _Host(name, self.delay)
+            return host
+
+    def set_delay(self, name, delay):
+        """Set the delay between request starts for a host, e.g. from robots"""
+        self._host(name).delay = delay
+
+    def _schedule(self, host):
+        """Queue a host for its next request, if it can make one"""
+        if not host.scheduled and host.pending and host.active < self.per_host:
+            host.scheduled = True
+            heapq.heappush(self._waiting,
+                           (host.next_start, self._seq.next(), host))
+
+    def add(self, url, priority=0, depth=0):
+        """Queue a URL unless it's been seen, returning whether it was queued"""
+        url = normalize_url(url)
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+
+        host = self._host(host_of(url))
+        heapq.heappush(host.pending, (priority, self._seq.next(), url, depth))
+        self._pending += 1
+        self._schedule(host)
+        return True
+
+    def pop(self):
+        """Take the next URL that may be visited now as (url, depth), or None"""
+        now = clock()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, host = heapq.heappop(self._waiting)
+            heapq.heappush(self._ready,
+                           (host.pending[0][0], self._seq.next(), host))
+
+        if not self._ready:
+            return None
+
+        _, _, host = heapq.heappop(self._ready)
+        _, _, url, depth = heapq.heappop(host.pending)
+        self._pending -= 1
+        host.active += 1
+        host.next_start = now + host.delay
+        host.scheduled = False
+        self._schedule(host)
+        return url, depth
+
+    def done(self, url):
+        """A URL given by pop() has been visited"""
+        host = self._hosts[host_of(url)]
+        host.active -= 1
+        self._schedule(host)
+
+    def wait(self):
+        """Seconds until pop() may give a URL, or None if it's waiting on done()"""
+        if self._ready:
+            return 0
+        if self._waiting:
+            return max(0, self._waiting[0][0] - clock())
+        return None
+
+    def __len__(self):
+        return self._pending
+
+class RobotsCache(object):
+
+    """
+    Parsed robots.txt files by host, each kept for ttl seconds
+    """
+
+    crawl_delay = re.compile(r'^\s*crawl-delay\s*:\s*([0-9.]+)', re.I | re.M)
+
+    def __init__(self, agent, ttl=24 * 60 * 60):
+        self.agent = agent
+        self.ttl = ttl
+        self._hosts = {} # host -> (parser, crawl delay, expires)
+
+    @staticmethod
+    def url(host):
+        """Where a host's robots.txt is"""
+        return host + '/robots.txt'
+
+    def known(self, host):
+        """Is there an unexpired robots.txt for the host?"""
+        entry = self._hosts.get(host)
+        return entry is not None and entry[2] > time.time()
+
+    def update(self, host, http_code, src):
+        """
+        Take a host's robots.txt response: a missing one (4xx) allows
+        everything, an unavailable one (5xx, or None for a failed request)
+        allows nothing. Returns the crawl delay asked for, or None.
+        """
+        parser = RobotFileParser(self.url(host))
+        delay = None
+        if http_code is not None and 200 <= http_code < 300:
+            parser.parse((src or '').splitlines())
+            match = self.crawl_delay.search(src or '')
+            if match is not None:
+                delay = float(match.group(1))
+        elif http_code is not None and 400 <= http_code < 500:
+            parser.allow_all = True
+        else:
+            parser.disallow_all = True
+        self._hosts[host] = (parser, delay, time.time() + self.ttl)
+        return delay
+
+    def allowed(self, url):
+        """May the URL be crawled? Its host's robots.txt must be known"""
+        return self._hosts[host_of(url)][0].can_fetch(self.agent, url)
+
+def follow_links(browser, depth):
+    """The default Crawler handler: follow every link on HTML pages"""
+    if browser.http_code != 200 or not browser.src or \
+       'html' not in (browser.headers or {}).get('Content-Type', 'text/html'):
+        return []
+    return browser.links()
+
+class Crawler(object):
+
+    """
+    Crawl from a Frontier with a pool of AsyncBrowsers sharing one
+    AsyncHttpBackend (a CurlMultiBackend unless another is given).
+
+    handler(browser, depth) is called for each page visited and returns the
+    URLs to crawl next, optionally as (url, priority) pairs; by default
+    priority is depth, for a breadth-first crawl. Pages that fail, or whose
+    handler raises, are recorded in errors as (url, exception).
+    """
+
+    def __init__(self, handler=follow_links, backend=None, concurrency=10,
+                 per_host=2, delay=1.0, robots=True, max_depth=None,
+                 max_pages=None, seen=None, agent=None):
+        if backend is None:
+            from .backend import CurlMultiBackend
+            backend = CurlMultiBackend(concurrency=concurrency)
+        self.backend = backend
+        self.handler = handler
+        self.frontier = Frontier(per_host=per_host, delay=delay, seen=seen)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.pages = 0
+        self.errors = []
+
+        self._idle = [AsyncBrowser(backend=backend)
+                      for _ in range(concurrency)]
+        if agent is not None:
+            for browser in self._idle:
+                browser.agent = agent
+        self.agent = self._idle[0].agent
+
+        self.robots = RobotsCache(self.agent) if robots else None
+        self._held = {} # host -> [(url, priority, depth)] awaiting robots.txt
+        self._active = 0
+
+    def add(self, url, priority=None, depth=0):
+        """Queue a URL to be crawled"""
+        if self.max_depth is not None and depth > self.max_depth:
+            return
+        if priority is None:
+            priority = depth
+
+        host = host_of(normalize_url(url))
+        if self.robots is not None and not self.robots.known(host):
+            if host not in self._held:
+                self._held[host] = []
+                self._fetch_robots(host)
+            self._held[host].append((url, priority, depth))
+            return
+
+        if self.robots is None or self.robots.allowed(normalize_url(url)):
+            self.frontier.add(url, priority, depth)
+
+    def _fetch_robots(self, host):
+        """Start fetching a host's robots.txt, holding its URLs until then"""
+        def callback(resp):
+            """Closure to release the host's URLs once robots.txt is known"""
+            self._active -= 1
+            delay = self.robots.update(host,
+                                       resp.http_code if resp.exception is None
+                                                      else None,
+                                       resp.src)
+            if delay is not None:
+                self.frontier.set_delay(host, max(delay, self.frontier.delay))
+            for url, priority, depth in self._held.pop(host):
+                self.add(url, priority, depth)
+
+        self._active += 1
+        self.backend.start(self.robots.url(host),
+                           follow=True,
+                           agent=self.agent,
+                           retries=0,
+                           debug=False,
+                           callback=callback)
+
+    def _visit(self, browser, url, depth):
+        """Start visiting a URL with an idle browser"""
+        self._active += 1
+        self.pages += 1
+        pending = browser.go(url)
+
+        def waiter():
+            """Closure to handle the page and free the browser"""
+            self._active -= 1
+            self.frontier.done(url)
+            self._idle.append(browser)
+
+            resp = pending.resp
+            if resp.exception is not None:
+                self.errors.append((url, resp.exception))
+                return
+
+            try:
+                found = self.handler(browser, depth) or []
+                for link in found:
+                    if isinstance(link, tuple):
+                        self.add(link[0], link[1], depth + 1)
+                    else:
+                        self.add(link, depth=depth + 1)
+            except Exception, ex:
+                self.errors.append((url, ex))
+
+        pending.wait(waiter)
+
+    def _finished(self):
+        """Is there nothing left to do?"""
+        if self.max_pages is not None and self.pages >= self.max_pages:
+            return self._active == 0
+        return self._active == 0 and not self._held and not len(self.frontier)
+
+    def run(self, timeout=1.0):
+        """Crawl until the frontier is exhausted, or max_pages are visited"""
+        while not self._finished():
+            while self._idle and (self.max_pages is None or
+                                  self.pages < self.max_pages):
+                next_url = self.frontier.pop()
+                if next_url is None:
+                    break
+                self._visit(self._idle.pop(), *next_url)
+
+            # the frontier's wait only matters with a browser to start on it
+            wait = self.frontier.wait() if self._idle else None
+            wait = timeout if wait is None else min(wait, timeout)
+            if self._active:
+                self.backend.poll(wait)
+            elif wait:
+                # every host is waiting out its delay
+                time.sleep(wait)
@@ -0,0 +1,202 @@
+# coding: utf-8
+
+"""
+Instrumentation: subscribe to what browsers and backends are doing.
+
+Events, and the details passed with them as keyword arguments:
+
+    before_request: browser, url, method
+    after_response: browser, url, method, http_code, roundtrip, timing,
+                    exception (None unless the request failed), served
+                    (whether a prefetch served the page, unrequested),
+                    cached (whether the backend answered it from a cache)
+    retry:          backend, url, attempt, exception (None if retrying a
+                    response), http_code, delay (seconds before retrying)
+    redirect:       backend, url, final_url, count
+    hedge:          backend, url, delay (seconds waited before hedging)
+    parse_start:    browser, url
+    parse_end:      browser, url, parse_time
+    form_submit:    browser, action, method, data
+
+Subscribers are called as subscriber(event, **details). Browsers and
+backends use the process-wide hooks unless given their own, e.g.
+
+    stats = RequestStats()
+    stats.subscribe()
+"""
+
+import threading
+from bisect import bisect_left
+from urlparse import urlparse
+
+EVENTS = ('before_request',
+          'after_response',
+          'retry',
+          'redirect',
+          'hedge',
+          'parse_start',
+          'parse_end',
+          'form_submit')
+
+class Hooks(object):
+
+    """
+    Event subscriptions. Firing an event nobody subscribes to costs a dict
+    lookup.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, event, subscriber):
+        """Call subscriber whenever event fires"""
+        if event not in EVENTS:
+            raise ValueError("Unknown event: %s" % event)
+        with self._lock:
+            # copy on write, so that firing needn't lock
+            self._subscribers[event] = self._subscribers.get(event, ()) + \
+                                       (subscriber,)
+
+    def unsubscribe(self, event, subscriber):
+        """Stop calling subscriber for event"""
+        with self._lock:
+            self._subscribers[event] = tuple(s for s in
+                                             self._subscribers.get(event, ())
+                                             if s != subscriber)
+
+    def fire(self, event, **details):
+        """Tell the event's subscribers about it"""
+        for subscriber in self._subscribers.get(event, ()):
+            subscriber(event, **details)
+
+hooks = Hooks()
+
+class Histogram(object):
+
+    """
+    Counts of values in fixed, exponentially growing buckets, good for
+    estimating percentiles of latencies in seconds
+    """
+
+    def __init__(self, smallest=0.001, largest=120.0, growth=1.25):
+        self.bounds = []
+        bound = smallest
+        while bound < largest:
+            self.bounds.append(bound)
+            bound *= growth
+        self.bounds.append(largest)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        """Count a value"""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, or None"""
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return self.bounds[i] if i < len(self.bounds) \
+                                      else float('inf')
+        return float('inf')
+
+    @property
+    def mean(self):
+        """Mean of the values counted, or None"""
+        return self.sum / self.count if self.count else None
+
+def status_class(http_code):
+    """e.g. '2xx', or 'error' for a failed request"""
+    if http_code is None:
+        return 'error'
+    return '%dxx' % (http_code // 100)
+
+class RequestStats(object):
+
+    """
+    Subscriber keeping request counts and latency histograms per host and
+    status class, plus retry, redirect and hedge counts per host. Failed
+    requests, cache hits and pages served by a prefetch have no latency
+    worth the name, and are only counted, per host.
+    """
+
+    def __init__(self):
+        self.latency = {} # (host, status class) -> Histogram
+        self.failed = {} # host -> count
+        self.cached = {} # host -> count
+        self.served = {} # host -> count
+        self.retries = {} # host -> count
+        self.redirects = {} # host -> count
+        self.hedges = {} # host -> count
+        self._lock = threading.Lock()
+
+    def subscribe(self, to=None):
+        """Start collecting from the given hooks, or the process-wide ones"""
+        to = to if to is not None else hooks
+        for event in ('after_response', 'retry', 'redirect', 'hedge'):
+            to.subscribe(event, self)
+        return self
+
+    def unsubscribe(self, to=None):
+        """Stop collecting"""
+        to = to if to is not None else hooks
+        for event in ('after_response', 'retry', 'redirect', 'hedge'):
+            to.unsubscribe(event, self)
+
+    def __call__(self, event, url, **details):
+        host = urlparse(url).netloc
+
+        with self._lock:
+            if event == 'after_response':
+                if details['exception'] is not None:
+                    self.failed[host] = self.failed.get(host, 0) + 1
+                elif details['served']:
+                    self.served[host] = self.served.get(host, 0) + 1
+                elif details['cached']:
+                    self.cached[host] = self.cached.get(host, 0) + 1
+                else:
+                    key = (host, status_class(details['http_code']))
+                    if key not in self.latency:
+                        self.latency[key] = Histogram()
+                    roundtrip = details['roundtrip']
+                    self.latency[key].add(roundtrip.total_seconds()
+                                          if roundtrip is not None else 0.0)
+            elif event == 'retry':
+                self.retries[host] = self.retries.get(host, 0) + 1
+            elif event == 'redirect':
+                self.redirects[host] = self.redirects.get(host, 0) + \
+                                       details['count']
+            elif event == 'hedge':
+                self.hedges[host] = self.hedges.get(host, 0) + 1
+
+    def requests(self, host=None, status=None):
+        """
+        How many requests completed, optionally for a host/status class;
+        failures are of status class 'error'
+        """
+        count = sum(h.count for (h_host, h_status), h in self.latency.items()
+                    if host in (None, h_host) and status in (None, h_status))
+        if status in (None, 'error'):
+            count += sum(n for h_host, n in self.failed.items()
+                         if host in (None, h_host))
+        return count
+
+    def snapshot(self):
+        """Counts, mean and tail latencies (seconds) by host and status class"""
+        with self._lock:
+            return dict(('%s %s' % key,
+                         dict(count=h.count,
+                              mean=h.mean,
+                              p50=h.percentile(50),
+                              p90=h.percentile(90),
+                              p99=h.percentile(99)))
+                        for key, h in self.latency.items())
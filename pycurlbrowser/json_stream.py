@@ -0,0 +1,138 @@
+# coding: utf-8
+
+"""
+Incremental decoding of the items of a JSON array, as its text arrives.
+"""
+
+import re
+
+SPECIAL = re.compile(r'["\[\]{},:]')
+STRING_SPECIAL = re.compile(r'["\\]')
+
+class JsonItemDecoder(object):
+
+    """
+    Decode the items of one array in a JSON document, fed in chunks: the
+    top-level array, or the one at path, a dotted list of object keys such
+    as "data.items". Only the item being decoded is held in memory, and
+    everything outside the array is skipped.
+
+        decoder = JsonItemDecoder('results')
+        for chunk in chunks:
+            for item in decoder.feed(chunk):
+                ...
+    """
+
+    def __init__(self, path=None, loads=None):
+        if loads is None:
+            from .codec import _load_json
+            loads = _load_json().loads
+        self.path = path.split('.') if path else []
+        self._loads = loads
+        self._buf = ''
+        self._pos = 0
+        self._stack = [] # [container, key, expecting a key?]
+        self._in_string = False
+        self._item_start = None # of the item being decoded
+        self._key_start = None # of the object key being read
+        self.items = 0
+
+    def _at_target(self):
+        """Are we directly inside the array being decoded?"""
+        depth = len(self.path)
+        if len(self._stack) != depth + 1 or self._stack[depth][0] != '[':
+            return False
+        for i in range(depth):
+            if self._stack[i][0] != '{' or self._stack[i][1] != self.path[i]:
+                return False
+        return True
+
+    def _emit(self, end, out):
+        """Decode the item that has just ended"""
+        out.append(self._loads(self._buf[self._item_start:end]))
+        self._item_start = None
+        self.items += 1
+
+    def _scalar_start(self, end):
+        """Note the start of a number, true, false or null before end"""
+        if self._item_start is None and self._at_target():
+            skipped = self._buf[self._pos:end]
+            stripped = skipped.lstrip()
+            if stripped:
+                self._item_start = self._pos + len(skipped) - len(stripped)
+
+    def feed(self, chunk):
+        """Take the next chunk of the document, returning any items completed"""
+        out = []
+        buf = self._buf = self._buf + chunk
+
+        while self._pos < len(buf):
+            if self._in_string:
+                match = STRING_SPECIAL.search(buf, self._pos)
+                if match is None:
+                    self._pos = len(buf)
+                    break
+                if match.group() == '\\':
+                    self._pos = match.end() + 1 # skip what's escaped
+                    continue
+                self._pos = match.end()
+                self._in_string = False
+                if self._key_start is not None:
+                    self._stack[-1][1] = self._loads(buf[self._key_start:self._pos])
+                    self._key_start = None
+                elif self._item_start is not None and self._at_target():
+                    self._emit(self._pos, out)
+                continue
+
+            match = SPECIAL.search(buf, self._pos)
+            if match is None:
+                self._scalar_start(len(buf))
+                self._pos = len(buf)
+                break
+
+            char, i = match.group(), match.start()
+            if char in ']}:' and not self._stack:
+                raise ValueError("Malformed JSON document")
+            if char in ',]':
+                self._scalar_start(i)
+                if self._item_start is not None and self._at_target():
+                    self._emit(i, out)
+
+            if char == '"':
+                self._in_string = True
+                if self._stack and self._stack[-1][2]:
+                    self._key_start = i
+                elif self._item_start is None and self._at_target():
+                    self._item_start = i
+            elif char in '[{':
+                if self._item_start is None and self._at_target():
+                    self._item_start = i
+                self._stack.append([char, None, char == '{'])
+            elif char in ']}':
+                self._stack.pop()
+                if self._item_start is not None and self._at_target():
+                    self._emit(i + 1, out)
+            elif char == ',':
+                if self._stack and self._stack[-1][0] == '{':
+                    self._stack[-1][2] = True
+            elif char == ':':
+                self._stack[-1][2] = False
+            self._pos = i + 1
+
+        # forget what's been dealt with
+        keep = min(p for p in (self._item_start, self._key_start, self._pos)
+                   if p is not None)
+        keep = min(keep, len(buf))
+        self._buf = buf[keep:]
+        self._pos -= keep
+        if self._item_start is not None:
+            self._item_start -= keep
+        if self._key_start is not None:
+            self._key_start -= keep
+
+        return out
+
+    def close(self):
+        """Check that the document ended, raising ValueError if not"""
+        if self._stack or self._in_string or self._buf.strip():
+            raise ValueError("Truncated JSON document")
@@ -0,0 +1,170 @@
+# coding: utf-8
+
+"""
+A pool of Browsers for worker threads, e.g.
+
+    pool = BrowserPool(size=8, share_cookies=True)
+
+    def work(url):
+        with pool.browser() as browser:
+            browser.go(url)
+            return browser.title
+"""
+
+import threading
+from contextlib import contextmanager
+from .browser import Browser
+from .backend import default_backend, CurlBackend, CurlSharedState, RequestsBackend
+from .backend.util import clock
+from .hooks import Histogram
+
+class PoolExhausted(Exception):
+
+    """
+    No browser became free within the timeout
+    """
+
+class BrowserPool(object):
+
+    """
+    Lease Browsers to threads, one thread per browser at a time.
+
+    Browsers are created as needed, up to size, each with a backend of its
+    own (from backend_factory, by default the preferred backend) that stays
+    warm between leases. Curl backends share DNS, SSL session and connection
+    caches; with share_cookies, every browser also shares one set of cookies.
+    Page state, including the backend's last response, and settings are
+    reset as each browser is returned, and any prefetching is stopped.
+    """
+
+    settings = ('retries', 'follow', 'debug', 'parse_incrementally',
+                'absolute_links', 'agent')
+
+    def __init__(self, size=10, backend_factory=None, share_cookies=False):
+        self.size = size
+        self.backend_factory = backend_factory or default_backend
+        self.share_cookies = share_cookies
+        self.created = 0
+        self.leases = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.wait_time = Histogram() # seconds spent waiting for a browser
+        self._idle = []
+        self._defaults = {}
+        self._curl_share = None
+        self._cookies = None
+        self._cond = threading.Condition()
+
+    def _share(self, backend):
+        """Join a new backend to the state shared across the pool"""
+        if isinstance(backend, CurlBackend):
+            if self._curl_share is None:
+                self._curl_share = CurlSharedState(cookies=self.share_cookies)
+            backend._share = self._curl_share
+            self._curl_share.attach(backend._curl)
+        elif isinstance(backend, RequestsBackend) and self.share_cookies:
+            # cookielib's jar locks itself
+            if self._cookies is None:
+                self._cookies = backend._session.cookies
+            backend._session.cookies = self._cookies
+
+    def _create(self):
+        """Make a browser for the pool"""
+        backend = self.backend_factory()
+        self._share(backend)
+        browser = Browser(backend=backend)
+        self._defaults[browser] = dict((name, getattr(browser, name))
+                                       for name in self.settings)
+        return browser
+
+    def acquire(self, timeout=None):
+        """
+        Lease a browser, waiting up to timeout seconds (forever if None) for
+        one to be free; raises PoolExhausted if none is
+        """
+        create = False
+        start = clock()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while not self._idle and self.created >= self.size:
+                    remaining = None if timeout is None \
+                                     else timeout - (clock() - start)
+                    if remaining is not None and remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolExhausted("No browser free after %ss"
+                                            % timeout)
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    browser = self._idle.pop()
+                else:
+                    self.created += 1
+                    create = True
+            finally:
+                self.waiting -= 1
+            self.leases += 1
+            self.wait_time.add(clock() - start)
+
+        if create:
+            # outside the lock: making a backend may be slow
+            try:
+                browser = self._create()
+            except Exception:
+                with self._cond:
+                    self.created -= 1
+                    self._cond.notify()
+                raise
+
+        return browser
+
+    def release(self, browser, discard=False):
+        """
+        Return a leased browser, or with discard, drop it from the pool.
+        Raises ValueError for a browser that isn't leased from this pool.
+        """
+        with self._cond:
+            if browser not in self._defaults or browser in self._idle:
+                raise ValueError("Browser is not leased from this pool")
+            # closed once the pool is unlocked
+            prefetcher = browser.prefetcher
+            browser.prefetcher = browser.prefetch_candidates = None
+            if discard:
+                self.created -= 1
+                del self._defaults[browser]
+            else:
+                browser._reset_state()
+                browser._src = None
+                browser._response = None
+                browser._served = None
+                browser.backend.forget()
+                for name, value in self._defaults[browser].items():
+                    setattr(browser, name, value)
+                self._idle.append(browser)
+            self._cond.notify()
+
+        if prefetcher is not None:
+            prefetcher.close()
+
+    @contextmanager
+    def browser(self, timeout=None):
+        """Lease a browser for the duration of a with block"""
+        browser = self.acquire(timeout)
+        try:
+            yield browser
+        finally:
+            self.release(browser)
+
+    def stats(self):
+        """Pool sizing and wait-time metrics, with waits in seconds"""
+        with self._cond:
+            return dict(size=self.size,
+                        created=self.created,
+                        idle=len(self._idle),
+                        in_use=self.created - len(self._idle),
+                        waiting=self.waiting,
+                        leases=self.leases,
+                        timeouts=self.timeouts,
+                        wait_mean=self.wait_time.mean,
+                        wait_p50=self.wait_time.percentile(50),
+                        wait_p99=self.wait_time.percentile(99))
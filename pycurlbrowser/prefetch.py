@@ -0,0 +1,189 @@
+# coding: utf-8
+
+"""
+Speculative fetching of the pages a Browser is likely to visit next, e.g.
+
+    browser = Browser()
+    browser.prefetch('//a[@rel="next"]/@href')
+    browser.go('http://example.com/list')
+    while browser.xpath('//a[@rel="next"]'):
+        browser.follow_link('//a[@rel="next"]') # served from the prefetch
+"""
+
+import threading
+from copy import copy
+from collections import OrderedDict
+from datetime import timedelta
+from Queue import Queue
+from .backend import default_backend
+from .backend.base import Response
+from .backend.util import clock, Timing
+
+class Prefetcher(object):
+
+    """
+    Fetch URLs in the background, keeping the responses until asked for.
+
+    Up to concurrency fetches run at once, each thread with a backend of its
+    own from backend_factory, which is called in the thread creating the
+    Prefetcher; at most max_pages wait to start, and any more are dropped.
+    Fetched pages are kept, least recently fetched evicted first, within
+    max_pages and max_bytes of bodies, for up to ttl seconds; each is given
+    out once.
+    """
+
+    def __init__(self, concurrency=2, max_pages=16, max_bytes=8 * 1024 * 1024,
+                 ttl=30, backend_factory=None):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend_factory = backend_factory or default_backend
+        self.bytes = 0
+        self.fetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0 # not fetched, for want of room in the queue
+        self.wasted = 0 # fetched, but evicted or expired unused
+        self._pages = OrderedDict() # url -> (expires, Response)
+        self._queued = set()
+        self._in_flight = set()
+        self._idle = 0 # threads waiting for a URL to fetch
+        self._queue = Queue() # bounded by max_pages in add()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = []
+        for _ in range(concurrency):
+            thread = threading.Thread(target=self._work,
+                                      args=(self.backend_factory(),))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def _size(resp):
+        """Bytes of body held by a Response"""
+        return len(resp.src or '')
+
+    def _evict(self, now):
+        """Drop expired pages, then the oldest while over budget"""
+        for url in list(self._pages):
+            expires, resp = self._pages[url]
+            if expires <= now or len(self._pages) > self.max_pages or \
+               self.bytes > self.max_bytes:
+                del self._pages[url]
+                self.bytes -= self._size(resp)
+                self.wasted += 1
+
+    def _work(self, backend):
+        """Fetch queued URLs, for as long as the prefetcher is open"""
+        while True:
+            with self._cond:
+                self._idle += 1
+                self._cond.notify_all()
+            item = self._queue.get()
+            if item is None:
+                return
+            url, follow, agent = item
+            with self._cond:
+                self._idle -= 1
+                self._cond.notify_all() # take() may stop waiting for a thread
+                if url not in self._queued:
+                    continue # taken before it was started
+                self._queued.discard(url)
+                self._in_flight.add(url)
+
+            try:
+                resp = backend.go(url, 'GET', None, None, None, follow, agent,
+                                  0, False)
+                if resp is None:
+                    resp = Response.from_backend(backend)
+            except Exception:
+                resp = None
+
+            with self._cond:
+                self._in_flight.discard(url)
+                if resp is not None and self._size(resp) <= self.max_bytes:
+                    self.fetched += 1
+                    self._pages[url] = (clock() + self.ttl, resp)
+                    self.bytes += self._size(resp)
+                    self._evict(clock())
+                self._cond.notify_all()
+
+    def add(self, url, follow=True, agent=None):
+        """Fetch a URL in the background, unless it's held or on its way"""
+        with self._cond:
+            if self._closed or url in self._pages or url in self._queued or \
+               url in self._in_flight:
+                return
+            if len(self._queued) >= self.max_pages:
+                self.dropped += 1
+                return
+            self._queue.put_nowait((url, follow, agent))
+            self._queued.add(url)
+
+    def take(self, url):
+        """
+        The fetched Response for a URL, waiting for it if it's being
+        fetched or about to be, or None if it wasn't prefetched, the fetch
+        failed, or it's still waiting for a thread (it's then dropped)
+        """
+        with self._cond:
+            while url in self._queued and self._idle:
+                self._cond.wait()
+            self._queued.discard(url)
+            while url in self._in_flight:
+                self._cond.wait()
+            entry = self._pages.pop(url, None)
+            if entry is not None:
+                self.bytes -= self._size(entry[1])
+            if entry is None or entry[0] <= clock():
+                self.misses += 1
+                if entry is not None:
+                    self.wasted += 1
+                return None
+            self.hits += 1
+
+        # it's ready: report the wait as nothing
+        resp = copy(entry[1])
+        resp.roundtrip = timedelta()
+        resp.timing = Timing(total=timedelta())
+        return resp
+
+    def close(self):
+        """
+        Stop the background threads without waiting for them: fetches not
+        yet started are dropped, and those under way left to finish
+        """
+        with self._cond:
+            self._closed = True
+            self._queued.clear()
+            self._cond.notify_all()
+        for _ in self._threads:
+            self._queue.put_nowait(None)
+
+    def stats(self):
+        """Counts of pages fetched, hits, misses, dropped and wasted"""
+        with self._cond:
+            return dict(fetched=self.fetched,
+                        hits=self.hits,
+                        misses=self.misses,
+                        dropped=self.dropped,
+                        wasted=self.wasted,
+                        pages=len(self._pages),
+                        bytes=self.bytes)
+
+def sharing_cookies(backend):
+    """
+    A backend factory for Prefetcher whose backends are companions of the
+    given backend, sharing its cookies; or None if it can't have any. Both
+    are to be called in the thread using the backend.
+    """
+    spare = backend.companion()
+    if spare is None:
+        return None
+    spare = [spare]
+
+    def factory():
+        """Closure making a backend to prefetch with"""
+        return spare.pop() if spare else backend.companion()
+    return factory
@@ -4,11 +4,17 @@
 REST functionality based off pycurlbrowser's Browser.
 """
 
-try:
-    import simplejson as json
-except ImportError:
-    import json
+import re
+import threading
+from Queue import Queue, Empty, Full
+from collections import deque
+from urlparse import urljoin
 from . import Browser
+from .browser import url_for_get
+from .backend import Response
+from .backend.cache import header
+from .json_stream import JsonItemDecoder
+from .codec import _load_json, JsonCodec, Negotiator
 
 class StatusInformational(Exception):
 
@@ -34,6 +40,13 @@ class StatusServerError(Exception):
     Represent 5xx status codes
     """
 
+class StreamAbandoned(Exception):
+
+    """
+    Raised from a stream's sink to stop the download once its consumer has
+    gone
+    """
+
 def status_factory(status):
     """Post exceptions based on HTTP status codes"""
     if   100 <= status < 200:
@@ -47,6 +60,64 @@ def status_factory(status):
 
     raise ValueError("Unsupported error code: %d" % status)
 
+def prefetched(iterable, depth):
+    """
+    Iterate in a background thread, keeping up to depth items fetched ahead
+    of the caller. Exceptions are raised in the caller, in turn. Once the
+    caller is done, the thread is waited for.
+    """
+    cond = threading.Condition()
+    fetched = deque()
+    state = dict(ahead=0, stop=False)
+    done = object()
+
+    def run():
+        """Closure to fetch items until done, or no longer wanted"""
+        iterator = iter(iterable)
+        while True:
+            with cond:
+                while state['ahead'] >= depth and not state['stop']:
+                    cond.wait()
+                if state['stop']:
+                    return
+
+            try:
+                entry = (iterator.next(), None)
+            except StopIteration:
+                entry = (done, None)
+            except Exception, ex:
+                entry = (done, ex)
+
+            with cond:
+                fetched.append(entry)
+                state['ahead'] += 1
+                cond.notify_all()
+            if entry[0] is done:
+                return
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            with cond:
+                while not fetched:
+                    cond.wait(0.5) # a timeout keeps KeyboardInterrupt working
+                item, error = fetched.popleft()
+                state['ahead'] -= 1
+                cond.notify_all()
+
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        with cond:
+            state['stop'] = True
+            cond.notify_all()
+        thread.join()
 
 class RestClient(Browser):
 
@@ -58,16 +129,20 @@ class RestClient(Browser):
         super(RestClient, self).__init__(*args, **kwargs)
         self.base = base
 
-    def go(self, obj, method, uid=None, data=None, headers=None):
+    def _url(self, obj, uid=None):
+        """URL of an object type, or of one object"""
         url = '%(base)s/%(obj)s' % {'base': self.base,
                                     'obj' : obj}
         if uid is not None:
             url += '/%s' % uid
+        return url
 
-        super(RestClient, self).go(url=url,
+    def go(self, obj, method, uid=None, data=None, headers=None, sink=None):
+        super(RestClient, self).go(url=self._url(obj, uid),
                                    method=method,
                                    data=data,
-                                   headers=headers)
+                                   headers=headers,
+                                   sink=sink)
         if self.http_code != 200:
             raise status_factory(self.http_code)
 
@@ -102,33 +177,331 @@ class RestClient(Browser):
         self.go(obj, 'DELETE', uid=uid, headers=headers)
         return self.src
 
+    # bulk CRUD
+
+    @staticmethod
+    def _result(resp):
+        """The src of a bulk Response, or the exception it failed with"""
+        if resp.exception is not None:
+            return resp.exception
+        if resp.http_code != 200:
+            try:
+                return status_factory(resp.http_code)
+            except ValueError, ex:
+                return ex
+        return resp.src
+
+    def _many(self, method, obj, items, headers, concurrency, as_completed):
+        """
+        Make a request per (uid, data) item, concurrently where the backend
+        allows. Returns a list of results in input order, or with
+        as_completed, yields (index, result) pairs as each completes.
+        """
+        requests = (dict(url=self._url(obj, uid),
+                         method=method,
+                         data=data,
+                         headers=headers)
+                    for uid, data in items)
+        completed = ((i, self._result(resp))
+                     for i, resp in self.go_as_completed(requests,
+                                                         concurrency=concurrency))
+        if as_completed:
+            return completed
+        return [result for _, result in sorted(completed)]
+
+    def post_many(self, obj, items, headers=None, concurrency=None,
+                  as_completed=False):
+        """
+        Post each of items. Results are the src for each, or the exception
+        it failed with (see status_factory)
+        """
+        return self._many('POST', obj, ((None, data) for data in items),
+                          headers, concurrency, as_completed)
+
+    def get_many(self, obj, uids, headers=None, concurrency=None,
+                 as_completed=False):
+        """Get each of uids, with results as for post_many"""
+        return self._many('GET', obj, ((uid, None) for uid in uids),
+                          headers, concurrency, as_completed)
+
+    def put_many(self, obj, items, headers=None, concurrency=None,
+                 as_completed=False):
+        """Put each of items, (uid, data) pairs, with results as for post_many"""
+        return self._many('PUT', obj, items, headers, concurrency,
+                          as_completed)
+
+    def delete_many(self, obj, uids, headers=None, concurrency=None,
+                    as_completed=False):
+        """Delete each of uids, with results as for post_many"""
+        return self._many('DELETE', obj, ((uid, None) for uid in uids),
+                          headers, concurrency, as_completed)
+
 class RestClientJson(RestClient):
 
     """
-    A REST client that only speaks JSON
+    A REST client that only speaks JSON, or another codec (see codec).
+
+    Request bodies are encoded with codec. If accept codecs are given, they
+    are offered in an Accept header, and once the server answers in one of
+    them its requests are encoded in the most preferred it has answered in.
+    Responses are decoded by their Content-Type, straight from the bytes.
     """
 
+    abandon_timeout = 5.0 # seconds to wait for an abandoned stream to stop
+
+    def __init__(self, base, *args, **kwargs):
+        codec = kwargs.pop('codec', None)
+        accept = kwargs.pop('accept', None)
+        super(RestClientJson, self).__init__(base, *args, **kwargs)
+        self.negotiator = Negotiator(codec or JsonCodec(), accept)
+
+    def _headers(self, codec, headers=None):
+        """Headers for a request with a body in codec (or None), if any"""
+        headers = dict(headers or {})
+        if codec is not None:
+            headers['Content-Type'] = codec.content_type
+        accept = self.negotiator.accept_header
+        if accept is not None:
+            headers['Accept'] = accept
+        return headers or None
+
+    def _decode(self, src, headers):
+        """Decode a response body according to its Content-Type"""
+        if not src:
+            return None
+        return self.negotiator.for_response(header(headers, 'Content-Type')) \
+                              .loads(src)
+
+    def _call(self, method, obj, uid=None, data=None, body=False):
+        """Make a request, returning the decoded response"""
+        codec = self.negotiator.current if body else None
+        self.go(obj, method,
+                uid=uid,
+                data=codec.dumps(data) if body else None,
+                headers=self._headers(codec))
+        # bytes, rather than text decoded by the backend
+        return self._decode(self.content, self.headers)
+
     def post(self, obj, data=None):
         """Post"""
-        res = super(RestClientJson, self).post(obj, json.dumps(data), headers={'Content-Type': 'text/json'})
-        if len(res) > 0:
-            return json.loads(res)
-        return None
+        return self._call('POST', obj, data=data, body=True)
 
     def get(self, obj, uid=None):
         """Get"""
-        return json.loads(super(RestClientJson, self).get(obj, uid))
+        return self._call('GET', obj, uid)
 
     def put(self, obj, uid, data=None):
         """Put"""
-        res = super(RestClientJson, self).put(obj, uid, json.dumps(data), headers={'Content-Type': 'text/json'})
-        if len(res) > 0:
-            return json.loads(res)
-        return None
+        return self._call('PUT', obj, uid, data, body=True)
 
     def delete(self, obj, uid):
         """Delete"""
-        res = super(RestClientJson, self).delete(obj, uid)
-        if len(res) > 0:
-            return json.loads(res)
-        return None
+        return self._call('DELETE', obj, uid)
+
+    # bulk CRUD
+
+    def _result(self, resp):
+        """The decoded body of a bulk Response, or the exception it failed with"""
+        res = RestClient._result(resp)
+        if isinstance(res, Exception):
+            return res
+        try:
+            return self._decode(resp.content, resp.headers)
+        except ValueError, ex:
+            return ex
+
+    def _many(self, method, obj, items, headers, concurrency, as_completed):
+        """As for RestClient, encoding any data"""
+        codec = self.negotiator.current if method in ('POST', 'PUT') else None
+        items = ((uid, codec.dumps(data) if codec is not None else None)
+                 for uid, data in items)
+        return super(RestClientJson, self)._many(method, obj, items,
+                                                 self._headers(codec, headers),
+                                                 concurrency, as_completed)
+
+    # streaming
+
+    def stream(self, obj, uid=None, path=None, headers=None, buffer=1000):
+        """
+        Get a JSON array (the top-level one, or that at path, see
+        JsonItemDecoder) and yield its items as they download, holding no
+        more than buffer decoded items at once; the download waits for the
+        caller beyond that. A non-200 status is raised once the body ends,
+        as is anything that goes wrong decoding it.
+
+        The download runs in the background with a companion of the
+        client's backend (see HttpBackend.companion), leaving the current
+        page alone. A backend without companions is used itself; make no
+        other requests with the client until the iteration finishes. Either
+        way, the download is stopped once the caller is done, and waited for
+        up to abandon_timeout seconds; a download stalled for longer is left
+        to stop when its next chunk arrives.
+        """
+        decoder = JsonItemDecoder(path, _load_json().loads)
+        items = Queue(maxsize=buffer)
+        abandoned = threading.Event()
+        failed = [] # raised by write, which a backend may report otherwise
+        done = object()
+        backend = self.backend.companion()
+
+        def put(entry):
+            """Closure to queue an entry, unless the caller has gone"""
+            while not abandoned.is_set():
+                try:
+                    items.put(entry, timeout=0.1)
+                    return
+                except Full:
+                    pass
+            raise StreamAbandoned() # aborts the download
+
+        def write(chunk):
+            """Closure to decode each chunk as it arrives"""
+            try:
+                for item in decoder.feed(chunk):
+                    put((item, None))
+            except Exception, ex:
+                failed.append(ex)
+                raise
+
+        def download():
+            """Closure to make the request, raising any bad status"""
+            if backend is None:
+                self.go(obj, 'GET', uid=uid, headers=headers, sink=write)
+                return
+            resp = backend.go(self._url(obj, uid), 'GET', None, headers, None,
+                              self.follow, self.agent, self.retries,
+                              self.debug, write)
+            http_code = resp.http_code if resp is not None \
+                                       else backend.http_code
+            if http_code != 200:
+                raise status_factory(http_code)
+
+        def run():
+            """Closure to download in the background"""
+            try:
+                download()
+                decoder.close()
+                put((done, None))
+            except Exception, ex:
+                if failed:
+                    ex = failed[0]
+                if not isinstance(ex, StreamAbandoned):
+                    try:
+                        put((done, ex))
+                    except StreamAbandoned:
+                        pass
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            while True:
+                try:
+                    # a timeout keeps KeyboardInterrupt working
+                    item, error = items.get(timeout=0.5)
+                except Empty:
+                    continue
+                if error is not None:
+                    raise error
+                if item is done:
+                    return
+                yield item
+        finally:
+            abandoned.set()
+            thread.join(self.abandon_timeout)
+
+    # pagination
+
+    link_next = re.compile(r'<([^>]*)>\s*;[^,]*rel="?next"?', re.I)
+
+    def _fetch_page(self, backend, url, headers):
+        """
+        Fetch a page of a listing with backend, or as the current page if
+        None, returning its decoded body and headers
+        """
+        headers = self._headers(None, headers)
+        if backend is None:
+            Browser.go(self, url, headers=headers)
+            page = self
+        else:
+            page = backend.go(url, 'GET', None, headers, None, self.follow,
+                              self.agent, self.retries, self.debug)
+            if page is None:
+                page = Response.from_backend(backend)
+        if page.http_code != 200:
+            raise status_factory(page.http_code)
+        return self._decode(page.content, page.headers), page.headers
+
+    def _pages(self, backend, base, url, headers, items_key, style, next_key,
+               cursor_key, cursor_param, offset_param, limit_param, limit,
+               params):
+        """Yield the items of each page of a listing, in turn"""
+        while url is not None:
+            body, page_headers = self._fetch_page(backend, url, headers)
+
+            if isinstance(body, list):
+                items = body
+            elif items_key is not None:
+                items = body[items_key]
+            else:
+                items = next((body[k] for k in ('items', 'results', 'data')
+                              if isinstance(body.get(k), list)), [])
+            yield items
+
+            link = self.link_next.search(header(page_headers, 'Link') or '')
+            body = body if isinstance(body, dict) else {}
+            if style == 'offset':
+                params[offset_param] += len(items)
+                url = url_for_get(base, params) \
+                      if len(items) >= limit else None
+            elif style in ('auto', 'link') and link is not None:
+                url = urljoin(url, link.group(1))
+            elif style in ('auto', 'next') and body.get(next_key):
+                url = urljoin(url, body[next_key])
+            elif style in ('auto', 'cursor') and body.get(cursor_key):
+                params[cursor_param] = body[cursor_key]
+                url = url_for_get(base, params)
+            else:
+                url = None
+
+    def iterate(self, obj, params=None, headers=None, items_key=None,
+                style='auto', next_key='next', cursor_key='next_cursor',
+                cursor_param='cursor', offset_param='offset',
+                limit_param='limit', limit=100, prefetch=1):
+        """
+        Iterate over every item of a paginated listing, fetching up to
+        prefetch pages ahead in the background (none, if 0).
+
+        Pages may be a JSON list, or an object with the list under items_key
+        (by default the first of items, results or data). The next page is
+        found by style:
+
+            link:   a Link header with rel="next"
+            next:   a URL in the next_key field
+            cursor: a cursor in the cursor_key field, passed as cursor_param
+            offset: offset_param and limit_param, until a short page
+            auto:   link, next or cursor, whichever is present
+
+        Pages are fetched with a companion of the client's backend (see
+        HttpBackend.companion), leaving the current page alone. A backend
+        without companions fetches each page in turn as the current page,
+        with no prefetching.
+        """
+        base = self._url(obj)
+        params = dict(params or {})
+        if style == 'offset':
+            params.setdefault(offset_param, 0)
+            params[limit_param] = limit
+        url = url_for_get(base, params) if params else base
+
+        backend = self.backend.companion()
+        pages = self._pages(backend, base, url, headers, items_key, style,
+                            next_key, cursor_key, cursor_param, offset_param,
+                            limit_param, limit, params)
+        if prefetch > 0 and backend is not None:
+            pages = prefetched(pages, prefetch)
+
+        for items in pages:
+            for item in items:
+                yield item
@@ -0,0 +1,70 @@
+# coding: utf-8
+
+"""
+Compiled XPath expressions and CSS selectors, cached so that each is
+compiled once rather than on every page.
+"""
+
+import threading
+from collections import OrderedDict
+
+class SelectorCache(object):
+
+    """
+    A bounded, least-recently-used cache of compiled selectors.
+
+    lxml serialises evaluation of a compiled XPath between threads, so each
+    thread gets a cache of its own.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._local = threading.local()
+
+    def _get(self, key, compile_):
+        """Fetch a compiled selector, compiling and storing it if necessary"""
+        try:
+            compiled = self._local.compiled
+        except AttributeError:
+            compiled = self._local.compiled = OrderedDict()
+
+        try:
+            selector = compiled.pop(key)
+        except KeyError:
+            selector = compile_()
+            if len(compiled) >= self.size:
+                compiled.popitem(last=False)
+
+        compiled[key] = selector
+        return selector
+
+    def xpath(self, expression, namespaces=None, extensions=None,
+              smart_strings=True, regexp=True):
+        """
+        A compiled XPath; call it with a node and any $variables. The
+        arguments are lxml's; with extensions it isn't cached.
+        """
+        # lazy-load LXML
+        from lxml.etree import XPath
+        compile_ = lambda: XPath(expression,
+                                 namespaces=namespaces,
+                                 extensions=extensions,
+                                 smart_strings=smart_strings,
+                                 regexp=regexp)
+        if extensions is not None:
+            return compile_()
+        key = ('xpath',
+               expression,
+               tuple(sorted(namespaces.items())) if namespaces else None,
+               bool(smart_strings),
+               bool(regexp))
+        return self._get(key, compile_)
+
+    def css(self, selector):
+        """A compiled CSS selector; call it with a node"""
+        # lazy-load LXML (CSS selectors also need the cssselect package)
+        from lxml.cssselect import CSSSelector
+        return self._get(('css', selector),
+                         lambda: CSSSelector(selector, translator='html'))
+
+selectors = SelectorCache()
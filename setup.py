@@ -21,6 +21,7 @@ setup(
     test_requires=[
         'pycurl>=7.18',
         'lxml>=2.3',
+        'cssselect>=0.9',
         'simplejson>=2.2.1',
     ],
     classifiers=[
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the backends and Browser, against a local server.
+
+    python tests/benchmark.py [-n N] [-o results.json] [-c old.json] [name ...]
+
+Each benchmark runs in a process of its own (with its own server) so that
+its peak memory is its own. Results are written as JSON:
+
+    {"version": ..., "python": ...,
+     "benchmarks": {name: {"n": ..., "throughput": ..., "mean": ...,
+                           "p50": ..., "p90": ..., "p99": ..., "max": ...,
+                           "peak_rss_kb": ...}}}
+
+with times in seconds and throughput in operations per second. Comparing
+with an earlier run (-c) reports, and exits non-zero for, any benchmark
+whose median has slowed by more than the tolerance.
+"""
+
+import os
+import sys
+import json
+import platform
+import resource
+from optparse import OptionParser
+from multiprocessing import Process, Pipe
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from pycurlbrowser import __version__, Browser, CurlBackend, RequestsBackend, MockBackend, MockResponse
+from pycurlbrowser.backend.util import StopWatch
+from local_server import LocalServer
+
+BENCHMARKS = []
+
+def benchmark(name):
+    """Decorator registering a benchmark: given a server, return an op to time"""
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+SCENARIOS = [('small',        'size=1024'),
+             ('large',        'size=1048576'),
+             ('chunked_gzip', 'size=65536&chunked=1&gzip=1'),
+             ('redirects',    'size=1024&redirects=3'),
+             ('latency',      'size=1024&latency=0.01'),
+             ('no_keepalive', 'size=1024&close=1')]
+
+def backend_benchmark(name, backend_type, query):
+    """Register a benchmark of a backend requesting one scenario"""
+    @benchmark('%s.%s' % (backend_type.__name__, name))
+    def setup(server):
+        backend = backend_type()
+        url = '%s/bench?%s' % (server.base, query)
+
+        def op():
+            backend.go(url, 'GET', None, None, None, True, 'benchmark', 0, False)
+        return op
+
+for backend_type in (CurlBackend, RequestsBackend):
+    for name, query in SCENARIOS:
+        backend_benchmark(name, backend_type, query)
+
+def page(links=500, forms=10):
+    """A biggish page of links and forms"""
+    return '<html><head><title>Benchmark</title></head><body>%s%s</body></html>' % (
+        ''.join('<p><a href="/link/%d">Link %d</a></p>' % (i, i)
+                for i in range(links)),
+        ''.join('<form name="form%d" action="/submit" method="post">'
+                '<input type="text" name="text" value="%d"/>'
+                '<select name="choice"><option value="a">A</option>'
+                '<option value="b">B</option></select>'
+                '<input type="submit" name="go" value="Go"/></form>' % (i, i)
+                for i in range(forms)))
+
+def mock_backend():
+    """A MockBackend serving the benchmark page and its form"""
+    backend = MockBackend()
+    mock = MockResponse()
+    mock.src = page()
+    backend.responses.add(mock, 'http://host/page')
+    backend.responses.add(MockResponse(), 'http://host/submit', 'POST',
+                          dict(text='x', choice='a', go='Go'))
+    return backend
+
+@benchmark('MockBackend.go')
+def mock_go(server):
+    backend = mock_backend()
+
+    def op():
+        backend.go('http://host/page', 'GET', None, None, None, True,
+                   'benchmark', 0, False)
+    return op
+
+@benchmark('Browser.parse')
+def browser_parse(server):
+    browser = Browser(backend=mock_backend())
+
+    def op():
+        browser.go('http://host/page')
+        browser.parse()
+    return op
+
+@benchmark('Browser.xpath')
+def browser_xpath(server):
+    browser = Browser('http://host/page', backend=mock_backend())
+    browser.parse()
+
+    def op():
+        browser.xpath('//a[starts-with(@href, $prefix)]/@href', prefix='/link/')
+    return op
+
+@benchmark('Browser.form')
+def browser_form(server):
+    browser = Browser(backend=mock_backend())
+
+    def op():
+        browser.go('http://host/page')
+        browser.form_select('form0')
+        browser.form_data_update(text='x')
+        browser.form_submit()
+    return op
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[max(0, int(round(p / 100.0 * len(ordered))) - 1)]
+
+def measure(setup, n, conn):
+    """Run a benchmark in this (child) process and send back its results"""
+    server = LocalServer().start()
+    try:
+        op = setup(server)
+        op() # warm up: connections, caches, lazy imports
+
+        times = []
+        with StopWatch() as total:
+            for _ in range(n):
+                with StopWatch() as sw:
+                    op()
+                times.append(sw.total.total_seconds())
+
+        times.sort()
+        conn.send(dict(n=n,
+                       throughput=n / total.total.total_seconds(),
+                       mean=sum(times) / n,
+                       p50=percentile(times, 50),
+                       p90=percentile(times, 90),
+                       p99=percentile(times, 99),
+                       max=times[-1],
+                       peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except Exception, ex:
+        conn.send(dict(error=repr(ex)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def run(names, n):
+    """Run the benchmarks named (or all of them), returning the results"""
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and not [w for w in names if name.startswith(w)]:
+            continue
+
+        parent, child = Pipe()
+        process = Process(target=measure, args=(setup, n, child))
+        process.start()
+        results[name] = parent.recv()
+        process.join()
+
+        sys.stderr.write('%-30s %s\n' % (name, results[name]))
+
+    return dict(version=__version__,
+                python=platform.python_version(),
+                benchmarks=results)
+
+def compare(old, new, tolerance):
+    """Report benchmarks whose median slowed by more than tolerance"""
+    regressions = []
+    for name, result in sorted(new['benchmarks'].items()):
+        before = old['benchmarks'].get(name)
+        if before is None or 'p50' not in before or 'p50' not in result:
+            continue
+        ratio = result['p50'] / before['p50']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = ' REGRESSION'
+        sys.stderr.write('%-30s p50 x%.2f%s\n' % (name, ratio, flag))
+    return regressions
+
+def main():
+    parser = OptionParser(usage="%prog [options] [benchmark-prefix ...]")
+    parser.add_option('-n', type='int', default=200,
+                      help="operations per benchmark")
+    parser.add_option('-o', '--output', help="write results to this file")
+    parser.add_option('-c', '--compare', help="compare with earlier results")
+    parser.add_option('-t', '--tolerance', type='float', default=0.1,
+                      help="slowdown allowed when comparing, e.g. 0.1")
+    options, names = parser.parse_args()
+
+    results = run(names, options.n)
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    else:
+        print json.dumps(results, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as fp:
+            if compare(json.load(fp), results, options.tolerance):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+A local HTTP server for tests that would otherwise need the network.
+"""
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread
+from urlparse import urlparse, parse_qs
+from StringIO import StringIO
+import gzip
+import time
+
+class EchoHandler(BaseHTTPRequestHandler):
+
+    """
+    Respond with the request path, e.g. /404 gives a 404.
+
+    /bytes/N responds with N bytes, /redirect redirects to /redirected,
+    /set-cookie sets a cookie, and any cookies sent are echoed back in the
+    X-Cookie header.
+
+    Any path also takes these options in the query string:
+
+        size=N       respond with N bytes
+        items=N      respond with a JSON array of the numbers 0 to N-1
+        latency=S    wait S seconds before responding
+        stall=S      wait S seconds, but only the first time this is requested
+        fail=N       respond 503, with Retry-After: 0, the first N times this
+                     is requested
+        chunked=1    use chunked transfer-encoding
+        gzip=1       gzip the body, if the client accepts it
+        redirects=N  redirect N times before responding
+        close=1      close the connection rather than keeping it alive
+        cookies=N    set N cookies, c0=0 to cN-1=N-1
+    """
+
+    protocol_version = 'HTTP/1.1'
+    timeout = 1 # drop idle kept-alive connections
+    wbufsize = -1 # send each response whole, not a packet per header...
+    disable_nagle_algorithm = True # ...and without delay
+    chunk_size = 8 * 1024
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        options = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+
+        if 'latency' in options:
+            time.sleep(float(options['latency']))
+        if 'stall' in options and self.path not in self.server.stalled:
+            self.server.stalled.add(self.path)
+            time.sleep(float(options['stall']))
+
+        try:
+            code = int(url.path.strip('/').split('/')[0])
+        except ValueError:
+            code = 200
+        if code < 100:
+            code = 200
+        if 'items' in options:
+            body = '[%s]' % ','.join(str(i) for i in xrange(int(options['items'])))
+        elif 'size' in options:
+            body = 'x' * int(options['size'])
+        elif self.path.startswith('/bytes/'):
+            body = 'x' * int(self.path.split('/')[2])
+        else:
+            body = "path: %s" % self.path
+
+        location = None
+        if self.path == '/redirect':
+            location = '/redirected'
+        elif int(options.get('redirects', 0)) > 0:
+            options['redirects'] = int(options['redirects']) - 1
+            location = '%s?%s' % (url.path, '&'.join('%s=%s' % i
+                                                    for i in options.items()))
+        if location is not None:
+            code = 302
+
+        failing = self.server.failed.get(self.path, 0) < int(options.get('fail', 0))
+        if failing:
+            self.server.failed[self.path] = self.server.failed.get(self.path, 0) + 1
+            code = 503
+            body = 'unavailable'
+
+        gzipped = options.get('gzip') == '1' and \
+                  'gzip' in self.headers.get('Accept-Encoding', '')
+        if gzipped:
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as fp:
+                fp.write(body)
+            body = buf.getvalue()
+
+        chunked = options.get('chunked') == '1'
+        close = options.get('close') == '1'
+
+        self.send_response(code)
+        if location is not None:
+            self.send_header('Location', location)
+        if failing:
+            self.send_header('Retry-After', '0')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        if close:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.send_header('X-Path', self.path)
+        if self.path == '/set-cookie':
+            self.send_header('Set-Cookie', 'session=shared; Path=/')
+        for i in range(int(options.get('cookies', 0))):
+            self.send_header('Set-Cookie', 'c%d=%d' % (i, i))
+        self.send_header('X-Cookie', self.headers.get('Cookie', ''))
+        self.end_headers()
+
+        if chunked:
+            for i in range(0, len(body), self.chunk_size):
+                chunk = body[i:i + self.chunk_size]
+                self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write('0\r\n\r\n')
+        else:
+            self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.do_GET()
+
+    do_PUT = do_DELETE = do_POST
+
+    def log_message(self, *args):
+        pass
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+
+    """
+    Threaded server on a random local port, run in the background.
+    """
+
+    request_queue_size = 128 # don't drop a burst of concurrent connections
+
+    def __init__(self, handler=EchoHandler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.stalled = set() # paths that have been requested with stall=S
+        self.failed = {} # path -> times failed, for fail=N
+        self.base = 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        """Serve from a daemon thread"""
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
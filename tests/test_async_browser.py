@@ -0,0 +1,141 @@
+from unittest import TestCase
+from pycurlbrowser import AsyncBrowser, SessionLoop, CurlMultiBackend, MockBackend, MockResponse
+from pycurlbrowser.async_browser import Pending
+from pycurlbrowser.backend.base import Response
+from local_server import LocalServer
+
+class TestAsyncBrowserMocked(TestCase):
+
+    """
+    Sessions driven over the mock backend.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.loop = SessionLoop(self.backend)
+
+    def test_form_session(self):
+        """go and form_submit are yielded, parsing works in between"""
+        form = MockResponse()
+        form.src = """
+            <form method="post" action="done">
+                <input type="text" name="one" value="one" />
+                <input type="submit" />
+            </form>
+        """
+        done = MockResponse()
+        done.src = "<html><head><title>Done</title></head></html>"
+        done.http_code = 201
+        self.backend.responses.add(form, 'form')
+        self.backend.responses.add(done, 'done', 'POST', dict(one='two'))
+
+        seen = []
+        def session(browser):
+            seen.append((yield browser.go('form')))
+            browser.form_select(0)
+            browser.form_data_update(one='two')
+            seen.append((yield browser.form_submit()))
+            seen.append(browser.title)
+
+        self.loop.spawn(session(AsyncBrowser(backend=self.backend)))
+        self.loop.run()
+        self.assertEqual(seen, [200, 201, "Done"])
+
+    def test_state_per_browser(self):
+        """Browsers sharing a backend keep their own page"""
+        for name in ('one', 'two'):
+            mock = MockResponse()
+            mock.src = name
+            self.backend.responses.add(mock, name)
+
+        one = AsyncBrowser(backend=self.backend)
+        two = AsyncBrowser(backend=self.backend)
+        def session(browser, url):
+            yield browser.go(url)
+
+        self.loop.spawn(session(one, 'one'))
+        self.loop.spawn(session(two, 'two'))
+        self.loop.run()
+        self.assertEqual((one.src, two.src), ('one', 'two'))
+
+    def test_exception(self):
+        """Failed requests are raised inside the session"""
+        caught = []
+        def session(browser):
+            try:
+                yield browser.go('missing')
+            except LookupError, ex:
+                caught.append(ex)
+
+        self.loop.spawn(session(AsyncBrowser(backend=self.backend)))
+        self.loop.run()
+        self.assertEqual(len(caught), 1)
+
+    def test_session_exception(self):
+        """Uncaught exceptions are raised by run, and kept on the session"""
+        def session(browser):
+            yield browser.go('missing')
+
+        finished = []
+        def other(browser):
+            yield browser.go('found')
+            finished.append(True)
+
+        found = MockResponse()
+        self.backend.responses.add(found, 'found')
+        session = self.loop.spawn(session(AsyncBrowser(backend=self.backend)))
+        self.loop.spawn(other(AsyncBrowser(backend=self.backend)))
+        self.assertRaises(LookupError, self.loop.run)
+        self.assertTrue(session.done)
+        self.assertTrue(isinstance(session.exception, LookupError))
+        self.assertEqual(finished, [True])
+        self.loop.run() # reported once
+
+    def test_completed_chain(self):
+        """Requests already complete when yielded don't recurse"""
+        class Done(object):
+            def go(self, url):
+                pending = Pending()
+                pending.complete(Response(http_code=200))
+                return pending
+
+        codes = []
+        def session(browser):
+            for _ in range(5000):
+                codes.append((yield browser.go('done')))
+
+        self.loop.spawn(session(Done()))
+        self.loop.run()
+        self.assertEqual(len(codes), 5000)
+
+class TestAsyncBrowserCurl(TestCase):
+
+    """
+    Many sessions in flight at once over a CurlMultiBackend.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.base = cls.server.base
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_many_sessions(self):
+        backend = CurlMultiBackend(concurrency=5)
+        loop = SessionLoop(backend)
+        results = {}
+
+        def session(browser, n):
+            yield browser.go('%s/%d/first' % (self.base, n))
+            yield browser.go('%s/%d/second' % (self.base, n))
+            results[n] = browser.src
+
+        for n in range(20):
+            loop.spawn(session(AsyncBrowser(backend=backend), n))
+        loop.run()
+
+        self.assertEqual(results,
+                         dict((n, 'path: /%d/second' % n) for n in range(20)))
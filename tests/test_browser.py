@@ -134,3 +134,153 @@ class TestForms(TestCase):
         self.browser.go(link_url)
         self.browser.follow_link(link_text)
         self.assertEqual(self.browser.src, right.src)
+
+class TestBackendSelection(TestCase):
+
+    """
+    Backends are created lazily, one per browser unless given.
+    """
+
+    def test_lazy(self):
+        browser = Browser()
+        self.assertEqual(browser._backend, None)
+
+    def test_not_shared(self):
+        self.assertFalse(Browser().backend is Browser().backend)
+
+    def test_shared_when_given(self):
+        backend = MockBackend()
+        self.assertTrue(Browser(backend=backend).backend is
+                        Browser(backend=backend).backend)
+
+class TestIncrementalParse(TestCase):
+
+    """
+    Parsing while the body downloads.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.browser = Browser(backend=self.backend)
+        self.browser.parse_incrementally = True
+
+    def test_parsed_on_arrival(self):
+        page = MockResponse()
+        page.src = "<html><head><title>Title</title></head>" + \
+                   "<body><a href='/link'>Link</a></body></html>"
+        self.backend.responses.add(page, 'http://host/page')
+        self.browser.go('http://host/page')
+        self.assertTrue(self.browser._tree is not None)
+        self.assertEqual(self.browser.src, page.src)
+        self.assertEqual(self.browser.title, "Title")
+        self.assertEqual(self.browser.links(), ['http://host/link'])
+
+    def test_unparseable_left_for_parse(self):
+        """An empty page fails when parsed, as it would otherwise"""
+        page = MockResponse()
+        self.backend.responses.add(page, 'empty')
+        self.browser.go('empty')
+        self.assertEqual(self.browser._tree, None)
+        self.assertRaises(Exception, self.browser.parse)
+
+class TestSelectors(TestCase):
+
+    """
+    XPath and CSS selection on the current page.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.browser = Browser(backend=self.backend)
+        page = MockResponse()
+        page.src = """
+            <div class="item"><a href="http://one"><span>One "quoted"</span></a></div>
+            <div class="item"><a href="http://two">Two</a></div>
+        """
+        self.backend.responses.add(page, 'page')
+        self.browser.go('page')
+
+    def test_xpath_variables(self):
+        self.assertEqual(self.browser.xpath('//a[text()=$text]/@href',
+                                            text='Two'),
+                         ['http://two'])
+
+    def test_xpath_lxml_options(self):
+        """lxml's own keyword arguments aren't taken as variables"""
+        hrefs = self.browser.xpath('//a/@href', smart_strings=False)
+        self.assertEqual(hrefs, ['http://one', 'http://two'])
+        self.assertFalse(hasattr(hrefs[0], 'getparent'))
+        upper = lambda context, value: value[0].upper()
+        self.assertEqual(self.browser.xpath('f:upper((//a)[2]/text())',
+                                            extensions={('urn:f', 'upper'): upper},
+                                            namespaces={'f': 'urn:f'}),
+                         'TWO')
+
+    def test_css(self):
+        self.assertEqual([a.get('href') for a in self.browser.css('div.item a')],
+                         ['http://one', 'http://two'])
+
+    def test_follow_link_quotes(self):
+        """Link text is passed as a variable, so quotes are fine"""
+        right = MockResponse()
+        right.src = "success"
+        self.backend.responses.add(right, 'http://one')
+        self.browser.follow_link('One "quoted"')
+        self.assertEqual(self.browser.src, right.src)
+
+    def test_compiled_once(self):
+        from pycurlbrowser.selectors import selectors
+        self.assertTrue(selectors.xpath('//a') is selectors.xpath('//a'))
+        self.assertTrue(selectors.css('a') is selectors.css('a'))
+
+class TestLinks(TestCase):
+
+    """
+    Links are made absolute as they're used.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.browser = Browser(backend=self.backend)
+        page = MockResponse()
+        page.src = """
+            <a href="/one"><span>One</span></a>
+            <a href="two">Two</a>
+            <form action="submit" method="post"><input type="submit" /></form>
+        """
+        self.backend.responses.add(page, 'http://host/dir/page')
+        self.browser.go('http://host/dir/page')
+
+    def test_not_rewritten(self):
+        self.assertEqual(self.browser.xpath('//a/@href'), ['/one', 'two'])
+
+    def test_links(self):
+        self.assertEqual(self.browser.links(),
+                         ['http://host/one', 'http://host/dir/two'])
+
+    def test_follow_link(self):
+        one = MockResponse()
+        self.backend.responses.add(one, 'http://host/one')
+        self.browser.follow_link('One')
+        self.assertEqual(self.browser.url, 'http://host/one')
+
+    def test_form_action(self):
+        done = MockResponse()
+        self.backend.responses.add(done, 'http://host/dir/submit', 'POST')
+        self.browser.form_select(0)
+        self.browser.form_submit()
+        self.assertEqual(self.browser.url, 'http://host/dir/submit')
+
+    def test_base_href(self):
+        page = MockResponse()
+        page.src = """<html><head><base href="http://other/base/" /></head>
+                      <body><a href="link">Link</a></body></html>"""
+        self.backend.responses.add(page, 'http://host/based')
+        self.browser.go('http://host/based')
+        self.assertEqual(self.browser.links(), ['http://other/base/link'])
+
+    def test_eager(self):
+        self.browser.absolute_links = True
+        self.browser.go('http://host/dir/page')
+        self.assertEqual(self.browser.xpath('//a/@href'),
+                         ['http://host/one', 'http://host/dir/two'])
@@ -0,0 +1,201 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, CachingBackend, MemoryCache, DirectoryCache, MockBackend, MockResponse
+from pycurlbrowser.backend.cache import CacheEntry
+from datetime import timedelta
+import shutil
+import tempfile
+
+class Latin1Backend(MockBackend):
+
+    """
+    A mock backend sending its pages as ISO-8859-1, decoding them again.
+    """
+
+    def go(self, *args, **kwargs):
+        resp = super(Latin1Backend, self).go(*args, **kwargs)
+        resp.content = resp.src.encode('latin-1')
+        resp.charset = 'latin-1'
+        resp.decode_content()
+        return resp
+
+class TestCachingBackend(TestCase):
+
+    """
+    Caching in front of the mock backend.
+    """
+
+    url = 'http://host/page'
+
+    def setUp(self):
+        self.mock = MockBackend()
+        self.backend = CachingBackend(self.mock)
+        self.browser = Browser(backend=self.backend)
+
+    def respond(self, src, headers, request_headers=None, http_code=200):
+        mock = MockResponse()
+        mock.src = src
+        mock.headers = headers
+        mock.http_code = http_code
+        mock.roundtrip = timedelta(seconds=1)
+        self.mock.responses = type(self.mock.responses)()
+        self.mock.responses.add(mock, self.url, headers=request_headers)
+
+    def test_fresh_hit(self):
+        self.respond('first', {'Cache-Control': 'max-age=60'})
+        self.browser.go(self.url)
+        self.respond('second', {})
+        self.browser.go(self.url)
+        self.assertEqual(self.backend.status, 'hit')
+        self.assertEqual(self.browser.src, 'first')
+        self.assertEqual(self.browser.roundtrip, timedelta())
+
+    def test_hit_parse_time(self):
+        """Parse time is kept on a hit's timing"""
+        self.respond('<p>first</p>', {'Cache-Control': 'max-age=60'})
+        self.browser.go(self.url)
+        self.browser.go(self.url)
+        self.backend.tree = None # make it parse again
+        self.browser._tree = None
+        self.browser.parse()
+        self.assertEqual(self.backend.status, 'hit')
+        self.assertTrue(self.browser.timing is self.browser.timing)
+        self.assertTrue(self.browser.timing.parse is not None)
+
+    def test_revalidate_etag(self):
+        self.respond('first', {'ETag': '"abc"'})
+        self.browser.go(self.url)
+        self.respond('', {'ETag': '"abc"'}, {'If-None-Match': '"abc"'}, 304)
+        self.assertEqual(self.browser.go(self.url), 200)
+        self.assertEqual(self.backend.status, 'revalidated')
+        self.assertEqual(self.browser.src, 'first')
+
+    def test_revalidate_last_modified(self):
+        date = 'Sat, 01 Jan 2000 00:00:00 GMT'
+        self.respond('first', {'Last-Modified': date})
+        self.browser.go(self.url)
+        self.respond('', {}, {'If-Modified-Since': date}, 304)
+        self.browser.go(self.url)
+        self.assertEqual(self.browser.src, 'first')
+
+    def test_changed(self):
+        self.respond('first', {'ETag': '"abc"'})
+        self.browser.go(self.url)
+        self.respond('second', {'ETag': '"def"'}, {'If-None-Match': '"abc"'})
+        self.browser.go(self.url)
+        self.assertEqual(self.backend.status, 'miss')
+        self.assertEqual(self.browser.src, 'second')
+
+    def test_no_store(self):
+        self.respond('first', {'Cache-Control': 'no-store, max-age=60'})
+        self.browser.go(self.url)
+        self.respond('second', {})
+        self.browser.go(self.url)
+        self.assertEqual(self.browser.src, 'second')
+
+    def test_post_invalidates(self):
+        self.respond('first', {'Cache-Control': 'max-age=60'})
+        self.browser.go(self.url)
+        mock = MockResponse()
+        self.mock.responses.add(mock, self.url, 'POST')
+        self.browser.go(self.url, 'POST')
+        self.assertEqual(self.backend.store.get(self.url), None)
+
+    def test_tree_reused(self):
+        """A parsed tree is kept with the cached response"""
+        self.respond('<p>first</p>', {'Cache-Control': 'max-age=60'})
+        self.browser.go(self.url)
+        self.browser.parse()
+        tree = self.browser._tree
+        self.browser.go(self.url)
+        self.assertTrue(self.browser._tree is not None)
+        # each reader gets its own copy
+        self.assertTrue(self.browser._tree is not tree)
+        self.assertEqual(self.browser.xpath('//p/text()'), ['first'])
+        self.browser._tree.xpath('//p')[0].text = 'changed'
+        self.browser.go(self.url)
+        self.assertEqual(self.browser.xpath('//p/text()'), ['first'])
+
+    def test_tree_kept_as_parsed(self):
+        """Changes to the page's tree don't reach the one kept"""
+        self.respond('<p>first</p>', {'Cache-Control': 'max-age=60'})
+        self.browser.go(self.url)
+        self.browser.parse()
+        self.browser._tree.xpath('//p')[0].text = 'changed'
+        self.browser.go(self.url)
+        self.assertEqual(self.browser.xpath('//p/text()'), ['first'])
+
+    def test_charset_kept(self):
+        """A hit gives the bytes received, and the text decoded from them"""
+        self.mock = Latin1Backend()
+        self.backend = CachingBackend(self.mock)
+        self.browser = Browser(backend=self.backend)
+        self.respond(u'<p>caf\xe9</p>', {'Cache-Control': 'max-age=60'})
+        self.browser.go(self.url)
+        self.browser.go(self.url)
+        self.assertEqual(self.backend.status, 'hit')
+        self.assertEqual(self.browser.content, '<p>caf\xe9</p>')
+        self.assertEqual(self.browser.src, u'<p>caf\xe9</p>')
+
+    def test_vary(self):
+        """A response is only reused for requests it didn't vary for"""
+        self.respond('json', {'Cache-Control': 'max-age=60', 'Vary': 'Accept'},
+                     {'Accept': 'application/json'})
+        self.browser.go(self.url, headers={'Accept': 'application/json'})
+        self.respond('html', {'Cache-Control': 'max-age=60', 'Vary': 'Accept'},
+                     {'Accept': 'text/html'})
+        self.browser.go(self.url, headers={'Accept': 'text/html'})
+        self.assertEqual(self.backend.status, 'miss')
+        self.assertEqual(self.browser.src, 'html')
+        self.browser.go(self.url, headers={'accept': 'text/html'})
+        self.assertEqual(self.backend.status, 'hit')
+        self.assertEqual(self.browser.src, 'html')
+
+    def test_vary_cookie(self):
+        """Responses varying by cookies the cache can't see aren't stored"""
+        self.respond('first', {'Cache-Control': 'max-age=60', 'Vary': 'Cookie'})
+        self.browser.go(self.url)
+        self.assertEqual(self.backend.store.get(self.url), None)
+
+class TestStores(TestCase):
+
+    """
+    Cache storage.
+    """
+
+    @staticmethod
+    def entry(src):
+        return CacheEntry('url', 200, {}, src, timedelta())
+
+    def test_memory_lru(self):
+        store = MemoryCache(max_bytes=25)
+        store.set('a', self.entry('a' * 10))
+        store.set('b', self.entry('b' * 10))
+        store.get('a')
+        store.set('c', self.entry('c' * 10))
+        self.assertEqual(store.get('b'), None)
+        self.assertEqual(store.get('a').src, 'a' * 10)
+        self.assertEqual(store.bytes, 20)
+
+    def test_tree_not_copied(self):
+        """A tree is only copied for its readers"""
+        from lxml.html import fromstring
+        entry = self.entry('<p>page</p>')
+        tree = fromstring(entry.src)
+        entry.tree = tree
+        self.assertTrue(entry._tree is tree)
+        self.assertTrue(entry.tree is not tree)
+
+    def test_memory_too_big(self):
+        store = MemoryCache(max_bytes=5)
+        store.set('a', self.entry('a' * 10))
+        self.assertEqual(store.get('a'), None)
+
+    def test_directory(self):
+        path = tempfile.mkdtemp()
+        try:
+            DirectoryCache(path).set('key', self.entry('stored'))
+            self.assertEqual(DirectoryCache(path).get('key').src, 'stored')
+            DirectoryCache(path).delete('key')
+            self.assertEqual(DirectoryCache(path).get('key'), None)
+        finally:
+            shutil.rmtree(path)
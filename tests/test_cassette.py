@@ -0,0 +1,121 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, MockBackend, MockResponse, Cassette, RecordingBackend, ReplayBackend
+from pycurlbrowser.backend.util import StopWatch
+from datetime import timedelta
+from StringIO import StringIO
+import os
+import shutil
+import tempfile
+
+class TestCassette(TestCase):
+
+    """
+    Record from a mock backend, then replay.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.cassette')
+
+        self.mock = MockBackend()
+        page = MockResponse()
+        page.src = '<html><a href="/two">two</a></html>'
+        page.headers = {'X-Page': 'one'}
+        page.roundtrip = timedelta(seconds=0.2)
+        self.mock.responses.add(page, 'http://host/one')
+
+        posted = MockResponse()
+        posted.http_code = 201
+        posted.src = u'caf\xe9'
+        self.mock.responses.add(posted, 'http://host/post', 'POST', dict(a='b'))
+
+        moved = MockResponse()
+        moved.redirect = 'http://host/one'
+        self.mock.responses.add(moved, 'http://host/old')
+
+        broken = MockResponse()
+        broken.exception = IOError("Broken")
+        self.mock.responses.add(broken, 'http://host/broken')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self):
+        recorder = RecordingBackend(self.path, backend=self.mock)
+        browser = Browser(backend=recorder)
+        browser.go('http://host/one')
+        browser.go('http://host/post', 'POST', dict(a='b'))
+        browser.go('http://host/old')
+        self.assertRaises(IOError, browser.go, 'http://host/broken')
+        recorder.cassette.close()
+
+    def test_records(self):
+        self.record()
+        records = list(Cassette(self.path))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0].request['url'], 'http://host/one')
+        self.assertEqual(records[0].headers, {'X-Page': 'one'})
+        self.assertEqual(records[1].src, u'caf\xe9')
+
+    def test_replay(self):
+        self.record()
+        browser = Browser(backend=ReplayBackend(self.path))
+        self.assertEqual(browser.go('http://host/one'), 200)
+        self.assertEqual(browser.links(), ['http://host/two'])
+        self.assertEqual(browser.roundtrip, timedelta(seconds=0.2))
+        self.assertEqual(browser.go('http://host/post', 'POST', dict(a='b')), 201)
+        self.assertEqual(browser.src, u'caf\xe9')
+        self.assertEqual(browser.go('http://host/old'), 200)
+        self.assertEqual(browser.url, 'http://host/one')
+        self.assertRaises(IOError, browser.go, 'http://host/broken')
+
+    def test_rerecorded(self):
+        self.record()
+        self.record()
+        browser = Browser(backend=ReplayBackend(self.path))
+        self.assertEqual(browser.go('http://host/one'), 200)
+
+    def test_streamed(self):
+        recorder = RecordingBackend(backend=self.mock)
+        out = StringIO()
+        Browser(backend=recorder).go('http://host/one', sink=out)
+        browser = Browser(backend=ReplayBackend(recorder.cassette))
+        browser.go('http://host/one')
+        self.assertEqual(browser.src, out.getvalue())
+
+    def test_missing(self):
+        """Replaying a cassette that doesn't exist fails, creating nothing"""
+        missing = os.path.join(self.dir, 'missing.cassette')
+        self.assertRaises(IOError, ReplayBackend, missing)
+        self.assertFalse(os.path.exists(missing))
+
+    def test_close(self):
+        self.record()
+        with ReplayBackend(self.path) as replay:
+            browser = Browser(backend=replay)
+            browser.go('http://host/one')
+            src = browser.src
+            self.assertTrue(browser.src is src) # unpacked once
+        self.assertTrue(all(c._fp.closed and not c._maps
+                            for c in replay.cassettes))
+        self.assertEqual(src, '<html><a href="/two">two</a></html>')
+
+    def test_streamed_large(self):
+        """A streamed body is compressed as it goes, not kept in memory"""
+        big = MockResponse()
+        big.src = 'x' * (1024 * 1024)
+        self.mock.responses.add(big, 'http://host/big')
+        with RecordingBackend(self.path, backend=self.mock) as recorder:
+            Browser(backend=recorder).go('http://host/big', sink=lambda _: None)
+            self.assertTrue(os.path.getsize(self.path) < len(big.src) / 10)
+        with ReplayBackend(self.path) as replay:
+            browser = Browser(backend=replay)
+            browser.go('http://host/big')
+            self.assertEqual(browser.src, big.src)
+
+    def test_latency(self):
+        self.record()
+        browser = Browser(backend=ReplayBackend(self.path, latency=True))
+        with StopWatch() as sw:
+            browser.go('http://host/one')
+        self.assertTrue(sw.total >= timedelta(seconds=0.2))
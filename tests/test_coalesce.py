@@ -0,0 +1,205 @@
+from unittest import TestCase
+import threading
+import time
+from pycurlbrowser import Browser, CoalescingBackend, SingleFlight, MockBackend, MockResponse, RestClientJson
+
+class CountingBackend(MockBackend):
+
+    """
+    A slow mock backend, counting the requests made through every instance.
+    """
+
+    calls = []
+
+    def __init__(self, delay=0.1):
+        super(CountingBackend, self).__init__()
+        self.delay = delay
+        page = MockResponse()
+        page.src = '<html><head><title>Page</title></head></html>'
+        self.responses.add(page, 'http://host/page')
+        self.responses.add(page, 'http://host/page', 'POST')
+        self.responses.add(page, 'http://host/page', headers={'Accept': 'text/html'})
+        obj = MockResponse()
+        obj.src = '{"uid": 1}'
+        self.responses.add(obj, 'http://host/object/1')
+        failure = MockResponse()
+        failure.exception = IOError("down")
+        self.responses.add(failure, 'http://host/down')
+        text = MockResponse()
+        text.src = u'<html><head><title>Caf\xe9</title></head></html>'
+        self.responses.add(text, 'http://host/text')
+        empty = MockResponse()
+        empty.src = None
+        self.responses.add(empty, 'http://host/empty')
+
+    def go(self, url, *args, **kwargs):
+        self.calls.append(url)
+        time.sleep(self.delay)
+        return super(CountingBackend, self).go(url, *args, **kwargs)
+
+class TestCoalescing(TestCase):
+
+    """
+    Identical concurrent requests from many threads.
+    """
+
+    def setUp(self):
+        CountingBackend.calls = []
+        self.group = SingleFlight()
+
+    def browser(self, delay=0.1):
+        return Browser(backend=CoalescingBackend(CountingBackend(delay),
+                                                 group=self.group))
+
+    def stampede(self, go, threads=10):
+        """Run go(browser) in many threads at once, returning the browsers"""
+        browsers = [self.browser() for _ in range(threads)]
+        errors = []
+
+        def run(browser):
+            try:
+                go(browser)
+            except Exception, ex:
+                errors.append(ex)
+
+        workers = [threading.Thread(target=run, args=(b,)) for b in browsers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return browsers, errors
+
+    def test_coalesced(self):
+        browsers, errors = self.stampede(lambda b: b.go('http://host/page'))
+        self.assertEqual(errors, [])
+        self.assertEqual(len(CountingBackend.calls), 1)
+        self.assertEqual([b.title for b in browsers], ['Page'] * 10)
+        self.assertEqual(sorted(b.backend.status for b in browsers),
+                         ['coalesced'] * 9 + ['sent'])
+        self.assertEqual(self.group.stats(), dict(requests=1, coalesced=9,
+                                                  reused=0, in_flight=0))
+
+    def test_exception_shared(self):
+        browsers, errors = self.stampede(lambda b: b.go('http://host/down'))
+        self.assertEqual(len(CountingBackend.calls), 1)
+        self.assertEqual(len(errors), 10)
+        self.assertTrue(all(isinstance(ex, IOError) for ex in errors))
+
+    def test_not_idempotent(self):
+        browsers, errors = self.stampede(lambda b: b.go('http://host/page', 'POST'),
+                                         threads=3)
+        self.assertEqual(len(CountingBackend.calls), 3)
+        self.assertEqual([b.backend.status for b in browsers], [None] * 3)
+
+    def test_headers_differ(self):
+        self.browser(0).go('http://host/page', headers={'Accept': 'text/html'})
+        self.browser(0).go('http://host/page')
+        self.assertEqual(len(CountingBackend.calls), 2)
+
+    def test_ttl(self):
+        self.group.ttl = 0.2
+        self.browser(0).go('http://host/page')
+        browser = self.browser(0)
+        browser.go('http://host/page')
+        self.assertEqual(browser.backend.status, 'reused')
+        self.assertEqual(browser.title, 'Page')
+        time.sleep(0.25)
+        browser.go('http://host/page')
+        self.assertEqual(browser.backend.status, 'sent')
+        self.assertEqual(len(CountingBackend.calls), 2)
+
+    def test_timing_own(self):
+        browsers, errors = self.stampede(lambda b: b.go('http://host/page'))
+        self.assertEqual(len(set(id(b.backend.timing) for b in browsers)), 10)
+
+    def test_ttl_bounded(self):
+        self.group = SingleFlight(ttl=10, max_results=1)
+        self.browser(0).go('http://host/page')
+        self.browser(0).go('http://host/object/1')
+        browser = self.browser(0)
+        browser.go('http://host/page')
+        self.assertEqual(browser.backend.status, 'sent')
+        self.assertEqual(self.group.bytes, len(browser.src))
+
+        self.group = SingleFlight(ttl=10, max_bytes=10)
+        self.browser(0).go('http://host/page')
+        browser = self.browser(0)
+        browser.go('http://host/page')
+        self.assertEqual(browser.backend.status, 'sent')
+        self.assertEqual(self.group.bytes, 0)
+
+    def test_sink_failure_own(self):
+        """A failing sink fails its own request, not those coalesced"""
+        def abort(chunk):
+            raise ValueError("enough")
+
+        backends = [CoalescingBackend(CountingBackend(), group=self.group)
+                    for _ in range(2)]
+        received, errors = [], []
+
+        def run(backend, sink):
+            try:
+                backend.go('http://host/page', 'GET', None, None, None,
+                           True, 'foo', 0, False, sink)
+            except Exception, ex:
+                errors.append(ex)
+
+        leader = threading.Thread(target=run, args=(backends[0], abort))
+        leader.start()
+        time.sleep(0.05)
+        run(backends[1], received.append)
+        leader.join()
+        self.assertEqual([type(ex) for ex in errors], [ValueError])
+        self.assertEqual(''.join(received),
+                         '<html><head><title>Page</title></head></html>')
+        self.assertEqual(backends[1].status, 'sent')
+        self.assertEqual(len(CountingBackend.calls), 2)
+
+    def shared(self, url, leader_sink, follower_sink):
+        """Have a follower share the flight of a leader, returning its response"""
+        backends = [CoalescingBackend(CountingBackend(), group=self.group)
+                    for _ in range(2)]
+        leader = threading.Thread(target=backends[0].go,
+                                  args=(url, 'GET', None, None, None,
+                                        True, 'foo', 0, False, leader_sink))
+        leader.start()
+        time.sleep(0.05)
+        resp = backends[1].go(url, 'GET', None, None, None,
+                              True, 'foo', 0, False, follower_sink)
+        leader.join()
+        self.assertEqual(backends[1].status, 'coalesced')
+        self.assertEqual(len(CountingBackend.calls), 1)
+        return resp
+
+    def test_follower_decoded(self):
+        """A follower without a sink gets text, even when the leader streamed"""
+        received = []
+        resp = self.shared('http://host/text', received.append, None)
+        self.assertEqual(''.join(received),
+                         '<html><head><title>Caf\xc3\xa9</title></head></html>')
+        self.assertTrue(isinstance(resp.src, unicode))
+        self.assertEqual(resp.src, u'<html><head><title>Caf\xe9</title></head></html>')
+
+    def test_follower_no_body(self):
+        """A follower's sink gets nothing from a leader without a body"""
+        received = []
+        resp = self.shared('http://host/empty', None, received.append)
+        self.assertEqual(received, [])
+        self.assertEqual(resp.src, None)
+
+    def test_rest_client(self):
+        """Streamed bodies reach every client"""
+        clients = [RestClientJson('http://host',
+                                  backend=CoalescingBackend(CountingBackend(),
+                                                            group=self.group))
+                   for _ in range(5)]
+        results = []
+        workers = [threading.Thread(target=lambda c: results.append(c.get('object', 1)),
+                                    args=(c,))
+                   for c in clients]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(results, [{'uid': 1}] * 5)
+        self.assertEqual(len(CountingBackend.calls), 1)
@@ -0,0 +1,179 @@
+from unittest import TestCase
+from pycurlbrowser import Crawler, Frontier, BloomFilter, MockBackend, MockResponse
+from pycurlbrowser.crawler import normalize_url, RobotsCache
+from pycurlbrowser.backend.util import StopWatch, clock
+from datetime import timedelta
+import time
+
+class TestUrls(TestCase):
+
+    def test_normalize(self):
+        self.assertEqual(normalize_url('HTTP://Example.COM:80/a/./b/../c?x=1#frag'),
+                         'http://example.com/a/c?x=1')
+        self.assertEqual(normalize_url('https://host:443'), 'https://host/')
+        self.assertEqual(normalize_url('http://host:8080/a/'), 'http://host:8080/a/')
+
+class TestBloomFilter(TestCase):
+
+    def test_membership(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('http://host/%d' % i)
+        self.assertTrue(all('http://host/%d' % i in bloom for i in range(1000)))
+        false_positives = sum('http://other/%d' % i in bloom for i in range(1000))
+        self.assertTrue(false_positives < 50)
+        self.assertTrue(990 <= len(bloom) <= 1000)
+
+class TestFrontier(TestCase):
+
+    def test_priority_and_dedup(self):
+        frontier = Frontier(per_host=10, delay=0)
+        self.assertTrue(frontier.add('http://a/low', priority=5))
+        self.assertTrue(frontier.add('http://a/high', priority=1))
+        self.assertFalse(frontier.add('http://A/high#again'))
+        self.assertEqual(len(frontier), 2)
+        self.assertEqual(frontier.pop(), ('http://a/high', 0))
+        self.assertEqual(frontier.pop(), ('http://a/low', 0))
+        self.assertEqual(frontier.pop(), None)
+
+    def test_per_host_concurrency(self):
+        frontier = Frontier(per_host=1, delay=0)
+        for url in ('http://a/1', 'http://a/2', 'http://b/1'):
+            frontier.add(url)
+        first = frontier.pop()
+        second = frontier.pop()
+        self.assertEqual(sorted([first[0], second[0]]), ['http://a/1', 'http://b/1'])
+        self.assertEqual(frontier.pop(), None)
+        self.assertEqual(frontier.wait(), None)
+        frontier.done('http://a/1')
+        self.assertEqual(frontier.pop(), ('http://a/2', 0))
+
+    def test_delay(self):
+        frontier = Frontier(per_host=10, delay=0.05)
+        frontier.add('http://a/1')
+        frontier.add('http://a/2')
+        frontier.add('http://b/1')
+        frontier.pop()
+        frontier.pop()
+        self.assertEqual(frontier.pop(), None)
+        self.assertTrue(0 < frontier.wait() <= 0.05)
+
+class TestRobots(TestCase):
+
+    def test_rules(self):
+        robots = RobotsCache('crawler')
+        self.assertEqual(robots.update('http://a', 200, "User-agent: *\nDisallow: /private\nCrawl-delay: 2\n"), 2)
+        self.assertTrue(robots.allowed('http://a/public'))
+        self.assertFalse(robots.allowed('http://a/private/page'))
+
+        robots.update('http://b', 404, '')
+        self.assertTrue(robots.allowed('http://b/anything'))
+        robots.update('http://c', 503, '')
+        self.assertFalse(robots.allowed('http://c/anything'))
+
+class SlowBackend(MockBackend):
+
+    """
+    A mock backend answering each request latency seconds after it starts,
+    counting polls.
+    """
+
+    def __init__(self, latency):
+        super(SlowBackend, self).__init__()
+        self.latency = latency
+        self.polls = 0
+        self._due = None
+
+    def start(self, *args, **kwargs):
+        if not self._queue:
+            self._due = clock() + self.latency
+        super(SlowBackend, self).start(*args, **kwargs)
+
+    def poll(self, timeout):
+        self.polls += 1
+        if self._queue and clock() < self._due:
+            time.sleep(max(0, min(timeout, self._due - clock())))
+            return len(self._queue)
+        return super(SlowBackend, self).poll(timeout)
+
+class TestCrawler(TestCase):
+
+    """
+    Crawls of a mocked site.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.page('http://site/', '<a href="/a">a</a><a href="/b">b</a><a href="http://other/">o</a>')
+        self.page('http://site/a', '<a href="/">home</a><a href="/c">c</a>')
+        self.page('http://site/b', '<a href="/private/x">x</a>')
+        self.page('http://site/c', 'the end')
+        self.page('http://site/private/x', 'secret')
+        self.page('http://other/', '<a href="/broken">broken</a>')
+        self.page('http://site/robots.txt', 'User-agent: *\nDisallow: /private\n')
+        self.page('http://other/robots.txt', '', 404)
+
+    def page(self, url, src, http_code=200):
+        mock = MockResponse()
+        mock.src = src
+        mock.http_code = http_code
+        self.backend.responses.add(mock, url)
+
+    def crawl(self, **kwargs):
+        visited = []
+
+        def handler(browser, depth):
+            visited.append(browser.url)
+            return browser.links() if '<a' in browser.src else []
+
+        crawler = Crawler(handler, backend=self.backend, delay=0, **kwargs)
+        crawler.add('http://site/')
+        crawler.run()
+        return crawler, visited
+
+    def test_crawl(self):
+        crawler, visited = self.crawl()
+        self.assertEqual(sorted(visited), ['http://other/', 'http://site/',
+                                           'http://site/a', 'http://site/b',
+                                           'http://site/c'])
+        self.assertEqual([url for url, _ in crawler.errors], ['http://other/broken'])
+
+    def test_max_depth(self):
+        _, visited = self.crawl(max_depth=1)
+        self.assertFalse('http://site/c' in visited)
+
+    def test_max_pages(self):
+        crawler, visited = self.crawl(max_pages=2, concurrency=1)
+        self.assertEqual(len(visited), 2)
+
+    def test_bloom(self):
+        _, visited = self.crawl(seen=BloomFilter(capacity=100))
+        self.assertEqual(len(visited), 5)
+
+    def test_without_robots(self):
+        _, visited = self.crawl(robots=False)
+        self.assertTrue('http://site/private/x' in visited)
+
+    def test_busy_browsers_wait(self):
+        """With every browser busy, poll waits rather than spins"""
+        backend = SlowBackend(0.05)
+        for path in ('', 'a', 'b', 'c'):
+            mock = MockResponse()
+            mock.src = 'page'
+            backend.responses.add(mock, 'http://site/%s' % path)
+        crawler = Crawler(lambda browser, depth: [], backend=backend,
+                          concurrency=1, per_host=4, delay=0, robots=False)
+        for path in ('', 'a', 'b', 'c'):
+            crawler.add('http://site/%s' % path)
+        crawler.run()
+        self.assertEqual(crawler.pages, 4)
+        self.assertTrue(backend.polls < 20, backend.polls)
+
+    def test_host_delay(self):
+        with StopWatch() as sw:
+            crawler = Crawler(lambda browser, depth: [], backend=self.backend,
+                              delay=0.05, robots=False)
+            for url in ('http://site/', 'http://site/a', 'http://site/b'):
+                crawler.add(url)
+            crawler.run()
+        self.assertTrue(sw.total >= timedelta(seconds=0.1))
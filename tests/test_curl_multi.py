@@ -0,0 +1,171 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, CurlMultiBackend, MockBackend, MockResponse, HedgePolicy, RetryPolicy, RetryBudget
+from pycurlbrowser.backend.util import StopWatch
+from local_server import LocalServer
+from datetime import timedelta
+import pycurl
+
+class TestCurlMulti(TestCase):
+
+    """
+    Concurrent fetching against a local server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.base = cls.server.base
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.backend = CurlMultiBackend(concurrency=3)
+
+    def test_go(self):
+        url = '%s/single' % self.base
+        self.backend.go(url, 'GET', None, None, None, True, "foo", 0, False)
+        self.assertEqual(self.backend.http_code, 200)
+        self.assertEqual(self.backend.src, "path: /single")
+        self.assertEqual(self.backend.url, url)
+        self.assertEqual(self.backend.headers['X-Path'], '/single')
+        self.assertTrue(self.backend.roundtrip > timedelta(0))
+
+    def test_go_many_order(self):
+        """Results come back in input order, regardless of completion"""
+        urls = ['%s/%d' % (self.base, i) for i in range(10)]
+        resps = self.backend.go_many(urls, True, "foo", 0, False)
+        self.assertEqual([r.src for r in resps],
+                         ['path: /%d' % i for i in range(10)])
+
+    def test_handles_reused(self):
+        """No more easy handles are created than the concurrency cap"""
+        urls = ['%s/%d' % (self.base, i) for i in range(20)]
+        self.backend.go_many(urls, True, "foo", 0, False)
+        self.assertEqual(len(self.backend._idle), 3)
+
+    def test_http_codes(self):
+        resps = self.backend.go_many(['%s/404' % self.base,
+                                      '%s/500' % self.base],
+                                     True, "foo", 0, False)
+        self.assertEqual([r.http_code for r in resps], [404, 500])
+
+    def test_failure_does_not_abort(self):
+        """A failed transfer is reported without stopping the others"""
+        resps = self.backend.go_many(['http://127.0.0.1:1/',
+                                      '%s/ok' % self.base],
+                                     True, "foo", 1, False)
+        self.assertTrue(isinstance(resps[0].exception, pycurl.error))
+        self.assertEqual(resps[1].src, "path: /ok")
+
+    def test_go_raises(self):
+        self.assertRaises(pycurl.error, self.backend.go,
+                          'http://127.0.0.1:1/', 'GET', None, None, None,
+                          True, "foo", 0, False)
+
+    def test_browser_go_many(self):
+        browser = Browser(backend=self.backend)
+        resps = browser.go_many(['%s/a' % self.base,
+                                 dict(url='%s/b' % self.base,
+                                      data=dict(c='d'))])
+        self.assertEqual([r.src for r in resps],
+                         ['path: /a', 'path: /b?c=d'])
+
+class TestGoManyFallback(TestCase):
+
+    """
+    Backends without concurrency visit each URL in turn.
+    """
+
+    def test_mock(self):
+        backend = MockBackend()
+        one = MockResponse()
+        one.src = "one"
+        two = MockResponse()
+        two.exception = LookupError()
+        backend.responses.add(one, 'one')
+        backend.responses.add(two, 'two')
+        resps = Browser(backend=backend).go_many(['one', 'two'])
+        self.assertEqual(resps[0].src, "one")
+        self.assertTrue(isinstance(resps[1].exception, LookupError))
+
+    def test_page_kept(self):
+        backend = MockBackend()
+        for name in ('one', 'two'):
+            mock = MockResponse()
+            mock.src = '<html><head><title>%s</title></head></html>' % name
+            backend.responses.add(mock, 'http://host/%s' % name)
+        browser = Browser(backend=backend)
+        browser.go('http://host/one')
+        resps = browser.go_many(['http://host/two'])
+        self.assertEqual(resps[0].url, 'http://host/two')
+        self.assertEqual((browser.url, browser.title), ('http://host/one', 'one'))
+        self.assertEqual(browser.src,
+                         '<html><head><title>one</title></head></html>')
+
+class TestHedging(TestCase):
+
+    """
+    Hedging slow requests against a local server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.base = cls.server.base
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def go(self, policy, path, method='GET', retries=0, budget=None):
+        backend = CurlMultiBackend(concurrency=3, hedge=policy)
+        if budget is not None:
+            backend.retry_policy = RetryPolicy(budget=budget)
+        with StopWatch() as sw:
+            resp = backend.go(self.base + path, method, None, None, None,
+                              True, "foo", retries, False)
+        return resp, sw.total
+
+    def test_hedge_wins(self):
+        policy = HedgePolicy(delay=0.05, budget=1)
+        resp, took = self.go(policy, '/hedge?stall=2')
+        self.assertEqual(resp.src, 'path: /hedge?stall=2')
+        self.assertTrue(took < timedelta(seconds=1))
+        self.assertEqual(policy.stats(), dict(requests=1, hedged=1, wins=1,
+                                              hedge_rate=1.0, win_rate=1.0))
+
+    def test_retryable_loses(self):
+        # the hedge is answered 503 while the original stalls, then succeeds
+        policy = HedgePolicy(delay=0.05, budget=1)
+        budget = RetryBudget()
+        resp, took = self.go(policy, '/unavailable?stall=0.3&fail=1',
+                             retries=1, budget=budget)
+        self.assertEqual(resp.http_code, 200)
+        self.assertEqual(policy.stats()['wins'], 0)
+        self.assertEqual((budget.retries, budget.refused), (0, 0))
+
+    def test_budget(self):
+        policy = HedgePolicy(delay=0.05, budget=0.5)
+        resp, took = self.go(policy, '/budget?stall=0.3')
+        self.assertTrue(took >= timedelta(seconds=0.3))
+        self.assertEqual(policy.hedged, 0)
+
+    def test_not_idempotent(self):
+        policy = HedgePolicy(delay=0.05, budget=1)
+        self.go(policy, '/post?stall=0.2', 'POST')
+        self.assertEqual(policy.hedged, 0)
+
+    def test_fast_not_hedged(self):
+        policy = HedgePolicy(delay=1, budget=1)
+        self.go(policy, '/fast')
+        self.assertEqual(policy.stats()['win_rate'], None)
+
+    def test_observed_delay(self):
+        policy = HedgePolicy(percentile=50, min_delay=0.01, warmup=3)
+        self.assertEqual(policy.delay_for('http://host/a'), 0.01)
+        for seconds in (0.1, 0.1, 0.2):
+            policy.observe('http://slow/b', seconds)
+        self.assertEqual(policy.delay_for('http://host/a'), 0.01)
+        self.assertAlmostEqual(policy.delay_for('http://slow/a'), 0.1, 1)
@@ -0,0 +1,61 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, CurlBackend, CurlSharedState, CurlMultiBackend
+from local_server import LocalServer
+
+class TestCurlSharedState(TestCase):
+
+    """
+    State shared between curl backends.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.base = cls.server.base
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_defaults(self):
+        """Cookies are not shared unless asked for"""
+        share = CurlSharedState()
+        self.assertTrue('LOCK_DATA_DNS' in share.shared)
+        self.assertTrue('LOCK_DATA_SSL_SESSION' in share.shared)
+        self.assertFalse('LOCK_DATA_COOKIE' in share.shared)
+
+    def test_cookies_shared(self):
+        share = CurlSharedState(cookies=True)
+        one = Browser(backend=CurlBackend(share=share))
+        two = Browser(backend=CurlBackend(share=share))
+        one.go('%s/set-cookie' % self.base)
+        two.go('%s/cookie' % self.base)
+        self.assertEqual(two.headers['X-Cookie'], 'session=shared')
+
+    def test_cookies_not_shared(self):
+        share = CurlSharedState()
+        one = Browser(backend=CurlBackend(share=share))
+        two = Browser(backend=CurlBackend(share=share))
+        one.go('%s/set-cookie' % self.base)
+        two.go('%s/cookie' % self.base)
+        self.assertEqual(two.headers['X-Cookie'], '')
+
+    def test_multi(self):
+        """The pooled handles of a multi backend attach to the share"""
+        share = CurlSharedState(cookies=True)
+        Browser(backend=CurlBackend(share=share)).go('%s/set-cookie' % self.base)
+        multi = Browser(backend=CurlMultiBackend(share=share))
+        resps = multi.go_many(['%s/cookie' % self.base] * 2)
+        self.assertEqual([r.headers['X-Cookie'] for r in resps],
+                         ['session=shared'] * 2)
+
+    def test_companion(self):
+        """A companion shares cookies set before and after it was made"""
+        browser = Browser(backend=CurlBackend())
+        browser.go('%s/set-cookie' % self.base)
+        companion = Browser(backend=browser.backend.companion())
+        companion.go('%s/cookie?cookies=1' % self.base)
+        self.assertEqual(companion.headers['X-Cookie'], 'session=shared')
+        browser.go('%s/cookie' % self.base)
+        self.assertEqual(sorted(browser.headers['X-Cookie'].split('; ')),
+                         ['c0=0', 'session=shared'])
@@ -0,0 +1,197 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, CurlBackend, CurlMultiBackend, MockBackend, MockResponse, CachingBackend, Hooks, RequestStats
+from pycurlbrowser.hooks import Histogram, status_class
+from local_server import LocalServer
+from datetime import timedelta
+import socket
+
+def unused_port():
+    """A local port with nothing listening on it"""
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class Recorder(object):
+
+    """
+    Subscriber remembering every event it's given.
+    """
+
+    def __init__(self, hooks):
+        self.events = []
+        for event in ('before_request', 'after_response', 'retry', 'redirect',
+                      'parse_start', 'parse_end', 'form_submit'):
+            hooks.subscribe(event, self)
+
+    def __call__(self, event, **details):
+        self.events.append((event, details))
+
+    def named(self, name):
+        return [d for e, d in self.events if e == name]
+
+class TestHooks(TestCase):
+
+    def test_unknown_event(self):
+        self.assertRaises(ValueError, Hooks().subscribe, 'bogus', lambda *a, **k: None)
+
+    def test_unsubscribe(self):
+        hooks = Hooks()
+        seen = []
+        subscriber = lambda event, **details: seen.append(event)
+        hooks.subscribe('retry', subscriber)
+        hooks.fire('retry')
+        hooks.unsubscribe('retry', subscriber)
+        hooks.fire('retry')
+        self.assertEqual(seen, ['retry'])
+
+    def test_histogram(self):
+        h = Histogram()
+        for ms in range(1, 101):
+            h.add(ms / 1000.0)
+        self.assertEqual(h.count, 100)
+        self.assertAlmostEqual(h.mean, 0.0505)
+        self.assertTrue(0.05 <= h.percentile(50) < 0.07)
+        self.assertTrue(0.1 <= h.percentile(99) < 0.13)
+        self.assertEqual(Histogram().percentile(50), None)
+
+    def test_status_class(self):
+        self.assertEqual(status_class(404), '4xx')
+        self.assertEqual(status_class(None), 'error')
+
+class TestBrowserHooks(TestCase):
+
+    """
+    Events fired by a Browser over a mock backend.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.browser = Browser(backend=self.backend)
+        self.browser.hooks = self.backend.hooks = Hooks()
+        self.recorder = Recorder(self.browser.hooks)
+
+        mock = MockResponse()
+        mock.src = '<html><form action="/submit"><input type="submit" name="go" value="Go"/></form></html>'
+        self.backend.responses.add(mock, 'http://example.com/')
+
+        mock = MockResponse()
+        mock.redirect = 'http://example.com/'
+        self.backend.responses.add(mock, 'http://example.com/old')
+
+        mock = MockResponse()
+        mock.http_code = 404
+        self.backend.responses.add(mock, 'http://example.com/submit?go=Go')
+
+        mock = MockResponse()
+        mock.exception = IOError("Broken")
+        self.backend.responses.add(mock, 'http://example.com/broken')
+
+    def test_request_events(self):
+        self.browser.go('http://example.com/')
+        self.assertEqual([e for e, _ in self.recorder.events],
+                         ['before_request', 'after_response'])
+        after = self.recorder.named('after_response')[0]
+        self.assertEqual(after['http_code'], 200)
+        self.assertEqual(after['method'], 'GET')
+        self.assertEqual(after['exception'], None)
+
+    def test_failure(self):
+        self.assertRaises(IOError, self.browser.go, 'http://example.com/broken')
+        after = self.recorder.named('after_response')[0]
+        self.assertTrue(isinstance(after['exception'], IOError))
+        self.assertEqual(after['http_code'], None)
+
+    def test_redirect(self):
+        self.browser.go('http://example.com/old')
+        redirect = self.recorder.named('redirect')[0]
+        self.assertEqual(redirect['url'], 'http://example.com/old')
+        self.assertEqual(redirect['final_url'], 'http://example.com/')
+
+    def test_parse_and_form(self):
+        self.browser.go('http://example.com/')
+        self.browser.form_select(0)
+        self.browser.form_submit()
+        names = [e for e, _ in self.recorder.events]
+        self.assertEqual(names, ['before_request', 'after_response',
+                                 'parse_start', 'parse_end',
+                                 'form_submit',
+                                 'before_request', 'after_response'])
+        self.assertEqual(self.recorder.named('form_submit')[0]['data'], {'go': 'Go'})
+        self.assertTrue(isinstance(self.recorder.named('parse_end')[0]['parse_time'], timedelta))
+
+    def test_incremental_parse(self):
+        self.browser.parse_incrementally = True
+        self.browser.go('http://example.com/')
+        self.assertEqual(len(self.recorder.named('parse_end')), 1)
+
+    def test_stats(self):
+        stats = RequestStats().subscribe(self.browser.hooks)
+        self.browser.go('http://example.com/')
+        self.browser.go('http://example.com/old')
+        self.assertRaises(IOError, self.browser.go, 'http://example.com/broken')
+        self.assertEqual(stats.requests(), 3)
+        self.assertEqual(stats.requests('example.com', '2xx'), 2)
+        self.assertEqual(stats.requests(status='error'), 1)
+        self.assertEqual(stats.redirects, {'example.com': 1})
+        self.assertEqual(stats.snapshot()['example.com 2xx']['count'], 2)
+        # failures are counted, but kept out of the latency histograms
+        self.assertEqual(stats.failed, {'example.com': 1})
+        self.assertFalse('example.com error' in stats.snapshot())
+
+        stats.unsubscribe(self.browser.hooks)
+        self.browser.go('http://example.com/')
+        self.assertEqual(stats.requests(), 3)
+
+    def test_stats_cached(self):
+        mock = MockResponse()
+        mock.src = 'cached'
+        mock.headers = {'Cache-Control': 'max-age=60'}
+        mock.roundtrip = timedelta(seconds=0.2)
+        self.backend.responses.add(mock, 'http://example.com/cached')
+        browser = Browser(backend=CachingBackend(self.backend))
+        browser.hooks = self.browser.hooks
+        stats = RequestStats().subscribe(browser.hooks)
+        for _ in range(3):
+            browser.go('http://example.com/cached')
+        self.assertEqual(stats.cached, {'example.com': 2})
+        self.assertEqual(stats.requests(), 1)
+        self.assertAlmostEqual(stats.snapshot()['example.com 2xx']['mean'], 0.2)
+
+class TestBackendHooks(TestCase):
+
+    """
+    Retry and redirect events from real backends.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def check(self, backend):
+        backend.hooks = Hooks()
+        recorder = Recorder(backend.hooks)
+
+        backend.go('%s/redirect' % self.server.base, 'GET', None, None, None,
+                   True, 'test', 0, False)
+        redirect = recorder.named('redirect')[0]
+        self.assertEqual(redirect['count'], 1)
+        self.assertTrue(redirect['final_url'].endswith('/redirected'))
+
+        url = 'http://127.0.0.1:%d/' % unused_port()
+        self.assertRaises(Exception, backend.go, url, 'GET', None, None, None,
+                          True, 'test', 2, False)
+        self.assertEqual([(r['url'], r['attempt']) for r in recorder.named('retry')],
+                         [(url, 1), (url, 2)])
+
+    def test_curl(self):
+        self.check(CurlBackend())
+
+    def test_curl_multi(self):
+        self.check(CurlMultiBackend())
@@ -248,3 +248,22 @@ class TestBrowserMocked(TestCase):
 
         # Assert
         self.assertEqual(self.browser.headers, mock.headers)
+
+    def test_many_responses(self):
+        """Lookups among many responses pick the right one"""
+        for i in range(5000):
+            mock = MockResponse()
+            mock.http_code = i
+            self.backend.responses.add(mock, 'page%d' % i, 'POST', dict(n=str(i), x='y'))
+        self.assertEqual(self.browser.go('page1234', 'POST', dict(n='1234')), 1234)
+
+    def test_miss_message(self):
+        """A miss describes the request and the stored responses"""
+        self.backend.responses.add(MockResponse(), 'there')
+        try:
+            self.browser.go('nowhere')
+        except LookupError, ex:
+            self.assertTrue('nowhere' in str(ex))
+            self.assertTrue('there' in str(ex))
+        else:
+            self.fail("LookupError not raised")
@@ -0,0 +1,109 @@
+from unittest import TestCase
+from pycurlbrowser import BrowserPool, PoolExhausted, CurlBackend, RequestsBackend, MockBackend, MockResponse
+from local_server import LocalServer
+import threading
+
+class TestBrowserPool(TestCase):
+
+    """
+    Leasing browsers over mock backends.
+    """
+
+    def setUp(self):
+        def factory():
+            backend = MockBackend()
+            mock = MockResponse()
+            mock.src = '<html><form><input type="submit"/></form></html>'
+            backend.responses.add(mock, 'page')
+            return backend
+        self.pool = BrowserPool(size=2, backend_factory=factory)
+
+    def test_reuse(self):
+        with self.pool.browser() as first:
+            pass
+        with self.pool.browser() as second:
+            pass
+        self.assertTrue(first is second)
+        self.assertEqual(self.pool.stats()['created'], 1)
+
+    def test_reset(self):
+        with self.pool.browser() as browser:
+            browser.go('page')
+            browser.form_select(0)
+            browser.retries = 5
+        self.assertEqual(browser._form, None)
+        self.assertEqual(browser._tree, None)
+        self.assertEqual(browser.retries, 0)
+        # nothing of the last lessee's page is left on the backend
+        self.assertEqual(browser.src, None)
+        self.assertEqual(browser.url, None)
+        self.assertEqual(browser.http_code, None)
+
+    def test_release_twice(self):
+        browser = self.pool.acquire()
+        self.pool.release(browser)
+        self.assertRaises(ValueError, self.pool.release, browser)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+        self.assertRaises(ValueError, self.pool.release, object())
+
+    def test_exhausted(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertRaises(PoolExhausted, self.pool.acquire, 0.01)
+        stats = self.pool.stats()
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.pool.release(first)
+        self.pool.release(second, discard=True)
+        self.assertEqual(self.pool.stats()['created'], 1)
+
+    def test_threads(self):
+        errors = []
+        def work():
+            try:
+                for _ in range(20):
+                    with self.pool.browser(timeout=5) as browser:
+                        browser.go('page')
+                        browser.form_select(0)
+            except Exception, ex:
+                errors.append(ex)
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        stats = self.pool.stats()
+        self.assertEqual(stats['leases'], 120)
+        self.assertEqual(stats['created'], 2)
+        self.assertTrue(stats['wait_p99'] is not None)
+
+class SharedCookieTests(object):
+
+    """
+    Cookies set through one pooled browser are sent by another.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_shared_cookies(self):
+        pool = BrowserPool(size=2, backend_factory=self.backend_type,
+                           share_cookies=True)
+        first = pool.acquire()
+        second = pool.acquire()
+        first.go('%s/set-cookie' % self.server.base)
+        second.go('%s/echo' % self.server.base)
+        self.assertEqual(second.headers['X-Cookie'], 'session=shared')
+
+class TestSharedCookiesCurl(SharedCookieTests, TestCase):
+    backend_type = CurlBackend
+
+class TestSharedCookiesRequests(SharedCookieTests, TestCase):
+    backend_type = RequestsBackend
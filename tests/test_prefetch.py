@@ -0,0 +1,202 @@
+from unittest import TestCase
+import time
+from datetime import timedelta
+from pycurlbrowser import Browser, BrowserPool, Prefetcher, MockBackend, MockResponse, Hooks, RequestStats
+from pycurlbrowser.backend.util import StopWatch
+
+PAGES = 4
+
+class SiteBackend(MockBackend):
+
+    """
+    A slow mock of a paged site, counting the requests made through every
+    instance.
+    """
+
+    calls = []
+
+    def __init__(self, delay=0.05):
+        super(SiteBackend, self).__init__()
+        self.delay = delay
+        for i in range(1, PAGES + 1):
+            page = MockResponse()
+            page.src = '<html><head><title>Page %d</title></head><body>' % i
+            page.roundtrip = timedelta(seconds=delay)
+            if i < PAGES:
+                page.src += '<a rel="next" href="/page/%d">Next</a>' % (i + 1)
+            page.src += '<a href="/about">About</a></body></html>'
+            self.responses.add(page, 'http://host/page/%d' % i)
+        about = MockResponse()
+        about.src = '<html><head><title>About</title></head></html>'
+        about.roundtrip = timedelta(seconds=delay)
+        self.responses.add(about, 'http://host/about')
+
+    def go(self, url, *args, **kwargs):
+        self.calls.append(url)
+        time.sleep(self.delay)
+        return super(SiteBackend, self).go(url, *args, **kwargs)
+
+class LoneBackend(SiteBackend):
+
+    """
+    A mock of a paged site that can't share its cookies.
+    """
+
+    def companion(self):
+        return None
+
+class TestPrefetch(TestCase):
+
+    """
+    Following links a browser has fetched ahead of time.
+    """
+
+    def setUp(self):
+        SiteBackend.calls = []
+        self.browser = Browser(backend=SiteBackend())
+
+    def tearDown(self):
+        if self.browser.prefetcher is not None:
+            self.browser.prefetcher.close()
+
+    def test_follow_served(self):
+        prefetcher = self.browser.prefetch('//a[@rel="next"]/@href',
+                                           backend_factory=SiteBackend)
+        self.browser.go('http://host/page/1')
+        for i in range(2, PAGES + 1):
+            self.browser.follow_link('//a[@rel="next"]')
+            self.assertEqual(self.browser.title, 'Page %d' % i)
+            self.assertEqual(self.browser.url, 'http://host/page/%d' % i)
+            self.assertEqual(self.browser.http_code, 200)
+            self.assertEqual(self.browser.roundtrip, timedelta())
+        stats = prefetcher.stats()
+        self.assertEqual(stats['hits'], PAGES - 1)
+        self.assertEqual(stats['pages'], 0)
+        # each page was fetched once, the first by the browser itself
+        self.assertEqual(sorted(SiteBackend.calls),
+                         ['http://host/page/%d' % i for i in range(1, PAGES + 1)])
+
+    def test_companions(self):
+        """By default, pages are fetched with the browser's companions"""
+        prefetcher = self.browser.prefetch('//a[@rel="next"]/@href')
+        self.browser.go('http://host/page/1')
+        self.browser.follow_link('//a[@rel="next"]')
+        self.assertEqual(self.browser.title, 'Page 2')
+        self.assertEqual(prefetcher.stats()['hits'], 1)
+
+        browser = Browser(backend=LoneBackend())
+        self.assertEqual(browser.prefetch('//a[@rel="next"]/@href'), None)
+        self.assertEqual(browser.prefetcher, None)
+        browser.go('http://host/page/1')
+        browser.follow_link('//a[@rel="next"]')
+        self.assertEqual(browser.title, 'Page 2')
+
+    def test_stats_served(self):
+        self.browser.hooks = Hooks()
+        stats = RequestStats().subscribe(self.browser.hooks)
+        self.browser.prefetch('//a[@rel="next"]/@href',
+                              backend_factory=SiteBackend)
+        self.browser.go('http://host/page/1')
+        self.browser.follow_link('//a[@rel="next"]')
+        self.assertEqual(stats.served, {'host': 1})
+        self.assertEqual(stats.requests(), 1)
+        self.assertTrue(stats.snapshot()['host 2xx']['mean'] > 0)
+
+    def test_pool_release(self):
+        pool = BrowserPool(size=1, backend_factory=lambda: SiteBackend(0.2))
+        browser = pool.acquire()
+        prefetcher = browser.prefetch('//a[@rel="next"]/@href',
+                                      concurrency=1, max_pages=1)
+        prefetcher.add('http://host/page/1')
+        time.sleep(0.05)
+        prefetcher.add('http://host/page/2') # waits for the busy thread
+        with StopWatch() as sw:
+            pool.release(browser)
+        self.assertTrue(sw.total < timedelta(seconds=0.1))
+        self.assertTrue(prefetcher._closed)
+        self.assertEqual((browser.prefetcher, browser.prefetch_candidates),
+                         (None, None))
+
+    def test_elements_and_predicate(self):
+        self.browser.prefetch('//a[@rel="next"]', backend_factory=SiteBackend)
+        self.browser.go('http://host/page/1')
+        self.browser.parse()
+        self.assertEqual(self.browser.go('http://host/page/2'), 200)
+        self.assertEqual(self.browser.roundtrip, timedelta())
+
+        prefetcher = self.browser.prefetch(lambda url: url.endswith('/about'),
+                                           backend_factory=SiteBackend)
+        self.browser.parse() # the page is already parsed
+        self.browser.go('http://host/about')
+        self.assertEqual(self.browser.title, 'About')
+        self.assertEqual(prefetcher.stats()['hits'], 1)
+
+    def test_miss(self):
+        prefetcher = self.browser.prefetch('//a[@rel="next"]/@href',
+                                           backend_factory=SiteBackend)
+        self.browser.go('http://host/page/1')
+        self.browser.parse()
+        self.browser.go('http://host/about')
+        self.assertEqual(self.browser.title, 'About')
+        self.assertNotEqual(self.browser.roundtrip, timedelta())
+        # the first page was asked for too
+        self.assertEqual(prefetcher.stats()['misses'], 2)
+
+    def test_given_once(self):
+        prefetcher = Prefetcher(backend_factory=SiteBackend)
+        prefetcher.add('http://host/about')
+        self.assertEqual(prefetcher.take('http://host/about').http_code, 200)
+        self.assertEqual(prefetcher.take('http://host/about'), None)
+        prefetcher.close()
+
+    def test_budget(self):
+        prefetcher = Prefetcher(concurrency=1, max_pages=2,
+                                backend_factory=lambda: SiteBackend(0))
+        for i in range(1, PAGES + 1):
+            prefetcher.add('http://host/page/%d' % i)
+            time.sleep(0.05)
+        stats = prefetcher.stats()
+        self.assertEqual(stats['pages'], 2)
+        self.assertEqual(stats['wasted'], PAGES - 2)
+        # the oldest were evicted
+        self.assertEqual(prefetcher.take('http://host/page/1'), None)
+        self.assertNotEqual(prefetcher.take('http://host/page/4'), None)
+        prefetcher.close()
+
+        prefetcher = Prefetcher(max_bytes=10, backend_factory=SiteBackend)
+        prefetcher.add('http://host/about')
+        time.sleep(0.2)
+        self.assertEqual(prefetcher.take('http://host/about'), None)
+        prefetcher.close()
+
+    def test_close_prompt(self):
+        """Closing neither waits for fetches nor starts those queued"""
+        prefetcher = Prefetcher(concurrency=1, max_pages=2,
+                                backend_factory=lambda: SiteBackend(0.2))
+        for i in range(1, PAGES):
+            prefetcher.add('http://host/page/%d' % i)
+        time.sleep(0.05)
+        with StopWatch() as sw:
+            prefetcher.close()
+        self.assertTrue(sw.total < timedelta(seconds=0.1))
+        time.sleep(0.3)
+        self.assertEqual(SiteBackend.calls, ['http://host/page/1'])
+
+    def test_take_while_busy(self):
+        """A page waiting for a busy thread isn't waited for"""
+        prefetcher = Prefetcher(concurrency=1,
+                                backend_factory=lambda: SiteBackend(0.3))
+        prefetcher.add('http://host/page/1')
+        prefetcher.add('http://host/page/2')
+        with StopWatch() as sw:
+            self.assertEqual(prefetcher.take('http://host/page/2'), None)
+        self.assertTrue(sw.total < timedelta(seconds=0.2))
+        prefetcher.close()
+
+    def test_expiry(self):
+        prefetcher = Prefetcher(ttl=0.05, backend_factory=lambda: SiteBackend(0))
+        prefetcher.add('http://host/about')
+        time.sleep(0.15)
+        self.assertEqual(prefetcher.take('http://host/about'), None)
+        self.assertEqual(prefetcher.stats()['wasted'], 1)
+        prefetcher.close()
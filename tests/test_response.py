@@ -0,0 +1,146 @@
+from unittest import TestCase
+import cPickle as pickle
+from pycurlbrowser import CurlBackend, RequestsBackend, MockBackend, MockResponse
+from pycurlbrowser.backend import Response, Headers
+from local_server import LocalServer
+
+class TestHeaders(TestCase):
+
+    """
+    Case-insensitive, multi-valued headers.
+    """
+
+    def setUp(self):
+        self.headers = Headers(lines=['HTTP/1.1 200 OK\r\n',
+                                      'Content-Type: text/html\r\n',
+                                      'Set-Cookie: a=1\r\n',
+                                      'X-Folded: one\r\n',
+                                      '\ttwo\r\n',
+                                      'set-cookie: b=2\r\n',
+                                      '\r\n'])
+
+    def test_lookup(self):
+        self.assertEqual(self.headers['content-type'], 'text/html')
+        self.assertEqual(self.headers.get('CONTENT-TYPE'), 'text/html')
+        self.assertEqual(self.headers.get('Location'), None)
+        self.assertTrue('x-folded' in self.headers)
+        self.assertEqual(self.headers['X-Folded'], 'one two')
+
+    def test_repeated(self):
+        self.assertEqual(self.headers.getall('Set-Cookie'), ['a=1', 'b=2'])
+        self.assertEqual(self.headers['Set-Cookie'], 'a=1, b=2')
+        self.assertEqual(self.headers.getall('Location'), [])
+        self.assertEqual(list(self.headers), ['Content-Type', 'Set-Cookie', 'X-Folded'])
+        self.assertEqual(len(self.headers.allitems()), 4)
+
+    def test_dict(self):
+        headers = Headers(dict(a='1'))
+        self.assertEqual(headers, {'a': '1'})
+        self.assertEqual(headers['A'], '1')
+        self.assertEqual(dict(pickle.loads(pickle.dumps(self.headers, 2))),
+                         dict(self.headers))
+
+    def test_response(self):
+        resp = Response(src=u'caf\xe9', headers={'a': '1'})
+        self.assertEqual(resp.content, 'caf\xc3\xa9')
+        self.assertEqual(resp.headers['A'], '1')
+        self.assertEqual(resp.history, [])
+
+    def test_lazy_src(self):
+        """src is decoded on first reading, and only then"""
+        decoded = []
+        def decode():
+            decoded.append(True)
+            return u'caf\xe9'
+        resp = Response(content='caf\xc3\xa9', decode=decode)
+        self.assertEqual(resp.content, 'caf\xc3\xa9')
+        self.assertEqual(decoded, [])
+        self.assertEqual(resp.src, u'caf\xe9')
+        self.assertEqual(resp.src, u'caf\xe9')
+        self.assertEqual(decoded, [True])
+        resp.src = 'replaced'
+        self.assertEqual(resp.src, 'replaced')
+
+class TestMockResponse(TestCase):
+
+    """
+    go() returns a Response, recording the redirects followed.
+    """
+
+    def test_history(self):
+        backend = MockBackend()
+        hop = MockResponse()
+        hop.http_code = 302
+        hop.headers = {'Location': 'http://host/b'}
+        hop.redirect = 'http://host/b'
+        backend.responses.add(hop, 'http://host/a')
+        page = MockResponse()
+        page.src = 'b'
+        backend.responses.add(page, 'http://host/b')
+
+        resp = backend.go('http://host/a', 'GET', None, None, None, True, None, 0, False)
+        self.assertEqual((resp.url, resp.http_code, resp.src), ('http://host/b', 200, 'b'))
+        self.assertEqual([(h.url, h.http_code) for h in resp.history],
+                         [('http://host/a', 302)])
+        self.assertEqual(backend.headers, {})
+
+class TestCurlResponse(TestCase):
+
+    """
+    Headers and redirect history from curl.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.backend = CurlBackend()
+
+    def go(self, path):
+        return self.backend.go(self.server.base + path, 'GET', None, None, None,
+                               True, 'test', 0, False)
+
+    def test_headers(self):
+        resp = self.go('/page?cookies=2')
+        self.assertTrue(resp.headers is self.backend.headers)
+        self.assertEqual(resp.headers.getall('set-cookie'), ['c0=0', 'c1=1'])
+        self.assertEqual(resp.headers['x-path'], '/page?cookies=2')
+        self.assertEqual(resp.content, resp.src)
+
+    def test_history(self):
+        resp = self.go('/page?redirects=2')
+        self.assertEqual(resp.http_code, 200)
+        self.assertEqual([h.http_code for h in resp.history], [302, 302])
+        self.assertEqual([h.url for h in resp.history],
+                         [self.server.base + '/page?redirects=2',
+                          self.server.base + '/page?redirects=1'])
+        # only the final response's headers
+        self.assertEqual(resp.headers.getall('X-Path'), ['/page?redirects=0'])
+        self.assertEqual(resp.history[0].headers['Location'], '/page?redirects=1')
+
+    def test_no_redirects(self):
+        self.assertEqual(self.go('/page').history, [])
+
+class TestRequestsResponse(TestCurlResponse):
+
+    """
+    Headers and redirect history from Requests, with src decoded lazily.
+    """
+
+    def setUp(self):
+        self.backend = RequestsBackend()
+
+    def test_headers(self):
+        resp = self.go('/page?cookies=2')
+        self.assertEqual(resp.headers.getall('set-cookie'), ['c0=0', 'c1=1'])
+        self.assertEqual(resp.headers['x-path'], '/page?cookies=2')
+        self.assertTrue(resp._decode is not None)
+        self.assertEqual(resp.content, 'path: /page?cookies=2')
+        self.assertEqual(resp.src, u'path: /page?cookies=2')
+        self.assertEqual(resp._decode, None)
@@ -1,6 +1,16 @@
 from unittest import TestCase
-from pycurlbrowser import RestClient, RestClientJson, MockBackend, MockResponse
+from pycurlbrowser import RestClient, RestClientJson, MockBackend, MockResponse, CurlBackend, CurlMultiBackend, CachingBackend
+from pycurlbrowser.rest_client import StatusClientError
+from pycurlbrowser.codec import JsonCodec
+from pycurlbrowser.backend.base import Response, sink_writer
+from pycurlbrowser.backend.util import StopWatch
+from local_server import LocalServer
+from datetime import timedelta
 from urllib import urlencode
+from StringIO import StringIO
+import sys
+import time
+import threading
 
 class TestRest(TestCase):
 
@@ -191,3 +201,369 @@ class TestJsonRest(TestCase):
 
         # Act, Assert
         self.assertEqual(self.client.delete('object', uid), expected)
+
+class TestRestBulk(TestCase):
+
+    """
+    Bulk operations, over the mock backend.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.client = RestClientJson('http://mocked', backend=self.backend)
+
+    def respond(self, src, uid=None, method='GET', data=None, headers=None, http_code=200):
+        mock = MockResponse()
+        mock.http_code = http_code
+        mock.src = src
+        url = 'http://mocked/object' + ('/%s' % uid if uid is not None else '')
+        self.backend.responses.add(mock, url, method, data, headers)
+
+    def test_get_many(self):
+        self.respond('{"uid": 1}', 1)
+        self.respond('', 2, http_code=404)
+        results = self.client.get_many('object', [1, 2, 3])
+        self.assertEqual(results[0], {'uid': 1})
+        self.assertTrue(isinstance(results[1], StatusClientError))
+        self.assertTrue(isinstance(results[2], LookupError))
+
+    def test_post_many(self):
+        headers = {'Content-Type': 'text/json'}
+        self.respond('1', method='POST', data='{"a": 1}', headers=headers)
+        self.respond('2', method='POST', data='{"a": 2}', headers=headers)
+        self.assertEqual(self.client.post_many('object', [dict(a=1), dict(a=2)]), [1, 2])
+
+    def test_put_and_delete_many(self):
+        self.respond('"put"', 1, 'PUT', '{"a": 1}', {'Content-Type': 'text/json'})
+        self.respond('', 1, 'DELETE')
+        self.assertEqual(self.client.put_many('object', [(1, dict(a=1))]), ['put'])
+        self.assertEqual(self.client.delete_many('object', [1]), [None])
+
+    def test_as_completed(self):
+        self.respond('"one"', 1)
+        self.respond('"two"', 2)
+        self.assertEqual(sorted(self.client.get_many('object', [1, 2], as_completed=True)),
+                         [(0, 'one'), (1, 'two')])
+
+class TestRestBulkConcurrent(TestCase):
+
+    """
+    Bulk operations run concurrently over a CurlMultiBackend.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_concurrent(self):
+        client = RestClient(self.server.base, backend=CurlMultiBackend())
+        with StopWatch() as sw:
+            results = client.put_many('object', [('%d?latency=0.2' % i, 'x') for i in range(10)],
+                                      concurrency=10)
+        self.assertEqual(results, ['path: /object/%d?latency=0.2' % i for i in range(10)])
+        self.assertTrue(sw.total < timedelta(seconds=1))
+
+    def test_sequential_page_kept(self):
+        client = RestClient(self.server.base, backend=CurlBackend())
+        client.get('object', 0)
+        self.assertEqual(client.put_many('object', [(1, 'x'), (2, 'y')]),
+                         ['path: /object/1', 'path: /object/2'])
+        self.assertEqual((client.url, client.src),
+                         ('%s/object/0' % self.server.base, 'path: /object/0'))
+
+    def test_status_errors(self):
+        client = RestClient(self.server.base, backend=CurlMultiBackend())
+        results = client.delete_many('404', [1, 2], concurrency=1)
+        self.assertTrue(all(isinstance(r, StatusClientError) for r in results))
+
+class ReversedCodec(JsonCodec):
+
+    """
+    A stand-in for a binary codec: JSON, backwards
+    """
+
+    content_type = 'application/x-reversed'
+    media_types = ('application/x-reversed',)
+
+    def dumps(self, data):
+        return JsonCodec.dumps(self, data)[::-1]
+
+    def loads(self, src):
+        return JsonCodec.loads(self, src[::-1])
+
+class TestRestCodec(TestCase):
+
+    """
+    Codecs, and negotiating one with the server.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.reversed = ReversedCodec()
+        self.client = RestClientJson('http://mocked', backend=self.backend,
+                                     accept=[self.reversed, JsonCodec()])
+
+    def respond(self, src, method, data, content_type):
+        mock = MockResponse()
+        mock.src = src
+        mock.headers = {'Content-Type': content_type}
+        headers = {'Accept': self.client.negotiator.accept_header}
+        if data is not None:
+            headers['Content-Type'] = content_type
+        self.backend.responses.add(mock, 'http://mocked/object', method, data,
+                                   headers)
+
+    def test_positional(self):
+        """Arguments after base are still Browser's"""
+        client = RestClientJson('http://mocked', None, self.backend)
+        self.assertTrue(client.backend is self.backend)
+
+    def test_cached(self):
+        """Responses are read whole, so they can be cached"""
+        mock = MockResponse()
+        mock.src = '{"a": 1}'
+        mock.headers = {'Content-Type': 'application/json',
+                        'Cache-Control': 'max-age=60'}
+        self.backend.responses.add(mock, 'http://mocked/object')
+        client = RestClientJson('http://mocked',
+                                backend=CachingBackend(self.backend))
+        self.assertEqual(client.get('object'), {'a': 1})
+        self.assertEqual(client.get('object'), {'a': 1})
+        self.assertEqual(client.backend.status, 'hit')
+
+    def test_content_type(self):
+        client = RestClientJson('http://mocked', backend=self.backend,
+                                codec=JsonCodec(content_type='application/json'))
+        mock = MockResponse()
+        mock.src = '{"uid": 1}'
+        self.backend.responses.add(mock, 'http://mocked/object', 'POST', '{"a": 1}',
+                                   {'Content-Type': 'application/json'})
+        self.assertEqual(client.post('object', dict(a=1)), {'uid': 1})
+
+    def test_accept(self):
+        self.assertEqual(self.client.negotiator.accept_header,
+                         'application/x-reversed, application/json;q=0.9, text/json;q=0.9')
+
+    def test_upgrade(self):
+        self.assertEqual(self.client.negotiator.current.content_type, 'text/json')
+        self.respond('[1, 2]', 'GET', None, 'application/json; charset=utf-8')
+        self.assertEqual(self.client.get('object'), [1, 2])
+        self.assertEqual(self.client.negotiator.current.content_type, 'text/json')
+
+        self.backend.responses = type(self.backend.responses)()
+        self.respond(']2 ,1[', 'GET', None, 'application/x-reversed')
+        self.assertEqual(self.client.get('object'), [1, 2])
+        self.assertTrue(self.client.negotiator.current is self.reversed)
+
+        self.respond('}1 :"a"{', 'POST', '}1 :"a"{', 'application/x-reversed')
+        self.assertEqual(self.client.post('object', dict(a=1)), {'a': 1})
+
+class SlowMockBackend(MockBackend):
+
+    """
+    A mock backend taking a while over each request.
+    """
+
+    def go(self, *args, **kwargs):
+        time.sleep(0.1)
+        return super(SlowMockBackend, self).go(*args, **kwargs)
+
+class StallingBackend(MockBackend):
+
+    """
+    A mock backend streaming the start of a body, then stalling.
+    """
+
+    def go(self, url, method, data, headers, auth, follow, agent, retries, debug, sink=None):
+        write = sink_writer(sink)
+        write('[1, ')
+        time.sleep(1)
+        write('2]')
+        return Response(url=url, http_code=200)
+
+class TestRestIterate(TestCase):
+
+    """
+    Iterating over paginated listings.
+    """
+
+    def setUp(self):
+        self.backend = SlowMockBackend()
+        self.client = RestClientJson('http://mocked', backend=self.backend)
+
+    def respond(self, url, src, headers=None):
+        mock = MockResponse()
+        mock.src = src
+        mock.headers = headers or {}
+        self.backend.responses.add(mock, url)
+
+    def test_link(self):
+        self.respond('http://mocked/object', '[1, 2]',
+                     {'Link': '<http://mocked/object?page=2>; rel="next", <http://mocked/object?page=9>; rel="last"'})
+        self.respond('http://mocked/object?page=2', '[3]')
+        self.assertEqual(list(self.client.iterate('object')), [1, 2, 3])
+
+    def test_next(self):
+        self.respond('http://mocked/object', '{"results": [1], "next": "/object?page=2"}')
+        self.respond('http://mocked/object?page=2', '{"results": [2], "next": null}')
+        self.assertEqual(list(self.client.iterate('object')), [1, 2])
+
+    def test_cursor(self):
+        self.respond('http://mocked/object?q=x', '{"items": [1], "next_cursor": "abc"}')
+        self.respond('http://mocked/object?q=x&cursor=abc', '{"items": [2]}')
+        self.assertEqual(list(self.client.iterate('object', params=dict(q='x'))), [1, 2])
+
+    def test_offset(self):
+        self.respond('http://mocked/object?limit=2&offset=0', '{"data": [1, 2]}')
+        self.respond('http://mocked/object?limit=2&offset=2', '{"data": [3]}')
+        self.assertEqual(list(self.client.iterate('object', style='offset', limit=2,
+                                                  prefetch=0)), [1, 2, 3])
+
+    def test_error(self):
+        self.respond('http://mocked/object', '[1]', {'Link': '</missing>; rel=next'})
+        items = self.client.iterate('object')
+        self.assertEqual(items.next(), 1)
+        self.assertRaises(LookupError, items.next)
+
+    def test_prefetch(self):
+        for page in range(1, 4):
+            self.respond('http://mocked/object?page=%d' % page,
+                         '{"items": [%d], "next": "?page=%d"}' % (page, page + 1))
+        self.respond('http://mocked/object?page=4', '[]')
+
+        def consume(prefetch):
+            with StopWatch() as sw:
+                for item in self.client.iterate('object', params=dict(page=1),
+                                                prefetch=prefetch):
+                    time.sleep(0.1)
+            return sw.total
+
+        self.assertTrue(consume(0) >= timedelta(seconds=0.7))
+        self.assertTrue(consume(1) < timedelta(seconds=0.6))
+
+    def test_abandoned(self):
+        """Closing waits for the page being prefetched"""
+        self.respond('http://mocked/object', '{"items": [1], "next": "/object"}')
+        before = set(threading.enumerate())
+        items = self.client.iterate('object', prefetch=2)
+        self.assertEqual(items.next(), 1)
+        items.close()
+        self.assertEqual(set(threading.enumerate()) - before, set())
+
+    def test_current_page_kept(self):
+        self.respond('http://mocked/other', '{"other": true}')
+        self.respond('http://mocked/object', '[1, 2]')
+        self.assertEqual(self.client.get('other'), {'other': True})
+        self.assertEqual(list(self.client.iterate('object')), [1, 2])
+        self.assertEqual(self.client.url, 'http://mocked/other')
+        self.assertEqual(self.backend.url, 'http://mocked/other')
+
+class TestRestStream(TestCase):
+
+    """
+    Streaming the items of big JSON arrays.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.client = RestClientJson('http://mocked', backend=self.backend)
+
+    def respond(self, src, http_code=200):
+        mock = MockResponse()
+        mock.src = src
+        mock.http_code = http_code
+        self.backend.responses.add(mock, 'http://mocked/object')
+
+    def test_stream(self):
+        self.respond('[{"a": 1}, "two", 3]')
+        self.assertEqual(list(self.client.stream('object')), [{'a': 1}, 'two', 3])
+
+    def test_path(self):
+        self.respond('{"count": 2, "data": {"items": [1, 2]}}')
+        self.assertEqual(list(self.client.stream('object', path='data.items')), [1, 2])
+
+    def test_status(self):
+        self.respond('{"error": "missing"}', 404)
+        self.assertRaises(StatusClientError, list, self.client.stream('object'))
+
+    def test_truncated(self):
+        self.respond('[1, 2')
+        self.assertRaises(ValueError, list, self.client.stream('object'))
+
+    def test_abandon(self):
+        """Closing stops the download, and waits for it"""
+        self.respond('[1, 2, 3, 4]')
+        before = set(threading.enumerate())
+        items = self.client.stream('object', buffer=1)
+        self.assertEqual(items.next(), 1)
+        items.close()
+        self.assertEqual(set(threading.enumerate()) - before, set())
+
+    def test_abandon_stalled(self):
+        """A stalled download is waited for no longer than abandon_timeout"""
+        client = RestClientJson('http://mocked', backend=StallingBackend())
+        client.abandon_timeout = 0.1
+        items = client.stream('object')
+        self.assertEqual(items.next(), 1)
+        with StopWatch() as sw:
+            items.close()
+        self.assertTrue(sw.total < timedelta(seconds=0.5))
+
+class TestRestStreamConcurrent(TestCase):
+
+    """
+    Items arrive before the download ends, and an abandoned stream stops it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_early_items(self):
+        from pycurlbrowser.json_stream import JsonItemDecoder
+        decoder = JsonItemDecoder()
+        self.assertEqual(decoder.feed('[1, 2, {"a'), [1, 2])
+        self.assertEqual(decoder.feed('": 3}'), [{'a': 3}])
+        self.assertEqual(decoder.feed(']'), [])
+        decoder.close()
+
+    def test_stream(self):
+        client = RestClientJson(self.server.base, backend=CurlBackend())
+        self.assertEqual(sum(client.stream('list?items=100000&chunked=1')),
+                         sum(range(100000)))
+
+    def quietly(self, fn, *args):
+        """Call fn, returning what it wrote to stderr"""
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            fn(*args)
+        finally:
+            stderr, sys.stderr = sys.stderr, stderr
+        return stderr.getvalue()
+
+    def test_abandon(self):
+        client = RestClientJson(self.server.base, backend=CurlBackend())
+        client.go('page', 'GET')
+        items = client.stream('list?items=1000000&chunked=1', buffer=10)
+        self.assertEqual([items.next() for _ in range(5)], range(5))
+        # the download is aborted without curl reporting the abandonment
+        self.assertFalse('StreamAbandoned' in self.quietly(items.close))
+        # the download left the current page alone
+        self.assertEqual(client.src, 'path: /page')
+
+    def test_decode_error(self):
+        """Errors decoding the body are raised as themselves"""
+        client = RestClientJson(self.server.base, backend=CurlBackend())
+        output = self.quietly(self.assertRaises, ValueError, list,
+                              client.stream('plain'))
+        self.assertFalse('Traceback' in output)
@@ -0,0 +1,122 @@
+from unittest import TestCase
+from email.utils import formatdate
+import time
+import pycurl
+from pycurlbrowser import CurlBackend, CurlMultiBackend, RequestsBackend, Hooks
+from pycurlbrowser.backend import RetryPolicy, RetryBudget
+from pycurlbrowser.backend.retry import retry_after
+from local_server import LocalServer
+
+class TestRetryPolicy(TestCase):
+
+    """
+    When, and after how long, to retry.
+    """
+
+    def setUp(self):
+        self.budget = RetryBudget(ratio=0.5, reserve=2)
+        self.policy = RetryPolicy(backoff=1, jitter=False, budget=self.budget)
+
+    def test_backoff(self):
+        delays = [self.policy.retry('GET', attempt, exception=Exception())
+                  for attempt in (1, 2)]
+        self.assertEqual(delays, [1, 2])
+
+    def test_jitter(self):
+        policy = RetryPolicy(backoff=1, budget=RetryBudget(reserve=100))
+        for attempt in range(1, 20):
+            self.assertTrue(0 <= policy.retry('GET', attempt, exception=Exception()) <= 10)
+
+    def test_idempotency(self):
+        self.assertEqual(self.policy.retry('POST', 1, exception=Exception()), None)
+        self.assertEqual(self.policy.retry('POST', 1, exception=Exception(),
+                                           connect_failed=True), 1)
+        self.assertEqual(self.policy.retry('POST', 1, http_code=503), None)
+
+    def test_statuses(self):
+        self.assertEqual(self.policy.retry('GET', 1, http_code=500), None)
+        self.assertEqual(self.policy.retry('GET', 1, http_code=503), 1)
+
+    def test_retry_after(self):
+        self.assertEqual(self.policy.retry('GET', 1, http_code=429,
+                                           headers={'Retry-After': '5'}), 5)
+        self.assertEqual(self.policy.retry('GET', 1, http_code=429,
+                                           headers={'Retry-After': '3600'}), None)
+        self.assertEqual(retry_after('soon'), None)
+        self.assertTrue(25 < retry_after(formatdate(time.time() + 30)) <= 30)
+
+    def test_budget(self):
+        for _ in range(2):
+            self.assertEqual(self.policy.retry('GET', 1, exception=Exception()), 1)
+        self.assertEqual(self.policy.retry('GET', 1, exception=Exception()), None)
+        self.assertEqual(self.budget.refused, 1)
+        for _ in range(2):
+            self.policy.started()
+        self.assertEqual(self.policy.retry('GET', 1, exception=Exception()), 1)
+
+    def test_delay_unpaid(self):
+        for _ in range(3):
+            self.assertEqual(self.policy.delay('GET', 1, http_code=503), 1)
+        self.assertEqual(self.policy.delay('GET', 1, http_code=404), None)
+        self.assertEqual((self.budget.retries, self.budget.refused), (0, 0))
+
+class RetryingBackend(object):
+
+    """
+    Retrying against a local server, for any backend.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.backend = self.backend_type()
+        self.backend.retry_policy = RetryPolicy(backoff=0.01,
+                                                budget=RetryBudget(reserve=100))
+        self.backend.hooks = Hooks()
+        self.retries = []
+        self.backend.hooks.subscribe('retry', lambda event, **details:
+                                              self.retries.append(details))
+
+    def go(self, path, method='GET', retries=3):
+        return self.backend.go(self.server.base + path, method, None, None,
+                               None, True, 'test', retries, False)
+
+    def test_status(self):
+        resp = self.go('/%s?fail=2' % self.backend_type.__name__)
+        self.assertEqual((resp.http_code, resp.src),
+                         (200, 'path: /%s?fail=2' % self.backend_type.__name__))
+        self.assertEqual([(r['attempt'], r['http_code'], r['delay'])
+                          for r in self.retries], [(1, 503, 0), (2, 503, 0)])
+
+    def test_out_of_retries(self):
+        resp = self.go('/%s/out?fail=2' % self.backend_type.__name__, retries=1)
+        self.assertEqual(resp.http_code, 503)
+
+    def test_not_idempotent(self):
+        resp = self.go('/%s/post?fail=1' % self.backend_type.__name__, 'POST')
+        self.assertEqual(resp.http_code, 503)
+        self.assertEqual(self.retries, [])
+
+    def test_connect_failed(self):
+        self.server.base, base = 'http://127.0.0.1:1', self.server.base
+        try:
+            self.assertRaises(Exception, self.go, '/', 'POST', 2)
+        finally:
+            self.server.base = base
+        self.assertEqual([r['attempt'] for r in self.retries], [1, 2])
+
+class TestCurlRetry(RetryingBackend, TestCase):
+    backend_type = CurlBackend
+
+class TestCurlMultiRetry(RetryingBackend, TestCase):
+    backend_type = CurlMultiBackend
+
+class TestRequestsRetry(RetryingBackend, TestCase):
+    backend_type = RequestsBackend
@@ -0,0 +1,109 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, CurlBackend, CurlMultiBackend, RequestsBackend, MockBackend, MockResponse
+from local_server import LocalServer
+from StringIO import StringIO
+import os
+import tempfile
+
+class StreamingTests(object):
+
+    """
+    Bodies streamed to a sink rather than kept in src.
+    """
+
+    size = 1024 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.url = '%s/bytes/%d' % (cls.server.base, cls.size)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_file(self):
+        sink = StringIO()
+        self.assertEqual(self.browser.go(self.url, sink=sink), 200)
+        self.assertEqual(sink.getvalue(), 'x' * self.size)
+        self.assertEqual(self.browser.src, None)
+
+    def test_callable(self):
+        chunks = []
+        self.browser.go(self.url, sink=chunks.append)
+        self.assertEqual(''.join(chunks), 'x' * self.size)
+
+    def test_generator(self):
+        received = []
+        def consumer():
+            while True:
+                received.append(len((yield)))
+        sink = consumer()
+        sink.next()
+        self.browser.go(self.url, sink=sink)
+        self.assertEqual(sum(received), self.size)
+
+    def test_not_streamed_after(self):
+        """A later request without a sink fills src again"""
+        self.browser.go(self.url, sink=StringIO())
+        self.browser.go(self.url)
+        self.assertEqual(len(self.browser.src), self.size)
+
+    def test_sink_raises(self):
+        """A sink's exception is raised as itself, and the backend recovers"""
+        def sink(chunk):
+            raise ValueError("enough")
+        self.assertRaises(ValueError, self.browser.go, self.url, sink=sink)
+        self.assertEqual(self.browser.go(self.server.base + '/again'), 200)
+
+    def test_save(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.assertEqual(self.browser.save(filename, self.url), 200)
+            with open(filename, 'rb') as fp:
+                self.assertEqual(fp.read(), 'x' * self.size)
+        finally:
+            os.unlink(filename)
+
+class TestCurlStreaming(StreamingTests, TestCase):
+
+    def setUp(self):
+        self.browser = Browser(backend=CurlBackend())
+
+class TestCurlMultiStreaming(StreamingTests, TestCase):
+
+    def setUp(self):
+        self.browser = Browser(backend=CurlMultiBackend())
+
+class TestRequestsStreaming(StreamingTests, TestCase):
+
+    def setUp(self):
+        self.browser = Browser(backend=RequestsBackend())
+
+    def test_closed_on_sink_error(self):
+        session = self.browser.backend._session
+        responses = []
+
+        def request(**kwargs):
+            responses.append(type(session).request(session, **kwargs))
+            return responses[-1]
+
+        session.request = request
+        def sink(chunk):
+            raise ValueError("enough")
+        self.assertRaises(ValueError, self.browser.go, self.url, sink=sink)
+        self.assertTrue(responses[0].raw.closed)
+
+class TestMockStreaming(TestCase):
+
+    def test_file(self):
+        backend = MockBackend()
+        mock = MockResponse()
+        mock.src = "streamed"
+        backend.responses.add(mock, 'url')
+        sink = StringIO()
+        browser = Browser(backend=backend)
+        browser.go('url', sink=sink)
+        self.assertEqual(sink.getvalue(), "streamed")
+        self.assertEqual(browser.src, None)
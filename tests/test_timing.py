@@ -0,0 +1,99 @@
+from unittest import TestCase
+from pycurlbrowser import Browser, CurlBackend, CurlMultiBackend, RequestsBackend, MockBackend, MockResponse
+from pycurlbrowser.backend.util import StopWatch, Timing
+from local_server import LocalServer
+from datetime import timedelta
+
+class TestTiming(TestCase):
+
+    """
+    The Timing record itself.
+    """
+
+    def test_stopwatch(self):
+        with StopWatch() as sw:
+            pass
+        self.assertTrue(isinstance(sw.total, timedelta))
+        self.assertTrue(sw.total >= timedelta(0))
+
+    def test_as_dict(self):
+        timing = Timing(total=timedelta(seconds=1.5), bytes_down=10)
+        self.assertEqual(timing.as_dict()['total'], 1.5)
+        self.assertEqual(timing.as_dict()['bytes_down'], 10)
+        self.assertEqual(timing.as_dict()['dns'], None)
+
+    def test_unknown(self):
+        self.assertRaises(TypeError, Timing, bogus=1)
+
+class BackendTimingTests(object):
+
+    """
+    Timings from real requests against a local server.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = LocalServer().start()
+        cls.url = '%s/bytes/1000' % cls.server.base
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_total(self):
+        self.browser.go(self.url)
+        self.assertTrue(self.browser.timing.total > timedelta(0))
+        self.assertTrue(self.browser.timing.first_byte is not None)
+
+class TestCurlTiming(BackendTimingTests, TestCase):
+
+    def setUp(self):
+        self.browser = Browser(backend=CurlBackend())
+
+    def test_phases(self):
+        self.browser.go(self.url)
+        timing = self.browser.timing
+        for phase in ('dns', 'connect', 'tls', 'first_byte', 'transfer',
+                      'redirect'):
+            self.assertTrue(getattr(timing, phase) >= timedelta(0))
+        self.assertTrue(timing.bytes_down > 1000)
+        self.assertTrue(timing.bytes_up > 0)
+
+class TestCurlMultiTiming(BackendTimingTests, TestCase):
+
+    def setUp(self):
+        self.browser = Browser(backend=CurlMultiBackend())
+
+class TestRequestsTiming(BackendTimingTests, TestCase):
+
+    def setUp(self):
+        self.browser = Browser(backend=RequestsBackend())
+
+class TestParseTiming(TestCase):
+
+    """
+    Browser adds parse time to the backend's timing.
+    """
+
+    def setUp(self):
+        self.backend = MockBackend()
+        self.browser = Browser(backend=self.backend)
+        page = MockResponse()
+        page.src = "<p>page</p>"
+        page.roundtrip = timedelta(seconds=2)
+        self.backend.responses.add(page, 'page')
+
+    def test_mock_total(self):
+        self.browser.go('page')
+        self.assertEqual(self.browser.timing.total, timedelta(seconds=2))
+        self.assertEqual(self.browser.timing.parse, None)
+
+    def test_parse(self):
+        self.browser.go('page')
+        self.browser.parse()
+        self.assertTrue(self.browser.timing.parse >= timedelta(0))
+
+    def test_incremental_parse(self):
+        self.browser.parse_incrementally = True
+        self.browser.go('page')
+        self.assertTrue(self.browser.timing.parse >= timedelta(0))